@@ -20,37 +20,31 @@ import os
 from pathlib import Path
 import argparse
 import logging
-import re
 import math
-import yaml
+import itertools
 import numpy as np
 import pandas as pd
 from bokeh.plotting import Figure, figure
-from caret_analyze import Lttng
+from bokeh.palettes import Category10
 from caret_analyze import Architecture, Application
-from caret_analyze.runtime.node import Node
-from caret_analyze.plot import Plot
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
-from common import utils
+from common import utils, results_db, profiler, node_metrics
+from common.catalog import Catalog, make_catalog
+from common.event_filter import make_package_event_filter
+from common.manifest import Manifest, make_common_inputs
+from common.stats_accumulator import StatsAccumulator
+from common.trace_cache import TraceCache, extract_callback_records
+from common.trace_stream import CallbackStream
 
 _logger: logging.Logger = None
+_callback_record_list_dict: dict[str, list[dict]] = None    # shared with worker processes in parallel mode
 
 
 def calcualte_stats(data: pd.DataFrame) -> dict:
-    """Calculate stats"""
-    stats = {
-        'avg': '-',
-        'min': '-',
-        'max': '-',
-        'std': '-',
-    }
-    if len(data) > 1:
-        stats['avg'] = float(data.mean())
-        stats['std'] = float(data.std())
-    if len(data) > 0:
-        stats['min'] = float(data.min())
-        stats['max'] = float(data.max())
-    return stats
+    """Calculate stats (percentiles are estimated in the same way as streaming mode)"""
+    accumulator = StatsAccumulator()
+    accumulator.add(np.asarray(data, dtype=float))
+    return accumulator.to_stats()
 
 
 def draw_histogram(data: pd.DataFrame, title: str, metrics_str: str) -> Figure:
@@ -67,6 +61,11 @@ def draw_histogram(data: pd.DataFrame, title: str, metrics_str: str) -> Figure:
         _logger.warning(f'len = 0: {title}')
         return None
     hist, bin_edges = _to_histogram(data, (max(data) - min(data)) / 30, False)
+    return make_histogram_figure(hist, bin_edges, title, metrics_str)
+
+
+def make_histogram_figure(hist: np.ndarray, bin_edges: np.ndarray, title: str, metrics_str: str) -> Figure:
+    """Make histogram graph from bins"""
     figure_hist = figure(plot_width=600, plot_height=400, active_scroll='wheel_zoom', title=title,
                          x_axis_label=metrics_str, y_axis_label='Count')
     figure_hist.quad(top=hist, bottom=0, left=bin_edges[:-1], right=bin_edges[1:],
@@ -77,111 +76,247 @@ def draw_histogram(data: pd.DataFrame, title: str, metrics_str: str) -> Figure:
 def analyze_callback(callback_name: str, callback_displayname: str, metrics_str: str,
                      data: pd.DataFrame, metrics: str, dest_dir_path: str):
     """Analyze a callback"""
-    callack_stats = calcualte_stats(data)
-    figure_hist = draw_histogram(data, callback_displayname, metrics_str)
+    with profiler.stage('stats_histogram'):
+        callack_stats = calcualte_stats(data)
+        figure_hist = draw_histogram(data, callback_displayname, metrics_str)
     if figure_hist:
         filename_hist = f"{metrics}{callback_name.replace('/', '_')}_hist"[:250]
-        utils.export_graph(figure_hist, dest_dir_path, filename_hist, _logger)
+        utils.export_graph(figure_hist, dest_dir_path, filename_hist, callback_displayname, _logger)
         callack_stats['filename_hist'] = filename_hist
     else:
         callack_stats['filename_hist'] = ''
     return callack_stats
 
 
-def analyze_node(node: Node, dest_dir: str) -> dict:
-    """Analyze a node"""
-    all_metrics_dict = {'Frequency': Plot.create_callback_frequency_plot,
-                        'Period': Plot.create_callback_period_plot,
-                        'Latency': Plot.create_callback_latency_plot}
+def draw_timeseries(node_name: str, metrics_str: str, line_list: list[tuple[str, np.ndarray, np.ndarray]]) -> Figure:
+    """Draw timeseries graph of callbacks in a node (line_list has displayname, time [sec] and value of each callback)"""
+    p_timeseries = figure(frame_width=1000, frame_height=350, active_scroll='wheel_zoom', title=node_name,
+                          x_axis_label='Time [sec]', y_axis_label=metrics_str)
+    p_timeseries.y_range.start = 0
+    for (callback_displayname, time_list, value_list), color in zip(line_list, itertools.cycle(Category10[10])):
+        p_timeseries.line(time_list, value_list, legend_label=callback_displayname, line_color=color)
+    return p_timeseries
+
+
+def analyze_node(node_name: str, callback_record_list: list[dict], dest_dir: str) -> dict:
+    """Analyze a node. All metrics are calculated from callback records of the node (made by extract_callback_records)"""
+    called_record_list = [record for record in callback_record_list if len(record['start_timestamps']) > 0]
+    if len(called_record_list) == 0:
+        _logger.warning(f'This node is not called: {node_name}')
+        return None
+    time_origin = min([int(record['start_timestamps'][0]) for record in called_record_list])
+    with profiler.stage('node_metrics'):
+        metrics_list = node_metrics.calc_node_metrics(callback_record_list)
+
     node_stats = {}
     node_stats['filename_timeseries'] = {}
     node_stats['callbacks'] = {}
-
-    for metrics, method in all_metrics_dict.items():
-        p_timeseries = method(node)
-        filename_timeseries = metrics + node.node_name.replace('/', '_')[:250]
-        try:
-            measurement = p_timeseries.to_dataframe()
-            p_timeseries = p_timeseries.show(export_path='dummy.html')
-            p_timeseries.frame_width = 1000
-            p_timeseries.frame_height = 350
-            p_timeseries.y_range.start = 0
-            utils.export_graph(p_timeseries, dest_dir, filename_timeseries, _logger)
-            node_stats['filename_timeseries'][metrics] = filename_timeseries
-        except:
-            _logger.warning(f'This node is not called: {node.node_name}')
-            return None
-
-        for callback_info in measurement.iteritems():
-            callback_name = callback_info[0][0]
-            metrics_str = callback_info[0][1]
-            if 'callback_start_timestamp' in metrics_str:
-                continue
-            callback_displayname = callback_name.split('/')[-1] + ': '
-            callback_displayname += utils.make_callback_displayname(node.get_callback(callback_name))
-            data = callback_info[1].dropna()
-            data = data[:-2]    # remove the last data because freq becomes small
+    for metrics, metrics_str in node_metrics.METRICS_STR_DICT.items():
+        line_list = []
+        for record, callback_metrics in zip(callback_record_list, metrics_list):
+            callback_name = record['callback_name']
+            callback_displayname = callback_name.split('/')[-1] + ': ' + record['callback_displayname']
+            timestamp_list, value_list = callback_metrics[metrics]
+            if len(timestamp_list) > 0:
+                line_list.append((callback_displayname, (timestamp_list - time_origin) * 1e-9, value_list))
+            if metrics == 'Frequency':
+                value_list = value_list[:-2]    # remove the last data because freq becomes small
             callack_stats = analyze_callback(callback_name, callback_displayname,
-                                             metrics_str, data, metrics, dest_dir)
+                                             metrics_str, value_list, metrics, dest_dir)
             node_stats['callbacks'].setdefault(callback_name, {})
             node_stats['callbacks'][callback_name][metrics] = callack_stats
             node_stats['callbacks'][callback_name]['displayname'] = callback_displayname
 
+        with profiler.stage('create_plot'):
+            p_timeseries = draw_timeseries(node_name, metrics_str, line_list)
+        filename_timeseries = metrics + node_name.replace('/', '_')[:250]
+        utils.export_graph(p_timeseries, dest_dir, filename_timeseries, node_name, _logger)
+        node_stats['filename_timeseries'][metrics] = filename_timeseries
+
     return node_stats
 
 
-def analyze_package(node_list: list[Node], dest_dir: str):
-    """Analyze a package"""
-    utils.make_destination_dir(dest_dir, False, _logger)
+def analyze_callback_stream(callback_name: str, callback_displayname: str, metrics_str: str,
+                            stats_accumulator: StatsAccumulator, metrics: str, dest_dir_path: str):
+    """Analyze a callback using statistics accumulated chunk by chunk"""
+    callack_stats = stats_accumulator.to_stats()
+    if stats_accumulator.count == 0:
+        _logger.warning(f'len = 0: {callback_displayname}')
+        callack_stats['filename_hist'] = ''
+        return callack_stats
+    hist, bin_edges = stats_accumulator.to_histogram()
+    figure_hist = make_histogram_figure(hist, bin_edges, callback_displayname, metrics_str)
+    filename_hist = f"{metrics}{callback_name.replace('/', '_')}_hist"[:250]
+    utils.export_graph(figure_hist, dest_dir_path, filename_hist, callback_displayname, _logger)
+    callack_stats['filename_hist'] = filename_hist
+    return callack_stats
 
-    stats = {}
-    for node in node_list:
-        node_stats = analyze_node(node, dest_dir)
-        if node_stats:
-            stats[node.node_name] = node_stats
 
-    stat_file_path = f"{dest_dir}/stats_node.yaml"
-    with open(stat_file_path, 'w', encoding='utf-8') as f_yaml:
-        yaml.safe_dump(stats, f_yaml, encoding='utf-8', allow_unicode=True, sort_keys=False)
+def analyze_node_stream(node_name: str, callback_list: list[dict], dest_dir: str) -> dict:
+    """Analyze a node using statistics accumulated chunk by chunk (see trace_stream.CallbackStream)"""
+    node_stats = {}
+    node_stats['filename_timeseries'] = {}
+    node_stats['callbacks'] = {}
+    callback_list = [callback for callback in callback_list if callback['frequency'].origin is not None]
+    if len(callback_list) == 0:
+        _logger.warning(f'This node is not called: {node_name}')
+        return None
+    time_origin = min([callback['frequency'].origin for callback in callback_list])
+
+    for metrics, metrics_str in node_metrics.METRICS_STR_DICT.items():
+        line_list = []
+        for callback in callback_list:
+            callback_name = callback['callback_name']
+            callback_displayname = callback_name.split('/')[-1] + ': ' + callback['callback_displayname']
+            time_bin = callback[metrics.lower()]
+            if metrics == 'Frequency':
+                value_list = time_bin.to_frequency()[1]
+                # remove the last data because freq becomes small
+                callack_stats = analyze_callback(callback_name, callback_displayname, metrics_str,
+                                                 pd.Series(value_list[:-2]), metrics, dest_dir)
+            else:
+                value_list = time_bin.to_average()
+                callack_stats = analyze_callback_stream(callback_name, callback_displayname, metrics_str,
+                                                        callback[f'{metrics.lower()}_stats'], metrics, dest_dir)
+            line_list.append((callback_displayname, (time_bin.window_start_list - time_origin) * 1e-9, value_list))
+            node_stats['callbacks'].setdefault(callback_name, {})
+            node_stats['callbacks'][callback_name][metrics] = callack_stats
+            node_stats['callbacks'][callback_name]['displayname'] = callback_displayname
+
+        p_timeseries = draw_timeseries(node_name, metrics_str, line_list)
+        filename_timeseries = metrics + node_name.replace('/', '_')[:250]
+        utils.export_graph(p_timeseries, dest_dir, filename_timeseries, node_name, _logger)
+        node_stats['filename_timeseries'][metrics] = filename_timeseries
+
+    return node_stats
+
+
+def save_stats(stats: dict, dest_dir: str):
+    """Save stats of a package (dest_dir is {report_dir}/node/{package_name})"""
+    with results_db.ResultsDb(str(Path(dest_dir).parents[1])) as db:
+        db.save_node_stats(Path(dest_dir).name, stats)
+    results_db.export_yaml(stats, f'{dest_dir}/stats_node.yaml')
 
 
+def analyze_package(node_name_list: list[str], callback_record_list_dict: dict[str, list[dict]], dest_dir: str,
+                    package_name: str, manifest: Manifest):
+    """Analyze a package"""
+    utils.make_destination_dir(dest_dir, False, _logger, True)
 
+    stats = {}
+    for node_name in node_name_list:
+        inputs = {'package_name': package_name, 'node_name': node_name}
+        is_found, node_stats = manifest.lookup(f'{package_name}/{node_name}', inputs)
+        if not is_found:
+            with profiler.item('node', node_name):
+                node_stats = analyze_node(node_name, callback_record_list_dict.get(node_name, []), dest_dir)
+            manifest.update(f'{package_name}/{node_name}', inputs, node_stats, package_name)
+        if node_stats:
+            stats[node_name] = node_stats
+
+    save_stats(stats, dest_dir)
+
+
+def analyze_node_in_worker(task: tuple[str, str, str]) -> tuple[dict, dict]:
+    """Analyze a node in worker process. Records of profiler are returned with the result"""
+    _, node_name, dest_dir = task
+    with profiler.item('node', node_name):
+        node_stats = analyze_node(node_name, _callback_record_list_dict.get(node_name, []), dest_dir)
+    return node_stats, profiler.pop_records()
+
+
+def analyze_package_list_parallel(node_name_list_dict: dict[str, list[str]],
+                                  callback_record_list_dict: dict[str, list[dict]], dest_dir: str, jobs: int,
+                                  manifest: Manifest):
+    """Analyze all packages using process pool. Nodes in all packages are distributed to workers"""
+    task_list = []
+    for package_name, node_name_list in node_name_list_dict.items():
+        utils.make_destination_dir(f'{dest_dir}/{package_name}', False, _logger, True)
+        task_list.extend([(package_name, node_name, f'{dest_dir}/{package_name}')
+                          for node_name in node_name_list])
+
+    # Only nodes whose inputs are changed from the previous run are analyzed
+    node_stats_dict = {}
+    task_to_run_list = []
+    for task in task_list:
+        package_name, node_name, _ = task
+        is_found, node_stats = manifest.lookup(f'{package_name}/{node_name}',
+                                               {'package_name': package_name, 'node_name': node_name})
+        if is_found:
+            node_stats_dict[task] = node_stats
+        else:
+            task_to_run_list.append(task)
+    # Callback records are shared with forked worker processes (not pickled)
+    global _callback_record_list_dict
+    _callback_record_list_dict = callback_record_list_dict
+    result_list = utils.run_in_process_pool(analyze_node_in_worker, task_to_run_list, jobs, _logger)
+    for task, result in zip(task_to_run_list, result_list):
+        package_name, node_name, _ = task
+        if result is None:
+            # Failed in worker process (logged). It's analyzed again in the next run
+            node_stats_dict[task] = None
+            continue
+        node_stats, profile_records = result
+        profiler.merge_records(profile_records)
+        node_stats_dict[task] = node_stats
+        manifest.update(f'{package_name}/{node_name}',
+                        {'package_name': package_name, 'node_name': node_name}, node_stats, package_name)
+
+    # Merge results in the same order as serial execution
+    stats_dict = {package_name: {} for package_name in node_name_list_dict}
+    for task in task_list:
+        package_name, node_name, _ = task
+        if node_stats_dict[task]:
+            stats_dict[package_name][node_name] = node_stats_dict[task]
+    for package_name, stats in stats_dict.items():
+        save_stats(stats, f'{dest_dir}/{package_name}')
+
+
+def analyze(args, arch: Architecture, callback_record_list: list[dict], dest_dir: str, catalog: Catalog):
+    """Analyze All using callback records (trace data is not needed)"""
+    arch.export(dest_dir + '/architecture.yaml', force=True)
+    with results_db.ResultsDb(str(Path(dest_dir).parent)) as db:
+        db.clear_node_stats()
 
+    callback_record_list_dict: dict[str, list[dict]] = {}
+    for callback_record in callback_record_list:
+        callback_record_list_dict.setdefault(callback_record['node_name'], []).append(callback_record)
 
-def get_node_list(lttng: Lttng, app: Application,
-                  prefix_regexp: dict, ignore_list: list[str]) -> list[Node]:
-    """Get node list"""
-    target_node_name_list = []
-    for node in lttng.get_nodes():
-        node_name = node.node_name
-        if re.search(prefix_regexp, node_name):
-            is_match = True
-            for ignore in ignore_list:
-                if re.search(ignore, node_name):
-                    is_match = False
-                    break
-            if is_match:
-                target_node_name_list.append(node_name)
-    target_node_name_list.sort()
-    node_list = []
-    for node_name in target_node_name_list:
-        node_list.append(app.get_node(node_name))
+    # Nodes in trace data are indexed in the catalog. Nodes in records are used if it's not indexed
+    node_name_list = catalog.node_name_list if catalog.is_indexed else list(callback_record_list_dict.keys())
+    node_name_list_dict = {package_name: catalog.get_node_name_list(package_name, node_name_list)
+                           for package_name in catalog.package_dict}
 
-    return node_list
+    manifest = Manifest(dest_dir, make_common_inputs(args), args.incremental, _logger)
+    if args.jobs > 1:
+        analyze_package_list_parallel(node_name_list_dict, callback_record_list_dict, dest_dir, args.jobs, manifest)
+    else:
+        for package_name, node_name_list in node_name_list_dict.items():
+            analyze_package(node_name_list, callback_record_list_dict, f'{dest_dir}/{package_name}',
+                            package_name, manifest)
+    manifest.save()
 
 
-def analyze(args, dest_dir):
-    """Analyze All"""
-    utils.make_destination_dir(dest_dir, args.force, _logger)
-    package_dict, ignore_list = utils.make_package_list(args.package_list_json, _logger)
-    lttng = utils.read_trace_data(args.trace_data[0], args.start_point, args.duration, False)
-    arch = Architecture('lttng', str(args.trace_data[0]))
+def analyze_stream(args, arch: Architecture, callback_stream: CallbackStream, dest_dir: str, catalog: Catalog):
+    """Analyze All using statistics accumulated chunk by chunk"""
     arch.export(dest_dir + '/architecture.yaml', force=True)
-    app = Application(arch, lttng)
+    with results_db.ResultsDb(str(Path(dest_dir).parent)) as db:
+        db.clear_node_stats()
+
+    callback_list_dict: dict[str, list[dict]] = {}
+    for callback in callback_stream.callback_dict.values():
+        callback_list_dict.setdefault(callback['node_name'], []).append(callback)
 
-    for package_name, regexp in package_dict.items():
-        node_list = get_node_list(lttng, app, regexp, ignore_list)
-        analyze_package(node_list, f'{dest_dir}/{package_name}')
+    for package_name in catalog.package_dict:
+        package_dest_dir = f'{dest_dir}/{package_name}'
+        utils.make_destination_dir(package_dest_dir, False, _logger)
+        stats = {}
+        for node_name in catalog.get_node_name_list(package_name, list(callback_list_dict.keys())):
+            with profiler.item('node', node_name):
+                node_stats = analyze_node_stream(node_name, callback_list_dict[node_name], package_dest_dir)
+            if node_stats:
+                stats[node_name] = node_stats
+        save_stats(stats, package_dest_dir)
 
 
 def parse_arg():
@@ -194,9 +329,16 @@ def parse_arg():
                         help='Start point[sec] to load trace data')
     parser.add_argument('-d', '--duration', type=float, default=0.0,
                         help='Duration[sec] to load trace data')
+    parser.add_argument('--event_filter', action='store_true', default=False,
+                        help='Load only events of nodes which match package_list_json and are not ignored')
     parser.add_argument('-f', '--force', action='store_true', default=False,
                         help='Overwrite report directory')
+    parser.add_argument('-i', '--incremental', action='store_true', default=False,
+                        help='Keep report directory, and analyze only entries whose inputs are changed from the previous run')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='The number of processes to analyze nodes in parallel')
     parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    utils.add_common_arguments(parser)
     args = parser.parse_args()
     return args
 
@@ -214,10 +356,36 @@ def main():
     _logger.debug(f'trace_data: {args.trace_data[0]}')
     _logger.debug(f'package_list_json: {args.package_list_json}')
     _logger.debug(f'start_point: {args.start_point}, duration: {args.duration}')
+    _logger.debug(f'event_filter: {args.event_filter}')
+    _logger.debug(f'jobs: {args.jobs}')
     dest_dir = f'report_{Path(args.trace_data[0]).stem}/node'
     _logger.debug(f'dest_dir: {dest_dir}')
 
-    analyze(args, dest_dir)
+    utils.apply_common_arguments(args, Path(__file__).stem, str(Path(dest_dir).parent), _logger)
+
+    utils.make_destination_dir(dest_dir, args.force, _logger, args.incremental)
+    event_filter = make_package_event_filter(*utils.make_package_list(args.package_list_json)) \
+        if args.event_filter else None
+    cache = TraceCache(args.cache_dir, args.trace_data[0], args.start_point, args.duration, _logger,
+                       event_filter)
+    callback_record_list = cache.load('callback')
+    arch = cache.load_architecture()
+    if callback_record_list is None or arch is None:
+        lttng = utils.read_trace_data(args.trace_data[0], args.start_point, args.duration, False,
+                                      event_filter, _logger)
+        with profiler.stage('load_architecture'):
+            arch = Architecture('lttng', str(args.trace_data[0]))
+            app = Application(arch, lttng)
+        catalog = make_catalog(args, str(Path(dest_dir).parent), lttng, arch, app, _logger)
+        callback_record_list = extract_callback_records(app, _logger, catalog.get_callback_list())
+        cache.save('callback', callback_record_list)
+        cache.save_architecture(arch)
+    else:
+        catalog = make_catalog(args, str(Path(dest_dir).parent), logger=_logger)
+
+    analyze(args, arch, callback_record_list, dest_dir, catalog)
+    utils.stop_png_renderer()
+    profiler.save_profile(_logger)
     _logger.info('<<< OK. All nodes are analyzed >>>')
 
 
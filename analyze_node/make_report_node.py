@@ -14,17 +14,20 @@
 """
 Script to make report page
 """
-import glob
+import os
 import argparse
 from pathlib import Path
 import sys
-import yaml
 import flask
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+from common import profiler, graph_bundle
+from common.results_db import ResultsDb
 
 app = flask.Flask(__name__)
 
 
-def render_page(stats, report_name, package_name, destination_path, template_path):
+@profiler.stage_function('render_page')
+def render_page(stats, report_name, package_name, destination_path, template_path, graph_bundle_script=''):
     """Render html page"""
     with app.app_context():
         with open(template_path, 'r', encoding='utf-8') as f_html:
@@ -34,24 +37,21 @@ def render_page(stats, report_name, package_name, destination_path, template_pat
                 title=f'{package_name}: {report_name}',
                 stats=stats,
                 metrics_list=['Frequency', 'Period', 'Latency'],
-                metrics_unit=['[Hz]', '[ms]', '[ms]']
+                metrics_unit=['[Hz]', '[ms]', '[ms]'],
+                graph_bundle_script=graph_bundle_script
             )
 
         with open(destination_path, 'w', encoding='utf-8') as f_html:
             f_html.write(rendered)
 
-def make_report(stats_path: str):
+def make_report(report_dir: str, package_name: str, stats: dict):
     """Make report page"""
-    stats = None
-    with open(stats_path, 'r', encoding='utf-8') as f_yaml:
-        stats = yaml.safe_load(f_yaml)
-
-    stats_dir = Path(stats_path).resolve().parent
-    report_name = stats_path.split('/')[-4]
-    package_name = stats_path.split('/')[-2]
+    stats_dir = f'{report_dir}/node/{package_name}'
+    report_name = Path(report_dir).resolve().name
     destination_path = f'{stats_dir}/index.html'
     template_path = f'{Path(__file__).resolve().parent}/template_node.html'
-    render_page(stats, report_name, package_name, destination_path, template_path)
+    graph_bundle_script = graph_bundle.make_graph_bundle(stats_dir)
+    render_page(stats, report_name, package_name, destination_path, template_path, graph_bundle_script)
 
 
 def parse_arg():
@@ -63,20 +63,26 @@ def parse_arg():
     return args
 
 
-def main():
-    """main function"""
-    args = parse_arg()
-
-    report_dir = args.report_directory[0]
-    stats_path_list = glob.glob(f'{report_dir}/**/stats_node.yaml', recursive=True)
+def make_reports(report_dir: str):
+    """Make report pages for all packages in the report directory"""
+    package_list = []
+    if ResultsDb.exists(report_dir):
+        with ResultsDb(report_dir) as db:
+            package_list = db.get_package_list()
+            for package_name in package_list:
+                make_report(report_dir, package_name, db.load_node_stats(package_name))
 
-    if not stats_path_list:
-        print('Warning. No stats file exists.', file=sys.stderr)
+    if not package_list:
+        print('Warning. No stats exists.', file=sys.stderr)
     else:
-        for stats_path in stats_path_list:
-            make_report(stats_path)
         print('<<< OK. report page is created >>>')
 
 
+def main():
+    """main function"""
+    args = parse_arg()
+    make_reports(args.report_directory[0])
+
+
 if __name__ == '__main__':
     main()
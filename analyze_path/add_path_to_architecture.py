@@ -29,73 +29,124 @@ from common import utils
 _logger: logging.Logger = None
 
 
-def find_path(arch: Architecture, target_path: list, max_node_depth: int):
+COMM_FILTER_LIST = [
+    re.compile(r'/tf'),
+    re.compile(r'/tf_static'),
+    re.compile(r'/diagnostics'),
+]
+
+NODE_FILTER_LIST = [
+    re.compile(r'/_ros2cli_/*'),
+    re.compile(r'/launch_ros_*'),
+]
+
+
+def comm_filter(topic_name: str) -> bool:
+    """Return False for topics not to be used in path"""
+    return not any(comm_filter.search(topic_name) for comm_filter in COMM_FILTER_LIST)
+
+
+def node_filter(node_name: str) -> bool:
+    """Return False for nodes not to be used in path"""
+    return not any(node_filter.search(node_name) for node_filter in NODE_FILTER_LIST)
+
+
+def make_node_graph(arch: Architecture) -> dict[str, list[tuple[str, str]]]:
+    """Make adjacency list of nodes: {publish_node_name: [(topic_name, subscribe_node_name), ...]}"""
+    node_graph = {node_name: [] for node_name in arch.node_names if node_filter(node_name)}
+    for comm in arch.communications:
+        if comm.publish_node_name in node_graph and comm.subscribe_node_name in node_graph \
+                and comm_filter(comm.topic_name):
+            node_graph[comm.publish_node_name].append((comm.topic_name, comm.subscribe_node_name))
+    return node_graph
+
+
+def get_node_topic(info) -> tuple[str, str]:
+    """Get node name and topic name (None if not set) of a hop in JSON"""
+    if isinstance(info, str):
+        return info, None
+    elif isinstance(info, list) and len(info) == 2:
+        return info[0], info[1]
+    _logger.error('Invalid description in JSON file')
+    sys.exit(-1)
+
+
+def search_node_names(node_graph: dict[str, list[tuple[str, str]]], target_path: list,
+                      max_node_depth: int = 0) -> list[list[str]]:
+    """
+    Search node name lists which match all hops in JSON
+
+    Each hop (node name and topic name to the next node) is used as a constraint while searching,
+    so only nodes matching the current hop are visited instead of all paths up to max depth.
+    A path which has more nodes than max_node_depth is not searched (not limited if 0)
+    """
+    if max_node_depth > 0 and len(target_path) > max_node_depth:
+        _logger.error(f'The path has {len(target_path)} nodes, more than max_node_depth ({max_node_depth})')
+        return []
+    hop_list = []
+    for info in target_path:
+        node_name, topic_name = get_node_topic(info)
+        hop_list.append((re.compile(node_name), re.compile(topic_name) if topic_name else None))
+
+    node_name_list_list = []
+    deepest_node_name_list = []
+    stack = [[node_name] for node_name in reversed(list(node_graph))
+             if hop_list[0][0].fullmatch(node_name)]
+    while stack:
+        node_name_list = stack.pop()
+        index = len(node_name_list) - 1
+        if len(node_name_list) > len(deepest_node_name_list):
+            deepest_node_name_list = node_name_list
+        if index == len(hop_list) - 1:
+            node_name_list_list.append(node_name_list)
+            continue
+        _, topic_regex = hop_list[index]
+        next_node_regex, _ = hop_list[index + 1]
+        next_node_name_set = set()
+        for topic_name, next_node_name in node_graph[node_name_list[-1]]:
+            if next_node_name in next_node_name_set or not next_node_regex.fullmatch(next_node_name):
+                continue
+            if topic_regex and not topic_regex.fullmatch(topic_name):
+                continue
+            next_node_name_set.add(next_node_name)
+        stack.extend([node_name_list + [next_node_name] for next_node_name in sorted(next_node_name_set, reverse=True)])
+
+    if len(node_name_list_list) == 0 and len(deepest_node_name_list) > 0:
+        _logger.error(f'No node matches hop {len(deepest_node_name_list)}: {target_path[len(deepest_node_name_list)]}')
+        _logger.debug('Hops found until it:')
+        for node_name in deepest_node_name_list:
+            _logger.debug(node_name)
+    return node_name_list_list
+
+
+def find_path(arch: Architecture, node_graph: dict[str, list[tuple[str, str]]], target_path: list,
+              max_node_depth: int = 0):
     """Find target path from architecture"""
-    def get_node_topic(info) -> tuple[str, str]:
-        if isinstance(info, str):
-            return info, None
-        elif isinstance(info, list) and len(info) == 2:
-            return info[0], info[1]
-        _logger.error('Invalid description in JSON file')
-        sys.exit(-1)
+    # 1. Find node name lists which match JSON using node graph
+    node_name_list_list = search_node_names(node_graph, target_path, max_node_depth)
 
-    def comm_filter(topic_name: str) -> bool:
-        comm_filters = [
-            re.compile(r'/tf'),
-            re.compile(r'/tf_static'),
-            re.compile(r'/diagnostics'),
-        ]
-        can_pass = True
-        for comm_filter in comm_filters:
-            can_pass &= not bool(comm_filter.search(topic_name))
-        return can_pass
-
-    def node_filter(node_name: str) -> bool:
-        node_filters = [
-            re.compile(r'/_ros2cli_/*'),
-            re.compile(r'/launch_ros_*'),
-        ]
-        can_pass = True
-        for node_filter in node_filters:
-            can_pass &= not bool(node_filter.search(node_name))
-        return can_pass
-
-    # 1. Find all candidate paths which have the same start/end node as JSON
-    node_src = get_node_topic(target_path[0])[0]
-    node_dst = get_node_topic(target_path[-1])[0]
-    _logger.info(' search paths: %s to %s', node_src, node_dst)
-    path_info_list = arch.search_paths(node_src,
-                                       node_dst,
-                                       max_node_depth=max_node_depth,
-                                       node_filter=node_filter,
-                                       communication_filter=comm_filter)
-
-    # 2. Check if all nodes/topics in the canddiate path are the same as JSON
+    # 2. Get paths going through the nodes. Nodes are adjacent, so paths are searched only between each pair
     found_path_list = []
-    for path in path_info_list:
-        if len(target_path) != len(path.node_names):
-            # if the len is diffrent, it's not the target path
-            continue
+    for node_name_list in node_name_list_list:
+        _logger.info(' search paths: %s', ' -> '.join(node_name_list))
+        search_node_name_list = node_name_list if len(node_name_list) > 1 else node_name_list * 2
+        path_info_list = arch.search_paths(*search_node_name_list,
+                                           max_node_depth=2,
+                                           node_filter=node_filter,
+                                           communication_filter=comm_filter)
 
-        is_target_path = True
-        node_name_list = path.node_names
-        topic_name_list = path.topic_names
-        for index, _ in enumerate(target_path):
-            # if node_name/topic_name is different, it's not the target path
-            json_node_name, json_topic_name = get_node_topic(target_path[index])
-
-            ## Check node name
-            if not re.fullmatch(json_node_name, node_name_list[index]):
-                is_target_path = False
-                break
-
-            ## Check topic name when the node is not the last one and topic name is written in JSON
-            if index < len(topic_name_list) and json_topic_name:
-                if not re.fullmatch(json_topic_name, topic_name_list[index]):
+        # 3. Check if all nodes/topics in the candidate path are the same as JSON
+        for path in path_info_list:
+            if list(path.node_names) != node_name_list:
+                continue
+            is_target_path = True
+            for index, topic_name in enumerate(path.topic_names):
+                _, json_topic_name = get_node_topic(target_path[index])
+                if json_topic_name and not re.fullmatch(json_topic_name, topic_name):
                     is_target_path = False
                     break
-        if is_target_path:
-            found_path_list.append(path)
+            if is_target_path:
+                found_path_list.append(path)
 
     if len(found_path_list) > 0:
         for found_path in found_path_list:
@@ -103,11 +154,6 @@ def find_path(arch: Architecture, target_path: list, max_node_depth: int):
         return found_path_list
     else:
         _logger.error('Path not found')
-        _logger.debug('Candidates:')
-        for path in path_info_list:
-            for node_name in path.node_names:
-                _logger.debug(node_name)
-            _logger.debug('---')
         sys.exit(-1)
 
 
@@ -127,28 +173,25 @@ def convert_context_type_to_use_latest_message(filename_src, filename_dst):
         yaml.dump(yml, f_yaml, encoding='utf-8', allow_unicode=True, sort_keys=False)
 
 
-def add_path_to_architecture(args):
-    """Add path information to architecture file"""
-    # Read target path information from JSON
+def read_target_path_json(target_path_json: str) -> list:
+    """Read target path information from JSON"""
     try:
-        with open(args.target_path_json[0], encoding='UTF-8') as f_json:
+        with open(target_path_json, encoding='UTF-8') as f_json:
             target_path_list = json.load(f_json)
     except:
-        _logger.error(f'Unable to read {args.target_path_json[0]}')
+        _logger.error(f'Unable to read {target_path_json}')
         sys.exit(-1)
+    return target_path_list
 
-    # Create architecture object from architecture file or trace data
-    if args.architecture_file_src:
-        arch = Architecture('yaml', args.architecture_file_src)
-    else:
-        arch = Architecture('lttng', args.trace_data)
-        arch.export('architecture_raw.yaml', force=True)
 
-    # Find path from architecture
+def add_path_to_architecture(args, arch: Architecture, target_path_list: list):
+    """Add path information to architecture file"""
+    # Find path from architecture. Node graph is shared by all target paths
+    node_graph = make_node_graph(arch)
     for target_path in target_path_list:
         target_path_name = target_path['name']
         _logger.info(f'Processing: {target_path_name}')
-        found_path_list = find_path(arch, target_path['path'], max_node_depth=args.max_node_depth)
+        found_path_list = find_path(arch, node_graph, target_path['path'], args.max_node_depth)
         if len(found_path_list) > 0:
             _logger.info(f'Target path found: {target_path_name}')
             for i, found_path in enumerate(found_path_list):
@@ -172,8 +215,12 @@ def parse_arg():
     parser.add_argument('--trace_data', type=str, default=None)
     parser.add_argument('--architecture_file_src', type=str, default=None)
     parser.add_argument('--architecture_file_dst', type=str, default='architecture_path.yaml')
-    parser.add_argument('--use_latest_message', action='store_true', default=True)
-    parser.add_argument('--max_node_depth', type=int, default=20)
+    parser.add_argument('--use_latest_message', action='store_true', default=True,
+                        help='Convert UNDEFINED context_type of callbacks to use_latest_message (default)')
+    parser.add_argument('--no_use_latest_message', dest='use_latest_message', action='store_false',
+                        help='Keep context_type of the architecture file as it is')
+    parser.add_argument('--max_node_depth', type=int, default=20,
+                        help='The maximum number of nodes in a path. Longer paths in JSON are not searched (0: not limited)')
     parser.add_argument('-v', '--verbose', action='store_true', default=False)
     args = parser.parse_args()
     return args
@@ -194,12 +241,22 @@ def main():
     _logger.debug(f'architecture_file_src: {args.architecture_file_src}')
     _logger.debug(f'architecture_file_dst: {args.architecture_file_dst}')
     _logger.debug(f'use_latest_message: {args.use_latest_message}')
+    _logger.debug(f'max_node_depth: {args.max_node_depth}')
 
     if not args.trace_data and not args.architecture_file_src:
         _logger.error('Either trace_data or architecture_file_src must be set')
         sys.exit(-1)
 
-    add_path_to_architecture(args)
+    target_path_list = read_target_path_json(args.target_path_json[0])
+
+    # Create architecture object from architecture file or trace data
+    if args.architecture_file_src:
+        arch = Architecture('yaml', args.architecture_file_src)
+    else:
+        arch = Architecture('lttng', args.trace_data)
+        arch.export('architecture_raw.yaml', force=True)
+
+    add_path_to_architecture(args, arch, target_path_list)
     _logger.info('<<< OK. All target paths are found >>>')
 
 
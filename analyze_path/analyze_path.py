@@ -20,30 +20,22 @@ import os
 import pathlib
 import shutil
 import argparse
+import functools
 from distutils.util import strtobool
 import logging
-import yaml
 import numpy as np
 from bokeh.plotting import Figure, figure
-from caret_analyze.record import RecordsInterface
 from caret_analyze import Architecture, Application
-from caret_analyze.experiment import ResponseTime
 from caret_analyze.plot import message_flow
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
-from common import utils
+from common import utils, results_db, profiler
+from common.event_filter import make_path_event_filter
+from common.manifest import Manifest, make_common_inputs
+from common import response_time
 
 _logger: logging.Logger = None
-
-
-def align_timeseries(timeseries: tuple[np.ndarray, np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
-    """Adjust timeseries graph"""
-    x_list = np.zeros(len(timeseries[0]), dtype='float')
-    y_list = np.zeros(len(timeseries[1]), dtype='float')
-    offset = timeseries[0][0]
-    for i in range(len(timeseries[0])):
-        x_list[i] = (timeseries[0][i] - offset) * 10**-9  # [sec]
-        y_list[i] = timeseries[1][i] * 10**-6  # [msec]
-    return x_list, y_list
+_arch: Architecture = None    # shared with worker processes in parallel mode
+_app: Application = None    # shared with worker processes in parallel mode
 
 
 def draw_response_time(hist: np.ndarray, bin_edges: np.ndarray,
@@ -65,32 +57,6 @@ def draw_response_time(hist: np.ndarray, bin_edges: np.ndarray,
     return p_hist, p_timeseries
 
 
-def get_messageflow_durationtime(records: RecordsInterface):
-    """Get duration time [sec] of message flow"""
-    input_column = records.columns[0]
-    output_column = records.columns[-1]
-
-    input_time_min = None
-    output_time_max = None
-
-    # Need to check all records because some pathes may not be fully connected
-    data_list = records.data
-    for data in data_list:
-        if input_column in data.columns:
-            input_time = data.get(input_column)
-            input_time_min = min(input_time, input_time_min) if input_time_min else input_time
-        if output_column in data.columns:
-            output_time = data.get(output_column)
-            output_time_max = max(output_time, output_time_max) if output_time_max else output_time
-
-    if input_time_min is None or output_time_max is None:
-        duration = None
-    else:
-        duration = (output_time_max - input_time_min) / 1e9
-
-    return duration
-
-
 def create_default_stats(target_path_name: str, node_names: list[str]) -> dict:
     stats = {
         'target_path_name': target_path_name,
@@ -98,14 +64,33 @@ def create_default_stats(target_path_name: str, node_names: list[str]) -> dict:
         'worst_avg': '---',
         'worst_min': '---',
         'worst_max': '---',
+        'worst_p50': '---',
+        'worst_p90': '---',
+        'worst_p99': '---',
+        'worst_p999': '---',
+        'worst_std': '---',
+        'worst_count': '---',
         'best_avg': '---',
         'best_min': '---',
         'best_max': '---',
+        'best_p50': '---',
+        'best_p90': '---',
+        'best_p99': '---',
+        'best_p999': '---',
+        'best_std': '---',
+        'best_count': '---',
         'total_avg': '---',
         'total_min': '---',
         'total_max': '---',
+        'total_p50': '---',
+        'total_p90': '---',
+        'total_p99': '---',
+        'total_p999': '---',
+        'total_std': '---',
+        'total_count': '---',
         'filename_messageflow': '',
         'filename_messageflow_short': '',
+        'messageflow_window_list': [],
         'filename_hist_total': '',
         'filename_hist_best': '',
         'filename_timeseries_best': '',
@@ -121,94 +106,96 @@ def analyze_path(args, dest_dir: str, arch: Architecture, app: Application, targ
     target_path = app.get_path(target_path_name)
     stats = create_default_stats(target_path_name, arch.get_path(target_path_name).node_names)
 
-    records = target_path.to_records()
-    duration = get_messageflow_durationtime(records)
-    if duration is None:
+    with profiler.stage('path_records'):
+        records = target_path.to_records()
+    input_list, output_list = response_time.extract_input_output(records)
+    if len(input_list) == 0 or not np.any(output_list >= 0):
         _logger.warning(f'    There are no-traffic communications: {target_path_name}')
         return stats
-
-    _logger.info('  Call message_flow')
-    graph_short = message_flow(target_path, granularity='node', treat_drop_as_delay=False,
-                lstrip_s=duration / 2,
-                rstrip_s=max(duration / 2 - (3 + 0.1), 0),
-                export_path='dummy.html')
-
-    graph_short.width = 1400
-    graph_short.height = 800
-    utils.export_graph(graph_short, dest_dir, f'{target_path_name}_messageflow_short', target_path_name)
-
     if args.message_flow:
+        stats['filename_messageflow'] = export_messageflow_full(dest_dir, target_path, target_path_name)
+
+    _logger.info('  Calculate response time')
+    response_time_dict = response_time.calc_response_time(input_list, output_list)
+    window_list = response_time.find_worst_windows(input_list, output_list, response_time_dict,
+                                                   args.messageflow_topk, int(args.messageflow_window * 1e9))
+    for index, window in enumerate(window_list):
+        window['filename'] = f'{target_path_name}_messageflow_window{index}'
+        export_messageflow_window(dest_dir, target_path, target_path_name, input_list, output_list,
+                                  window)
+    set_messageflow_window_stats(stats, window_list, input_list[0])
+    return analyze_response_time(args, dest_dir, target_path_name, response_time_dict, stats)
+
+
+def export_messageflow_window(dest_dir: str, target_path, target_path_name: str,
+                              input_list: np.ndarray, output_list: np.ndarray, window: dict):
+    """Export message flow graph of a time window found by find_worst_windows"""
+    _logger.info(f"  Call message_flow ({window['kind']}: {window['filename']})")
+    with profiler.stage('message_flow'):
+        graph = message_flow(target_path, granularity='node', treat_drop_as_delay=False,
+                    lstrip_s=max(window['start'] - input_list[0], 0) / 1e9,
+                    rstrip_s=max(np.max(output_list) - window['end'], 0) / 1e9,
+                    export_path='dummy.html')
+    graph.width = 1400
+    graph.height = 800
+    utils.export_graph(graph, dest_dir, window['filename'], target_path_name, _logger)
+
+
+def export_messageflow_full(dest_dir: str, target_path, target_path_name: str) -> str:
+    """Export message flow graph of whole time period. Filename of the graph is returned"""
+    _logger.info('  Call message_flow (whole time period)')
+    with profiler.stage('message_flow'):
         graph = message_flow(target_path, granularity='node',
-                            treat_drop_as_delay=False, export_path='dummy.html')
-        graph.width = graph_short.width
-        graph.height = graph_short.height
-        utils.export_graph(graph, dest_dir, f'{target_path_name}_messageflow', target_path_name)
-
-    _logger.info('  Call ResponseTime')
-    response_time = ResponseTime(records)
+                             treat_drop_as_delay=False, export_path='dummy.html')
+    graph.width = 1400
+    graph.height = 800
+    utils.export_graph(graph, dest_dir, f'{target_path_name}_messageflow', target_path_name, _logger)
+    return f'{target_path_name}_messageflow'
+
+
+def set_messageflow_window_stats(stats: dict, window_list: list[dict], base_timestamp: int):
+    """Set message flow graphs of time windows in stats. Time is shown in seconds from base_timestamp"""
+    stats['messageflow_window_list'] = [{
+        'filename': window['filename'],
+        'kind': window['kind'],
+        'start': (window['start'] - base_timestamp) / 1e9,
+        'duration': (window['end'] - window['start']) / 1e9,
+        'worst': window['worst'] / 1e6,
+        'num_drop': window['num_drop'],
+    } for window in window_list]
+    stats['filename_messageflow_short'] = window_list[0]['filename'] if window_list else ''
+
+
+def analyze_response_time(args, dest_dir: str, target_path_name: str, response_time_dict: dict, stats: dict) -> dict:
+    """Draw graphs and calculate stats of response time"""
+    binsize = args.hist_binsize * 10**6   # [msec] to [nsec]
 
     _logger.debug('    Draw histogram (total)')
-    hist, bin_edges = response_time.to_histogram(10**7)  # binsize = 10ms
+    hist, bin_edges = response_time.calc_histogram(response_time_dict['total'], binsize)
     p_hist, _ = draw_response_time(hist, bin_edges, None)
-    utils.export_graph(p_hist, dest_dir, target_path_name + '_hist', target_path_name)
-    sumval = 0
-    for i in range(len(bin_edges) - 1):
-        val = (bin_edges[i] + bin_edges[i+1]) / 2
-        sumval += hist[i] * val
-    total_avg = sumval / np.sum(hist)
+    utils.export_graph(p_hist, dest_dir, target_path_name + '_hist', target_path_name, _logger)
 
     _logger.debug('    Draw histogram and timeseries (best)')
-    hist, bin_edges = response_time.to_best_case_histogram(10**7)  # binsize = 10ms
-    timeseries = response_time.to_best_case_timeseries()
-    timeseries = align_timeseries(timeseries)
+    hist, bin_edges = response_time.calc_histogram(response_time_dict['best'], binsize)
+    timeseries = response_time.to_timeseries(response_time_dict['input_max'], response_time_dict['best'])
     p_hist, p_timeseries = draw_response_time(hist, bin_edges, timeseries)
-    utils.export_graph(p_hist, dest_dir, target_path_name + '_hist_best', target_path_name)
-    utils.export_graph(p_timeseries, dest_dir, target_path_name + '_timeseries_best', target_path_name)
-    best_avg = np.average(timeseries[1])
-    best_min = np.min(timeseries[1])
-    best_max = np.max(timeseries[1])
+    utils.export_graph(p_hist, dest_dir, target_path_name + '_hist_best', target_path_name, _logger)
+    utils.export_graph(p_timeseries, dest_dir, target_path_name + '_timeseries_best', target_path_name, _logger)
 
     _logger.debug('    Draw histogram and timeseries (worst)')
-    hist, bin_edges = response_time.to_worst_case_histogram(10**7)  # binsize = 10ms
-    timeseries = response_time.to_worst_case_timeseries()
-    timeseries = align_timeseries(timeseries)
+    hist, bin_edges = response_time.calc_histogram(response_time_dict['worst'], binsize)
+    timeseries = response_time.to_timeseries(response_time_dict['input_min'], response_time_dict['worst'])
     p_hist, p_timeseries = draw_response_time(hist, bin_edges, timeseries)
-    utils.export_graph(p_hist, dest_dir, target_path_name + '_hist_worst', target_path_name)
-    utils.export_graph(p_timeseries, dest_dir, target_path_name + '_timeseries_worst', target_path_name)
-    worst_avg = np.average(timeseries[1])
-    worst_min = np.min(timeseries[1])
-    worst_max = np.max(timeseries[1])
-
-    total_min = best_min
-    total_max = worst_max
+    utils.export_graph(p_hist, dest_dir, target_path_name + '_hist_worst', target_path_name, _logger)
+    utils.export_graph(p_timeseries, dest_dir, target_path_name + '_timeseries_worst', target_path_name, _logger)
 
     _logger.info(f'---{target_path_name}---')
-    _logger.info(f'worst_avg = {worst_avg}')
-    _logger.info(f'worst_min = {worst_min}')
-    _logger.info(f'worst_max = {worst_max}')
-    _logger.info(f'best_avg = {best_avg}')
-    _logger.info(f'best_min = {best_min}')
-    _logger.info(f'best_max = {best_max}')
-    _logger.info(f'total_avg = {total_avg}')
-    _logger.info(f'total_min = {total_min}')
-    _logger.info(f'total_max = {total_max}')
-
-    stats['target_path_name'] =target_path_name
-    stats['node_names'] =arch.get_path(target_path_name).node_names
-    stats['worst_avg'] =float(worst_avg)
-    stats['worst_min'] =float(worst_min)
-    stats['worst_max'] =float(worst_max)
-    stats['best_avg'] =float(best_avg)
-    stats['best_min'] =float(best_min)
-    stats['best_max'] =float(best_max)
-    stats['total_avg'] =float(worst_avg)
-    stats['total_min'] =float(total_min)
-    stats['total_max'] =float(total_max)
-    if args.message_flow:
-        stats['filename_messageflow'] = f'{target_path_name}_messageflow'
-    else:
-        stats['filename_messageflow'] = ''
-    stats['filename_messageflow_short'] = f'{target_path_name}_messageflow_short'
+    for case in ['worst', 'best', 'total']:
+        case_stats = response_time.calc_stats(response_time_dict[case], case)
+        for key, value in case_stats.items():
+            _logger.info(f'{key} = {value}')
+        stats.update(case_stats)
+
     stats['filename_hist_total'] = f'{target_path_name}_hist'
     stats['filename_hist_best'] = f'{target_path_name}_hist_best'
     stats['filename_timeseries_best'] = f'{target_path_name}_timeseries_best'
@@ -218,17 +205,8 @@ def analyze_path(args, dest_dir: str, arch: Architecture, app: Application, targ
     return stats
 
 
-def analyze(args, dest_dir):
-    """Analyze all paths"""
-    utils.make_destination_dir(dest_dir, args.force, _logger)
-    lttng = utils.read_trace_data(args.trace_data[0], args.start_point, args.duration, False)
-    arch = Architecture('yaml', args.architecture_file)
-    app = Application(arch, lttng)
-    shutil.copy(args.architecture_file, dest_dir)
-
-    stats_list = []
-
-    # Verify each path
+def verify_paths(arch: Architecture):
+    """Verify each path. Exit if a path is invalid"""
     for target_path_name in arch.path_names:
         path = arch.get_path(target_path_name)
         ret_verify = path.verify()
@@ -236,16 +214,168 @@ def analyze(args, dest_dir):
         if not ret_verify:
             sys.exit(-1)
 
-    # Analyze each path
+
+def save_stats(stats_list: list[dict], dest_dir: str):
+    """Save stats of all paths"""
+    with results_db.ResultsDb(str(pathlib.Path(dest_dir).parent)) as db:
+        db.save_path_stats(stats_list)
+    results_db.export_yaml(stats_list, f'{dest_dir}/stats_path.yaml')
+
+
+def analyze_path_in_worker(args, dest_dir: str, target_path_name: str) -> tuple[dict, dict]:
+    """Analyze a path in worker process. Records of profiler are returned with the result"""
+    with profiler.item('path', target_path_name):
+        stats = analyze_path(args, dest_dir, _arch, _app, target_path_name)
+    return stats, profiler.pop_records()
+
+
+def analyze_path_list_parallel(args, arch: Architecture, app: Application, dest_dir: str,
+                               target_path_name_list: list[str]) -> list[dict]:
+    """Analyze paths using process pool, and return stats in the same order as target_path_name_list"""
+    global _arch, _app
+    _arch = arch
+    _app = app
+    stats_list = []
+    for result in utils.run_in_process_pool(functools.partial(analyze_path_in_worker, args, dest_dir),
+                                            target_path_name_list, args.jobs, _logger):
+        stats, profile_records = result if result else (None, None)
+        profiler.merge_records(profile_records)
+        stats_list.append(stats)
+    return stats_list
+
+
+def make_inputs(args, arch: Architecture, target_path_name: str) -> dict:
+    """Make inputs of a path in the manifest"""
+    return {
+        'node_names': arch.get_path(target_path_name).node_names,
+        'message_flow': args.message_flow,
+        'messageflow_topk': args.messageflow_topk,
+        'messageflow_window': args.messageflow_window,
+        'hist_binsize': args.hist_binsize,
+    }
+
+
+def is_analyzed(args, arch: Architecture, dest_dir: str) -> bool:
+    """Check if results of all paths in the previous run are reused (then trace data is not needed)"""
+    manifest = Manifest(dest_dir, make_common_inputs(args), args.incremental)
+    return all(manifest.lookup(target_path_name, make_inputs(args, arch, target_path_name))[0]
+               for target_path_name in arch.path_names)
+
+
+def analyze(args, arch: Architecture, app: Application, dest_dir: str):
+    """Analyze all paths (app can be None if is_analyzed() is True)"""
+    verify_paths(arch)
+    manifest = Manifest(dest_dir, make_common_inputs(args), args.incremental, _logger)
+
+    # Only paths whose inputs are changed from the previous run are analyzed
+    stats_dict = {}
+    inputs_dict = {}
+    for target_path_name in arch.path_names:
+        inputs = make_inputs(args, arch, target_path_name)
+        is_found, stats = manifest.lookup(target_path_name, inputs)
+        if is_found:
+            stats_dict[target_path_name] = stats
+        else:
+            inputs_dict[target_path_name] = inputs
+
+    target_path_name_list = list(inputs_dict.keys())
+    if args.jobs > 1 and len(target_path_name_list) > 1:
+        # Trace data is shared with forked worker processes (not reloaded nor pickled)
+        stats_to_run_list = analyze_path_list_parallel(args, arch, app, dest_dir, target_path_name_list)
+    else:
+        stats_to_run_list = []
+        for target_path_name in target_path_name_list:
+            with profiler.item('path', target_path_name):
+                stats_to_run_list.append(analyze_path(args, dest_dir, arch, app, target_path_name))
+    for target_path_name, stats in zip(target_path_name_list, stats_to_run_list):
+        if stats is None:
+            # Failed in worker process (logged). It's analyzed again in the next run
+            stats = create_default_stats(target_path_name, arch.get_path(target_path_name).node_names)
+        else:
+            manifest.update(target_path_name, inputs_dict[target_path_name], stats)
+        stats_dict[target_path_name] = stats
+
+    # Merge results in the order of paths in the architecture
+    stats_list = [stats_dict[target_path_name] for target_path_name in arch.path_names
+                  if stats_dict[target_path_name]]
+    manifest.save()
+    save_stats(stats_list, dest_dir)
+
+
+def update_stream_windows(window_state: dict, window: dict, target_path_name: str, num_window: int) -> bool:
+    """
+    Add a window found in a chunk to windows of the path if it's worse than them (streaming mode)
+
+    A graph file of the replaced window is overwritten, so at most num_window graphs are kept for a path.
+    At most one window is kept for drops. True is returned if the graph of the window needs to be exported
+    """
+    window_list = window_state['window_list']
+    if window['kind'] == 'drop':
+        replaced = next((w for w in window_list if w['kind'] == 'drop'), None)
+        if replaced and window['num_drop'] <= replaced['num_drop']:
+            return False
+    else:
+        replaced = min((w for w in window_list if w['kind'] == 'response_time'),
+                       key=lambda w: w['worst'], default=None)
+        if len(window_list) < num_window:
+            replaced = None
+        elif replaced is None or window['worst'] <= replaced['worst']:
+            return False
+    if replaced:
+        window['filename'] = replaced['filename']
+        window_list.remove(replaced)
+    elif len(window_list) < num_window:
+        window['filename'] = f"{target_path_name}_messageflow_window{window_state['num_file']}"
+        window_state['num_file'] += 1
+    else:
+        return False
+    window_list.append(window)
+    return True
+
+
+def analyze_chunk(args, arch: Architecture, app: Application, dest_dir: str,
+                  response_time_list_dict: dict[str, list[dict]], window_state_dict: dict[str, dict]):
+    """Calculate response time and find the worst windows of all paths in a chunk of trace data (streaming mode)"""
     for target_path_name in arch.path_names:
-        stats = analyze_path(args, dest_dir, arch, app, target_path_name)
-        if stats:
-            stats_list.append(stats)
+        target_path = app.get_path(target_path_name)
+        input_list, output_list = response_time.extract_input_output(target_path.to_records())
+        if len(input_list) == 0 or not np.any(output_list >= 0):
+            continue
+        if target_path_name not in response_time_list_dict:
+            _logger.info(f'Processing: {target_path_name}')
+        response_time_dict = response_time.calc_response_time(input_list, output_list)
+        response_time_list_dict.setdefault(target_path_name, []).append(response_time_dict)
+
+        # Message flow is drawn only for windows worse than the ones found in the previous chunks
+        window_state = window_state_dict.setdefault(target_path_name,
+                                                    {'base_timestamp': int(input_list[0]), 'num_file': 0,
+                                                     'window_list': []})
+        window_list = response_time.find_worst_windows(input_list, output_list, response_time_dict,
+                                                       args.messageflow_topk, int(args.messageflow_window * 1e9))
+        for window in window_list:
+            if update_stream_windows(window_state, window, target_path_name, args.messageflow_topk):
+                export_messageflow_window(dest_dir, target_path, target_path_name, input_list, output_list,
+                                          window)
+
+
+def analyze_stream(args, arch: Architecture, response_time_list_dict: dict[str, list[dict]],
+                   window_state_dict: dict[str, dict], dest_dir: str):
+    """Analyze all paths using response time calculated chunk by chunk"""
+    stats_list = []
+    for target_path_name in arch.path_names:
+        stats = create_default_stats(target_path_name, arch.get_path(target_path_name).node_names)
+        if target_path_name in response_time_list_dict:
+            with profiler.item('path', target_path_name):
+                response_time_dict = response_time.merge_response_time(response_time_list_dict[target_path_name])
+                window_state = window_state_dict[target_path_name]
+                window_list = sorted(window_state['window_list'], key=lambda w: (w['kind'] == 'drop', -w['worst']))
+                set_messageflow_window_stats(stats, window_list, window_state['base_timestamp'])
+                stats = analyze_response_time(args, dest_dir, target_path_name, response_time_dict, stats)
+        else:
+            _logger.warning(f'    There are no-traffic communications: {target_path_name}')
+        stats_list.append(stats)
 
-    # Save stats file
-    stat_file_path = f'{dest_dir}/stats_path.yaml'
-    with open(stat_file_path, 'w', encoding='utf-8') as f_yaml:
-        yaml.safe_dump(stats_list, f_yaml, encoding='utf-8', allow_unicode=True, sort_keys=False)
+    save_stats(stats_list, dest_dir)
 
 
 def parse_arg():
@@ -255,14 +385,27 @@ def parse_arg():
     parser.add_argument('trace_data', nargs=1, type=str)
     parser.add_argument('architecture_file', nargs='?', type=str, default='architecture_path.yaml')
     parser.add_argument('-m', '--message_flow', type=strtobool, default=False,
-                        help='Output message flow graph')
+                        help='Output message flow graph of whole time period')
+    parser.add_argument('--messageflow_topk', type=int, default=3,
+                        help='The number of time windows where message flow graph is drawn. Windows with the longest response time or drops are chosen')
+    parser.add_argument('--messageflow_window', type=float, default=3.0,
+                        help='Width[sec] of each time window of message flow graph')
     parser.add_argument('-s', '--start_point', type=float, default=0.0,
                         help='Start point[sec] to load trace data')
     parser.add_argument('-d', '--duration', type=float, default=0.0,
                         help='Duration[sec] to load trace data')
+    parser.add_argument('--event_filter', action='store_true', default=False,
+                        help='Load only events of nodes in paths. Publish events of topics not in paths are not loaded')
+    parser.add_argument('--hist_binsize', type=float, default=0.0,
+                        help='Bin size[ms] of response time histogram (0: calculated from range)')
     parser.add_argument('-f', '--force', action='store_true', default=False,
                         help='Overwrite report directory')
+    parser.add_argument('-i', '--incremental', action='store_true', default=False,
+                        help='Keep report directory, and analyze only entries whose inputs are changed from the previous run')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='The number of processes to analyze paths in parallel')
     parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    utils.add_common_arguments(parser, use_cache=False)
     args = parser.parse_args()
     return args
 
@@ -280,12 +423,30 @@ def main():
     _logger.debug(f'trace_data: {args.trace_data[0]}')
     _logger.debug(f'architecture_file: {args.architecture_file}')
     _logger.debug(f'start_point: {args.start_point}, duration: {args.duration}')
+    _logger.debug(f'event_filter: {args.event_filter}')
     dest_dir = f'report_{pathlib.Path(args.trace_data[0]).stem}/path'
     _logger.debug(f'dest_dir: {dest_dir}')
     args.message_flow = True if args.message_flow == 1 else False
     _logger.debug(f'message_flow: {args.message_flow}')
+    _logger.debug(f'messageflow_topk: {args.messageflow_topk}, messageflow_window: {args.messageflow_window}')
+    _logger.debug(f'hist_binsize: {args.hist_binsize}')
+    _logger.debug(f'jobs: {args.jobs}')
+
+    utils.apply_common_arguments(args, pathlib.Path(__file__).stem, str(pathlib.Path(dest_dir).parent), _logger)
+
+    utils.make_destination_dir(dest_dir, args.force, _logger, args.incremental)
+    with profiler.stage('load_architecture'):
+        arch = Architecture('yaml', args.architecture_file)
+    event_filter = make_path_event_filter(arch) if args.event_filter else None
+    lttng = utils.read_trace_data(args.trace_data[0], args.start_point, args.duration, False,
+                                  event_filter, _logger)
+    with profiler.stage('load_architecture'):
+        app = Application(arch, lttng)
+    shutil.copy(args.architecture_file, dest_dir)
 
-    analyze(args, dest_dir)
+    analyze(args, arch, app, dest_dir)
+    utils.stop_png_renderer()
+    profiler.save_profile(_logger)
     _logger.info('<<< OK. All target paths are analyzed >>>')
 
 
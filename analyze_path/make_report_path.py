@@ -14,17 +14,21 @@
 """
 Script to make report page
 """
-import glob
+from __future__ import annotations
+import os
 import argparse
 from pathlib import Path
 import sys
-import yaml
 import flask
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+from common import profiler, graph_bundle
+from common.results_db import ResultsDb
 
 app = flask.Flask(__name__)
 
 
-def render_page(stats, report_name, destination_path, template_path):
+@profiler.stage_function('render_page')
+def render_page(stats, report_name, destination_path, template_path, graph_bundle_script=''):
     """Render html page"""
     with app.app_context():
         with open(template_path, 'r', encoding='utf-8') as f_html:
@@ -33,24 +37,22 @@ def render_page(stats, report_name, destination_path, template_path):
                 template_string,
                 title=f'Path Analysis: {report_name}',
                 stats=stats,
+                graph_bundle_script=graph_bundle_script,
             )
 
         with open(destination_path, 'w', encoding='utf-8') as f_html:
             f_html.write(rendered)
 
 
-def make_report(stats_path: str):
+def make_report(report_dir: str, stats: list[dict]):
     """Make report page"""
-    stats = None
-    with open(stats_path, 'r', encoding='utf-8') as f_yaml:
-        stats = yaml.safe_load(f_yaml)
-
-    stats_dir = Path(stats_path).resolve().parent
-    report_name = stats_path.split('/')[-3]
+    stats_dir = f'{report_dir}/path'
+    report_name = Path(report_dir).resolve().name
 
     destination_path = f'{stats_dir}/index.html'
     template_path = f'{Path(__file__).resolve().parent}/template_path.html'
-    render_page(stats, report_name, destination_path, template_path)
+    graph_bundle_script = graph_bundle.make_graph_bundle(stats_dir)
+    render_page(stats, report_name, destination_path, template_path, graph_bundle_script)
 
 
 def parse_arg():
@@ -62,19 +64,20 @@ def parse_arg():
     return args
 
 
+def make_reports(report_dir: str):
+    """Make report page of paths in the report directory"""
+    if not ResultsDb.exists(report_dir) or not os.path.isdir(f'{report_dir}/path'):
+        print('Warning. No stats exists.', file=sys.stderr)
+    else:
+        with ResultsDb(report_dir) as db:
+            make_report(report_dir, db.load_path_stats())
+        print('<<< OK. report page is created >>>')
+
+
 def main():
     """main function"""
     args = parse_arg()
-
-    report_dir = args.report_directory[0]
-    stats_path_list = glob.glob(f'{report_dir}/**/stats_path.yaml', recursive=True)
-
-    if not stats_path_list:
-        print('Warning. No stats file exists.', file=sys.stderr)
-    else:
-        for stats_path in stats_path_list:
-            make_report(stats_path)
-        print('<<< OK. report page is created >>>')
+    make_reports(args.report_directory[0])
 
 
 if __name__ == '__main__':
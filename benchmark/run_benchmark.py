@@ -0,0 +1,378 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Script to measure time and memory of each analysis stage with synthetic inputs
+"""
+from __future__ import annotations
+import sys
+import os
+from pathlib import Path
+import argparse
+import logging
+import json
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import yaml
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+from common import utils, response_time, node_metrics, timer_metrics
+from common.results_db import ResultsDb
+from analyze_node import analyze_node, make_report_node
+from check_callback_sub import check_callback_sub, make_report_sub
+from check_callback_timer import make_report_timer
+from analyze_path import make_report_path
+from top import make_report_top
+from benchmark import synthetic
+
+BENCHMARK_VERSION = 1
+WARNING_NUM_HUGE_GAP = 10
+_logger: logging.Logger = None
+
+
+def prepare_calc_frequency(rng: np.random.Generator, scale: int, work_dir: str):
+    """Frequency of 10 topics (100 Hz)"""
+    timestamps_list = [synthetic.make_timestamps(rng, 100.0, synthetic.BASE_DURATION_S * scale)
+                       for _ in range(10)]
+
+    def run():
+        for timestamps in timestamps_list:
+            check_callback_sub.calc_pub_freq(timestamps)
+    return run, sum(len(timestamps) for timestamps in timestamps_list)
+
+
+def prepare_match_pubsub_freq(rng: np.random.Generator, scale: int, work_dir: str):
+    """Matching of publishment and subscription frequency of 10 topics (100 Hz)"""
+    pubsub_freq_list = []
+    for _ in range(10):
+        pub_timestamps, sub_timestamps = synthetic.make_pubsub_timestamps(rng, 100.0, synthetic.BASE_DURATION_S * scale)
+        pubsub_freq_list.append((check_callback_sub.calc_pub_freq(pub_timestamps),
+                                 check_callback_sub.calc_sub_freq(sub_timestamps)))
+
+    def run():
+        for pub_freq, sub_freq in pubsub_freq_list:
+            check_callback_sub.match_pubsub_freq(pub_freq, sub_freq)
+    return run, sum(len(pub_freq[0]) for pub_freq, _ in pubsub_freq_list)
+
+
+def prepare_node_stats_histogram(rng: np.random.Generator, scale: int, work_dir: str):
+    """Stats and histogram of latency of 10 callbacks (100 Hz)"""
+    data_list = [synthetic.make_latency(rng, int(100 * synthetic.BASE_DURATION_S * scale)) for _ in range(10)]
+
+    def run():
+        for data in data_list:
+            analyze_node.calcualte_stats(data)
+            analyze_node.draw_histogram(data, 'callback', 'Latency [ms]')
+    return run, sum(len(data) for data in data_list)
+
+
+def prepare_node_metrics(rng: np.random.Generator, scale: int, work_dir: str):
+    """Frequency, period and latency of a node with 10 callbacks (100 Hz)"""
+    callback_record_list = []
+    for _ in range(10):
+        start_timestamps = synthetic.make_timestamps(rng, 100.0, synthetic.BASE_DURATION_S * scale)
+        end_timestamps = start_timestamps + (synthetic.make_latency(rng, len(start_timestamps)) * 1e6).astype(np.int64)
+        callback_record_list.append({'start_timestamps': start_timestamps, 'end_timestamps': end_timestamps})
+
+    def run():
+        node_metrics.calc_node_metrics(callback_record_list)
+    return run, sum(len(record['start_timestamps']) for record in callback_record_list)
+
+
+def prepare_timer_metrics(rng: np.random.Generator, scale: int, work_dir: str):
+    """Frequency, period error, jitter and drift of timers at once (BASE_NUM_TIMER * 10 timers of 10 - 100 Hz)"""
+    period_ns_list = [int(1e9 / float(rng.choice([10.0, 30.0, 100.0]))) for _ in range(synthetic.BASE_NUM_TIMER * 10)]
+    start_timestamps_list = [synthetic.make_timestamps(rng, 1e9 / period_ns, synthetic.BASE_DURATION_S * scale)
+                             for period_ns in period_ns_list]
+
+    def run():
+        timer_metrics.calc_timer_metrics(start_timestamps_list, period_ns_list)
+    return run, sum(len(timestamps) for timestamps in start_timestamps_list)
+
+
+def prepare_path_response_time(rng: np.random.Generator, scale: int, work_dir: str):
+    """Response time of a path (5 nodes, 10 Hz input and 10 Hz output) from records"""
+    records = synthetic.make_path_records(rng, 5, 10.0, synthetic.BASE_DURATION_S * scale)
+
+    def run():
+        input_list, output_list = response_time.extract_input_output(records)
+        response_time_dict = response_time.calc_response_time(input_list, output_list)
+        for case in ['worst', 'best', 'total']:
+            response_time.calc_histogram(response_time_dict[case])
+            response_time.calc_stats(response_time_dict[case], case)
+    return run, len(records.data)
+
+
+def make_report_stats(rng: np.random.Generator, scale: int) -> dict:
+    """Make stats of all analyses"""
+    communication_stats_list = synthetic.make_communication_stats(rng, scale)
+    timer_stats_list = synthetic.make_timer_stats(rng, scale)
+    return {
+        'node': synthetic.make_node_stats(rng, scale),
+        'communication': communication_stats_list,
+        'communication_warning': [stats for stats in communication_stats_list
+                                  if stats['num_huge_gap'] >= WARNING_NUM_HUGE_GAP],
+        'timer': timer_stats_list,
+        'timer_warning': [stats for stats in timer_stats_list if stats['num_huge_gap'] >= WARNING_NUM_HUGE_GAP],
+        'path': synthetic.make_path_stats(rng, scale),
+    }
+
+
+def count_stats(report_stats: dict) -> int:
+    """Count callbacks, communications, timers and paths in stats"""
+    num_callback = sum(len(node_stats['callbacks']) for package_stats in report_stats['node'].values()
+                       for node_stats in package_stats.values())
+    return num_callback + len(report_stats['communication']) + len(report_stats['timer']) + len(report_stats['path'])
+
+
+def save_report_stats(report_dir: str, report_stats: dict):
+    """Save stats of all analyses into the results database"""
+    with ResultsDb(report_dir) as db:
+        db.clear_node_stats()
+        for package_name, stats in report_stats['node'].items():
+            db.save_node_stats(package_name, stats)
+        db.save_communication_stats(report_stats['communication'], report_stats['communication_warning'])
+        db.save_timer_stats(report_stats['timer'], report_stats['timer_warning'])
+        db.save_path_stats(report_stats['path'])
+
+
+def prepare_stats_yaml(rng: np.random.Generator, scale: int, work_dir: str):
+    """Dump and load of stats_*.yaml files"""
+    report_stats = make_report_stats(rng, scale)
+    stats_file_path = f'{work_dir}/stats.yaml'
+
+    def run():
+        for key in ['node', 'communication', 'timer', 'path']:
+            with open(stats_file_path, 'w', encoding='utf-8') as f_yaml:
+                yaml.safe_dump(report_stats[key], f_yaml, encoding='utf-8', allow_unicode=True, sort_keys=False)
+            with open(stats_file_path, 'r', encoding='utf-8') as f_yaml:
+                yaml.safe_load(f_yaml)
+    return run, count_stats(report_stats)
+
+
+def prepare_results_db(rng: np.random.Generator, scale: int, work_dir: str):
+    """Save and load of the results database"""
+    report_stats = make_report_stats(rng, scale)
+    report_dir = f'{work_dir}/report_results_db'
+
+    def run():
+        save_report_stats(report_dir, report_stats)
+        with ResultsDb(report_dir) as db:
+            for package_name in db.get_package_list():
+                db.load_node_stats(package_name)
+            db.load_communication_stats()
+            db.load_timer_stats()
+            db.load_path_stats()
+    return run, count_stats(report_stats)
+
+
+def prepare_report(rng: np.random.Generator, scale: int, work_dir: str) -> tuple[str, dict]:
+    """Make a report directory whose results database has stats"""
+    report_stats = make_report_stats(rng, scale)
+    report_dir = f'{work_dir}/report'
+    for package_name in report_stats['node']:
+        os.makedirs(f'{report_dir}/node/{package_name}', exist_ok=True)
+    for stats_dir in ['check_callback_sub', 'check_callback_timer', 'path']:
+        os.makedirs(f'{report_dir}/{stats_dir}', exist_ok=True)
+    save_report_stats(report_dir, report_stats)
+    return report_dir, report_stats
+
+
+def prepare_render_node(rng: np.random.Generator, scale: int, work_dir: str):
+    """Rendering of node report pages"""
+    report_dir, report_stats = prepare_report(rng, scale, work_dir)
+
+    def run():
+        for package_name, stats in report_stats['node'].items():
+            make_report_node.make_report(report_dir, package_name, stats)
+    return run, count_stats(report_stats)
+
+
+def prepare_render_sub(rng: np.random.Generator, scale: int, work_dir: str):
+    """Rendering of subscription callback report pages"""
+    report_dir, report_stats = prepare_report(rng, scale, work_dir)
+
+    def run():
+        make_report_sub.make_report(report_dir, report_stats['communication'], 'index')
+        make_report_sub.make_report(report_dir, report_stats['communication_warning'], 'index_warning')
+    return run, len(report_stats['communication'])
+
+
+def prepare_render_timer(rng: np.random.Generator, scale: int, work_dir: str):
+    """Rendering of timer callback report pages"""
+    report_dir, report_stats = prepare_report(rng, scale, work_dir)
+
+    def run():
+        make_report_timer.make_report(report_dir, report_stats['timer'], 'index')
+        make_report_timer.make_report(report_dir, report_stats['timer_warning'], 'index_warning')
+    return run, len(report_stats['timer'])
+
+
+def prepare_render_path(rng: np.random.Generator, scale: int, work_dir: str):
+    """Rendering of path report page"""
+    report_dir, report_stats = prepare_report(rng, scale, work_dir)
+
+    def run():
+        make_report_path.make_report(report_dir, report_stats['path'])
+    return run, len(report_stats['path'])
+
+
+def prepare_render_top(rng: np.random.Generator, scale: int, work_dir: str):
+    """Rendering of top page (including query of the results database)"""
+    report_dir, report_stats = prepare_report(rng, scale, work_dir)
+
+    def run():
+        make_report_top.make_report(report_dir, 'index', 'avg')
+    return run, count_stats(report_stats)
+
+
+STAGE_DICT = {
+    'calc_frequency': prepare_calc_frequency,
+    'match_pubsub_freq': prepare_match_pubsub_freq,
+    'node_stats_histogram': prepare_node_stats_histogram,
+    'node_metrics': prepare_node_metrics,
+    'timer_metrics': prepare_timer_metrics,
+    'path_response_time': prepare_path_response_time,
+    'stats_yaml': prepare_stats_yaml,
+    'results_db': prepare_results_db,
+    'render_node': prepare_render_node,
+    'render_sub': prepare_render_sub,
+    'render_timer': prepare_render_timer,
+    'render_path': prepare_render_path,
+    'render_top': prepare_render_top,
+}
+
+
+def measure(run, repeat: int) -> dict:
+    """Measure time of each run and peak memory allocated in an additional run"""
+    time_list = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        time_list.append(time.perf_counter() - start)
+    # tracemalloc slows down the run, so memory is measured separately from time
+    tracemalloc.start()
+    run()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'time_min': min(time_list),
+        'time_median': statistics.median(time_list),
+        'peak_memory_mb': peak_memory / 2**20,
+    }
+
+
+def run_benchmark(args) -> dict:
+    """Run stages at each scale"""
+    result_list = []
+    for scale in args.scale:
+        for stage in args.stage:
+            # Inputs are the same for each run as long as seed is the same
+            rng = np.random.default_rng(args.seed)
+            with tempfile.TemporaryDirectory() as work_dir:
+                run, size = STAGE_DICT[stage](rng, scale, work_dir)
+                result = dict({'stage': stage, 'scale': scale, 'size': size}, **measure(run, args.repeat))
+            _logger.info(f"{stage} x{scale}: {result['time_min']:.3f} [s], {result['peak_memory_mb']:.1f} [MB]")
+            result_list.append(result)
+    return {
+        'version': BENCHMARK_VERSION,
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+        },
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'results': result_list,
+    }
+
+
+def compare_with_baseline(summary: dict, baseline_path: str):
+    """Show ratio of time and memory to the baseline summary for the same stage and scale"""
+    with open(baseline_path, encoding='utf-8') as f_json:
+        baseline = json.load(f_json)
+    if baseline['version'] != BENCHMARK_VERSION:
+        _logger.warning(f'Benchmark version is different from the baseline: {baseline_path}')
+        return
+    baseline_dict = {(result['stage'], result['scale']): result for result in baseline['results']}
+    for result in summary['results']:
+        baseline_result = baseline_dict.get((result['stage'], result['scale']))
+        if baseline_result is None:
+            continue
+        result['time_ratio'] = result['time_min'] / baseline_result['time_min'] \
+            if baseline_result['time_min'] > 0 else None
+        result['memory_ratio'] = result['peak_memory_mb'] / baseline_result['peak_memory_mb'] \
+            if baseline_result['peak_memory_mb'] > 0 else None
+        _logger.info(f"{result['stage']} x{result['scale']}: time x{result['time_ratio'] or 0:.2f}, "
+                     f"memory x{result['memory_ratio'] or 0:.2f} (to baseline)")
+
+
+def parse_arg():
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(
+                description='Script to measure time and memory of each analysis stage with synthetic inputs')
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 10, 100],
+                        help='Scale of inputs. 1 corresponds to a 60 sec trace of 20 nodes')
+    parser.add_argument('--stage', type=str, nargs='+', default=list(STAGE_DICT.keys()),
+                        choices=list(STAGE_DICT.keys()), help='Stages to be measured')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='The number of runs to measure time')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed to generate inputs')
+    parser.add_argument('--baseline', type=str, default='',
+                        help='Summary file of a previous run to compare with')
+    parser.add_argument('-o', '--output', type=str, default='benchmark_summary.json',
+                        help='Summary file (json)')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    """Main function"""
+    args = parse_arg()
+
+    global _logger
+    if args.verbose:
+        _logger = utils.create_logger(__name__, logging.DEBUG)
+    else:
+        _logger = utils.create_logger(__name__, logging.INFO)
+
+    # Each analysis script outputs log using its own module logger
+    for module in [analyze_node, check_callback_sub]:
+        module._logger = _logger
+
+    _logger.debug(f'scale: {args.scale}')
+    _logger.debug(f'stage: {args.stage}')
+    _logger.debug(f'repeat: {args.repeat}')
+    _logger.debug(f'seed: {args.seed}')
+    _logger.debug(f'baseline: {args.baseline}')
+    _logger.debug(f'output: {args.output}')
+
+    summary = run_benchmark(args)
+    if args.baseline:
+        compare_with_baseline(summary, args.baseline)
+    Path(args.output).resolve().parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f_json:
+        json.dump(summary, f_json, indent=2)
+    _logger.info(f'<<< OK. benchmark summary is saved: {args.output} >>>')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Synthetic inputs for benchmark
+
+Scale 1 corresponds to a 60 sec trace of a system with 20 nodes (4 callbacks each), 50 communications,
+20 timers and 5 target paths. At scale N, the trace is N times longer (N times more events in each
+timestamp array and records) and the system has N times more nodes, communications, timers and paths.
+"""
+from __future__ import annotations
+import numpy as np
+from common import response_time
+
+BASE_DURATION_S = 60.0
+BASE_NUM_PACKAGE = 4
+BASE_NUM_NODE = 20
+NUM_CALLBACK_PER_NODE = 4
+BASE_NUM_COMMUNICATION = 50
+BASE_NUM_TIMER = 20
+BASE_NUM_PATH = 5
+START_TIME_NS = 1_600_000_000 * 10**9
+
+
+def make_timestamps(rng: np.random.Generator, frequency: float, duration_s: float,
+                    jitter_ratio: float = 0.05, drop_ratio: float = 0.01) -> np.ndarray:
+    """Make sorted timestamps [nsec] of a periodic event with jitter and dropped events"""
+    period_ns = 1e9 / frequency
+    num = int(duration_s * frequency)
+    offsets = np.arange(num) * period_ns + rng.normal(0, period_ns * jitter_ratio, num)
+    offsets = offsets[rng.random(num) >= drop_ratio]
+    return np.sort(START_TIME_NS + offsets.astype(np.int64))
+
+
+def make_pubsub_timestamps(rng: np.random.Generator, frequency: float, duration_s: float,
+                           latency_ms: float = 1.0, drop_ratio: float = 0.01) -> tuple[np.ndarray, np.ndarray]:
+    """Make timestamps [nsec] of publishment and subscription (some messages are not subscribed)"""
+    pub_timestamps = make_timestamps(rng, frequency, duration_s)
+    sub_timestamps = pub_timestamps + (rng.exponential(latency_ms, len(pub_timestamps)) * 1e6).astype(np.int64)
+    sub_timestamps = sub_timestamps[rng.random(len(sub_timestamps)) >= drop_ratio]
+    return pub_timestamps, sub_timestamps
+
+
+def make_latency(rng: np.random.Generator, size: int, median_ms: float = 2.0) -> np.ndarray:
+    """Make latency [msec] which has a long tail"""
+    return rng.lognormal(np.log(median_ms), 0.5, size)
+
+
+class FakeRecord:
+    """Record which has the same interface as RecordInterface (columns and get)"""
+
+    def __init__(self, data: dict):
+        self.data = data
+        self.columns = set(data.keys())
+
+    def get(self, column: str) -> int:
+        return self.data[column]
+
+
+class FakeRecords:
+    """Records which have the same interface as RecordsInterface (columns and data)"""
+
+    def __init__(self, columns: list[str], data: list[FakeRecord]):
+        self.columns = columns
+        self.data = data
+
+
+def make_path_records(rng: np.random.Generator, num_node: int, frequency: float, duration_s: float,
+                      output_frequency: float = 10.0, drop_ratio: float = 0.01) -> FakeRecords:
+    """
+    Make records of a path (input -> nodes -> output)
+
+    The last node publishes the latest message periodically (output_frequency),
+    so several inputs may reach the same output. Some messages are dropped on the way.
+    """
+    columns = [f'/node_{index}/callback_start_timestamp' for index in range(num_node)]
+    input_timestamps = make_timestamps(rng, frequency, duration_s)
+    num = len(input_timestamps)
+    timestamps_list = [input_timestamps]
+    for _ in range(num_node - 1):
+        timestamps_list.append(timestamps_list[-1] + (make_latency(rng, num) * 1e6).astype(np.int64))
+    output_period_ns = int(1e9 / output_frequency)
+    timestamps_list[-1] = (timestamps_list[-1] // output_period_ns + 1) * output_period_ns
+    reached_node_list = np.where(rng.random(num) < drop_ratio, rng.integers(1, num_node, num), num_node)
+
+    data = []
+    for index in range(num):
+        data.append(FakeRecord({columns[node_index]: int(timestamps_list[node_index][index])
+                                for node_index in range(reached_node_list[index])}))
+    return FakeRecords(columns, data)
+
+
+def make_callback_stats(rng: np.random.Generator, filename_hist: str) -> dict:
+    """Make stats of a callback in the same format as node analysis"""
+    avg, std = float(rng.uniform(1, 100)), float(rng.uniform(0, 10))
+    stats = {'avg': avg, 'min': max(0.0, avg - 3 * std), 'max': avg + 5 * std, 'std': std,
+             'p50': avg, 'p95': avg + 2 * std, 'p99': avg + 3 * std, 'count': int(rng.integers(1, 10000))}
+    stats['filename_hist'] = filename_hist
+    return stats
+
+
+def make_node_stats(rng: np.random.Generator, scale: int) -> dict[str, dict]:
+    """Make stats of nodes ({package_name: {node_name: node_stats}})"""
+    stats_dict = {}
+    for node_index in range(BASE_NUM_NODE * scale):
+        package_name = f'package_{node_index % BASE_NUM_PACKAGE}'
+        node_name = f'/{package_name}/node_{node_index}'
+        node_stats = {'filename_timeseries': {}, 'callbacks': {}}
+        for callback_index in range(NUM_CALLBACK_PER_NODE):
+            callback_name = f'{node_name}/callback_{callback_index}'
+            callback_stats = {'displayname': f'callback_{callback_index}: /topic_{node_index}_{callback_index}'}
+            for metrics in ['Frequency', 'Period', 'Latency']:
+                node_stats['filename_timeseries'][metrics] = f'{metrics}{node_name.replace("/", "_")}'
+                callback_stats[metrics] = make_callback_stats(rng, f'{metrics}{callback_name.replace("/", "_")}_hist')
+            node_stats['callbacks'][callback_name] = callback_stats
+        stats_dict.setdefault(package_name, {})[node_name] = node_stats
+    return stats_dict
+
+
+def make_communication_stats(rng: np.random.Generator, scale: int) -> list[dict]:
+    """Make stats of subscription callbacks in the same format as check_callback_sub"""
+    stats_list = []
+    for index in range(BASE_NUM_COMMUNICATION * scale):
+        publishment_freq = float(rng.choice([10.0, 30.0, 100.0]))
+        stats_list.append({
+            'title': f'/topic_{index} : /publisher_{index} -> /node_{index}',
+            'graph_filename': f'topic_{index}_node_{index}',
+            'topic_name': f'/topic_{index}',
+            'publisher_name': f'/publisher_{index}',
+            'node_name': f'/node_{index}',
+            'package_name': f'package_{index % BASE_NUM_PACKAGE}',
+            'callback_name': f'/node_{index}/callback_0',
+            'callback_displayname': f'/topic_{index}',
+            'publishment_freq': publishment_freq,
+            'subscription_freq': publishment_freq * float(rng.uniform(0.7, 1.0)),
+            'num_huge_gap': int(rng.integers(0, 20)),
+        })
+    return stats_list
+
+
+def make_timer_stats(rng: np.random.Generator, scale: int) -> list[dict]:
+    """Make stats of timer callbacks in the same format as check_callback_timer"""
+    stats_list = []
+    for index in range(BASE_NUM_TIMER * scale):
+        freq_timer = float(rng.choice([10.0, 30.0, 100.0]))
+        stats_list.append({
+            'node_name': f'/timer_node_{index}',
+            'package_name': f'package_{index % BASE_NUM_PACKAGE}',
+            'callback_name': f'/timer_node_{index}/callback_0',
+            'callback_displayname': f'{int(1000 / freq_timer)} [ms]',
+            'freq_timer': freq_timer,
+            'freq_callback': freq_timer * float(rng.uniform(0.7, 1.0)),
+            'num_huge_gap': int(rng.integers(0, 20)),
+            'period_error_avg': float(rng.normal(0, 0.1)),
+            'period_error_max': float(rng.uniform(0, 10)),
+            'jitter': float(rng.uniform(0, 1)),
+            'drift': float(rng.normal(0, 0.01)),
+            'graph_filename': f'timer_node_{index}_callback_0',
+        })
+    return stats_list
+
+
+def make_path_stats(rng: np.random.Generator, scale: int) -> list[dict]:
+    """Make stats of paths in the same format as analyze_path"""
+    stats_list = []
+    for index in range(BASE_NUM_PATH * scale):
+        target_path_name = f'path_{index}'
+        stats = {'target_path_name': target_path_name, 'node_names': [f'/node_{i}' for i in range(5)]}
+        for case in ['worst', 'best', 'total']:
+            stats.update(response_time.calc_stats(make_latency(rng, 1000, 50.0) * 1e6, case))
+        stats['filename_messageflow'] = f'{target_path_name}_messageflow'
+        stats['filename_messageflow_short'] = f'{target_path_name}_messageflow_window0'
+        stats['messageflow_window_list'] = [
+            {'filename': f'{target_path_name}_messageflow_window{window_index}', 'kind': 'response_time',
+             'start': float(rng.uniform(0, BASE_DURATION_S)), 'duration': 3.0,
+             'worst': stats['worst_max'], 'num_drop': int(rng.integers(0, 10))} for window_index in range(3)]
+        stats['filename_hist_total'] = f'{target_path_name}_hist'
+        stats['filename_hist_best'] = f'{target_path_name}_hist_best'
+        stats['filename_timeseries_best'] = f'{target_path_name}_timeseries_best'
+        stats['filename_hist_worst'] = f'{target_path_name}_hist_worst'
+        stats['filename_timeseries_worst'] = f'{target_path_name}_timeseries_worst'
+        stats_list.append(stats)
+    return stats_list
@@ -19,116 +19,45 @@ import sys
 import os
 from pathlib import Path
 import argparse
+import collections
 import logging
-import statistics
-import yaml
-import pandas as pd
+import numpy as np
 from bokeh.plotting import Figure, figure
 from caret_analyze import Architecture, Application
-from caret_analyze.runtime.communication import Communication
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
-from common import utils
+from common import utils, results_db, profiler
+from common.catalog import Catalog, make_catalog
+from common.event_filter import make_package_event_filter
+from common.manifest import Manifest, make_common_inputs
+from common import frequency
+from common.frequency import calc_frequency, FrequencyMemo
+from common.trace_cache import TraceCache, extract_communication_records
+from common.trace_stream import CommunicationStream
 
 _logger: logging.Logger = None
 
 
-def calc_frequency(timestamp_df: pd.DataFrame,
-                   timestamp_name: str) -> tuple[list[float], list[int]]:
-    """Measure frequency per 1 second"""
-    timestamp_list: list[float] = []
-    frequency_list: list[int] = []
-
-    timestamp_name = [s for s in timestamp_df.columns if timestamp_name in s][0]
-    timestamp_series = timestamp_df[timestamp_name]
-    timestamp_series = timestamp_series.sort_values()   # it seems time stamp is not sorted (?)
-
-    if len(timestamp_series) < 2:
-        return [], []
-    timestamp_series *= 1e-9    # from [nsec] to [sec]
-    timestamp_series -= timestamp_series[0]    # treat the first data as 0 [sec]
+def calc_pub_freq(pub_timestamps: np.ndarray, window_s: float = 1.0,
+                  step_s: float = 0.0) -> tuple[np.ndarray, np.ndarray]:
+    """Measure frequency of publishment"""
+    return calc_frequency(pub_timestamps, window_s, step_s)
 
-    timestamp_start_1sec = timestamp_series[0]
-    timestamp_list.append(timestamp_start_1sec)
-    frequency_list.append(1)
 
-    for timestamp in timestamp_series:
-        if (timestamp - timestamp_start_1sec) < 1.0:
-            # keep incrementing frequency for the current 1 second term
-            frequency_list[-1] += 1
-        else:
-            # it reaches the next 1 second term
-            timestamp_start_1sec = timestamp
-            timestamp_list.append(timestamp_start_1sec)
-            frequency_list.append(1)
+def calc_sub_freq(sub_timestamps: np.ndarray, window_s: float = 1.0,
+                  step_s: float = 0.0) -> tuple[np.ndarray, np.ndarray]:
+    """Measure frequency of subscription"""
+    return calc_frequency(sub_timestamps, window_s, step_s)
 
-    return timestamp_list, frequency_list
 
+def match_pubsub_freq(pub_freq: tuple[np.ndarray, np.ndarray],
+                      sub_freq: tuple[np.ndarray, np.ndarray],
+                      maximum_gap_time: float = 1.0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Make pubsub freq list whose timestamps match (see frequency.match_pubsub_freq)"""
+    return frequency.match_pubsub_freq(pub_freq, sub_freq, maximum_gap_time, _logger)
 
-def calc_pub_freq(timestamp_df: pd.DataFrame) -> tuple[list[float], list[int]]:
-    """Measure frequency of publishment"""
-    return calc_frequency(timestamp_df, 'rclcpp_publish_timestamp')
 
-
-def calc_sub_freq(timestamp_df: pd.DataFrame) -> tuple[list[float], list[int]]:
-    """Measure frequency of subscription"""
-    return calc_frequency(timestamp_df, 'callback_start_timestamp')
-
-
-def match_pubsub_freq(pub_freq: tuple[list[float], list[int]],
-                      sub_freq: tuple[list[float], list[int]]):
-    """
-    Make pubsub freq list whose timestamps match
-
-    Parameters
-    ----------
-    timestamp_df : pd.DataFrame
-        pandas data frame retrieved from CARET
-
-    Returns
-    -------
-    timestamp_list : list[float]
-        list of timestamp [sec]
-    pub_freq_list : list[float]
-        list of publishment frequency [Hz]
-    sub_freq_list : list[float]
-        list of subscription frequency [Hz]
-
-    Note
-    ---
-    In case there is not correspondib subscription(*), the publish event is ignored
-    (*: gap between publishment timestamp and subscription timestamp > 1 sec)
-    """
-    timestamp_list = []
-    pub_freq_list = []
-    sub_freq_list = []
-    index_to_start_check = 0
-    maximum_gap_time = 1.0  # 1sec
-    for index_pub in range(len(pub_freq[0])):
-        pub_time = pub_freq[0][index_pub]
-        matched_sub_index = -1
-        for index_sub in range(index_to_start_check, len(sub_freq[0])):
-            gap_time = sub_freq[0][index_sub] - pub_time
-            if gap_time < 0:
-                continue
-            gap_time_next = sub_freq[0][index_sub + 1] - pub_time if index_sub < len(sub_freq[0]) - 1 else -1
-            if gap_time_next < 0:
-                break    # ignore the last 1 sec because frequency may be calculated incorrectly
-            if gap_time < gap_time_next and gap_time < maximum_gap_time:
-                matched_sub_index = index_sub
-                break
-        if matched_sub_index != -1:
-            index_to_start_check = matched_sub_index + 1
-            timestamp_list.append(pub_time)
-            pub_freq_list.append(pub_freq[1][index_pub])
-            sub_freq_list.append(sub_freq[1][matched_sub_index])
-        elif gap_time_next > 0:
-            _logger.warning('Corresponding subscription is not found')
-
-    return timestamp_list, pub_freq_list, sub_freq_list
-
-
-def make_graph(pub_freq: tuple[list[float], list[int]],
-               sub_freq: tuple[list[float], list[int]]) -> Figure:
+def make_graph(pub_freq: tuple[np.ndarray, np.ndarray],
+               sub_freq: tuple[np.ndarray, np.ndarray]) -> Figure:
     """Create timeseries graph(pub/sub freq vs time)"""
     graph = figure(x_axis_label="Time [sec]", y_axis_label="Frequency [Hz]",
                    width=1000, height=300, active_scroll='wheel_zoom')
@@ -138,7 +67,7 @@ def make_graph(pub_freq: tuple[list[float], list[int]],
     return graph
 
 
-def create_stats(title, package_dict,  graph_filename, topic_name, publisher_name,
+def create_stats(title, catalog: Catalog, graph_filename, topic_name, publisher_name,
                  node_name, callback_name, callback_displayname,
                  publishment_freq, subscription_freq, num_huge_gap) -> dict:
     """Create stats"""
@@ -148,7 +77,7 @@ def create_stats(title, package_dict,  graph_filename, topic_name, publisher_nam
         'topic_name': topic_name,
         'publisher_name': publisher_name,
         'node_name': node_name,
-        'package_name': utils.nodename2packagename(package_dict, node_name),
+        'package_name': catalog.get_package_name(node_name),
         'callback_name': callback_name,
         'callback_displayname': callback_displayname,
         'publishment_freq': publishment_freq,
@@ -158,23 +87,28 @@ def create_stats(title, package_dict,  graph_filename, topic_name, publisher_nam
     return stats
 
 
-def analyze_communication(args, dest_dir, package_dict, communication: Communication) -> tuple(dict, bool):
-    """Analyze a subscription callback function"""
-    title = f'{communication.topic_name} : {communication.publish_node_name} -> {communication.subscribe_node_name}'
-    graph_filename = communication.topic_name.replace('/', '_')[1:] + communication.subscribe_node_name.replace('/', '_')
+def analyze_communication(args, dest_dir, catalog: Catalog, communication_record: dict,
+                          freq_memo: FrequencyMemo) -> tuple(dict, bool):
+    """Analyze a subscription callback function (frequency of publisher and subscription is shared using freq_memo)"""
+    topic_name = communication_record['topic_name']
+    publish_node_name = communication_record['publish_node_name']
+    subscribe_node_name = communication_record['subscribe_node_name']
+    title = f'{topic_name} : {publish_node_name} -> {subscribe_node_name}'
+    graph_filename = topic_name.replace('/', '_')[1:] + subscribe_node_name.replace('/', '_')
     graph_filename = graph_filename[:250]
-    callback_name = communication.callback_subscription.callback_name
-    display_name = utils.make_callback_displayname(communication.callback_subscription)
+    callback_name = communication_record['callback_name']
+    display_name = communication_record['callback_displayname']
     _logger.debug(f'Processing {title}')
 
-    try:
-        pub_df = communication.publisher.to_dataframe()
-        sub_df = communication.subscription.to_dataframe()
-        pub_freq = calc_pub_freq(pub_df)
-        sub_freq = calc_sub_freq(sub_df)
-    except:
-        _logger.warning(f'Failed to get pub/sub data: {title}')
-        return None, None
+    if 'pub_frequency' in communication_record:
+        # Streaming mode: frequency has been accumulated chunk by chunk
+        pub_freq = communication_record['pub_frequency'].to_frequency()
+        sub_freq = communication_record['sub_frequency'].to_frequency()
+    else:
+        pub_freq = freq_memo.calc_frequency(topic_name, ('pub', publish_node_name),
+                                            communication_record['pub_timestamps'])
+        sub_freq = freq_memo.calc_frequency(topic_name, ('sub', callback_name),
+                                            communication_record['sub_timestamps'])
 
     if len(pub_freq[0]) < 2 or len(sub_freq[0]) < 2:
         _logger.warning(f'Not enough data {title}')
@@ -182,10 +116,11 @@ def analyze_communication(args, dest_dir, package_dict, communication: Communica
         return None, None
 
     # Check gap between pub/sub freq
-    matched_pubsub_freq = match_pubsub_freq(pub_freq, sub_freq)
+    maximum_gap_time = args.freq_step if args.freq_step > 0 else args.freq_window
+    matched_pubsub_freq = match_pubsub_freq(pub_freq, sub_freq, maximum_gap_time)
     if len(matched_pubsub_freq[0]) < 2:
         _logger.warning(f'Not enough matching {title}')
-        _logger.warning('  # of matched_pubsub_freq = ' + str(len(pub_freq[0])))
+        _logger.warning('  # of matched_pubsub_freq = ' + str(len(matched_pubsub_freq[0])))
         return None, None
 
     # Save graph file
@@ -194,13 +129,13 @@ def analyze_communication(args, dest_dir, package_dict, communication: Communica
 
 
     # Check if sub freq is lower than pub freq
-    mean_pub_freq = statistics.mean(matched_pubsub_freq[1])
-    mean_sub_freq = statistics.mean(matched_pubsub_freq[2])
+    mean_pub_freq = float(np.mean(matched_pubsub_freq[1]))
+    mean_sub_freq = float(np.mean(matched_pubsub_freq[2]))
     freq_threshold = mean_pub_freq * (1 - args.gap_threshold_ratio)
-    num_huge_gap = sum(freq_callback <= freq_threshold for freq_callback in matched_pubsub_freq[2])
+    num_huge_gap = int(np.count_nonzero(matched_pubsub_freq[2] <= freq_threshold))
 
-    stats = create_stats(title, package_dict, graph_filename, communication.topic_name,
-                         communication.publish_node_name, communication.subscribe_node_name,
+    stats = create_stats(title, catalog, graph_filename, topic_name,
+                         publish_node_name, subscribe_node_name,
                          callback_name, display_name, mean_pub_freq, mean_sub_freq, num_huge_gap)
 
     is_warning = False
@@ -209,47 +144,64 @@ def analyze_communication(args, dest_dir, package_dict, communication: Communica
     return stats, is_warning
 
 
-def analyze(args, dest_dir):
+def analyze(args, communication_record_list: list[dict], dest_dir: str, catalog: Catalog):
     """Analyze All"""
-    utils.make_destination_dir(dest_dir, args.force, _logger)
-    lttng = utils.read_trace_data(args.trace_data[0], args.start_point, args.duration, False)
-    arch = Architecture('lttng', str(args.trace_data[0]))
-    app = Application(arch, lttng)
+    manifest = Manifest(dest_dir, make_common_inputs(args), args.incremental, _logger)
 
-    package_dict, ignore_list = utils.make_package_list(args.package_list_json, _logger)
+    # Only communications whose inputs are changed from the previous run are analyzed
+    result_list = []
+    record_to_run_list = []
+    for communication_record in communication_record_list:
+        if catalog.is_ignored(communication_record['callback_name']):
+            continue
+        key = (f"{communication_record['topic_name']}:{communication_record['publish_node_name']}"
+               f"->{communication_record['subscribe_node_name']}:{communication_record['callback_name']}")
+        inputs = {
+            'package_name': catalog.get_package_name(communication_record['subscribe_node_name']),
+            'gap_threshold_ratio': args.gap_threshold_ratio,
+            'count_threshold': args.count_threshold,
+            'freq_window': args.freq_window,
+            'freq_step': args.freq_step,
+        }
+        is_found, result = manifest.lookup(key, inputs)
+        if not is_found:
+            record_to_run_list.append((len(result_list), communication_record, key, inputs))
+        result_list.append(result)
+
+    # Frequency of a topic is kept until the last communication of the topic is analyzed
+    remaining_count_dict = collections.Counter(record[1]['topic_name'] for record in record_to_run_list)
+    freq_memo = FrequencyMemo(args.freq_window, args.freq_step)
+    for index, communication_record, key, inputs in record_to_run_list:
+        with profiler.item('communication', key):
+            stats, is_warning = analyze_communication(args, dest_dir, catalog, communication_record, freq_memo)
+        manifest.update(key, inputs, [stats, is_warning])
+        result_list[index] = [stats, is_warning]
+        topic_name = communication_record['topic_name']
+        remaining_count_dict[topic_name] -= 1
+        if remaining_count_dict[topic_name] == 0:
+            freq_memo.release(topic_name)
 
     stats_all_list = []
     stats_warning_list = []
-
-    topic_name_list = []
-    for item in lttng.get_count(['topic_name']).iterrows():
-        topic_name_list.append(item[0])
-
-    for topic_name in topic_name_list:
-        try:
-            communication_list = app.get_communications(topic_name)
-        except:
-            _logger.warning(f' Failed to get communication: {topic_name}')
-            continue
-
-        for communication in communication_list:
-            if utils.check_if_ignore(package_dict, ignore_list, communication.callback_subscription.callback_name):
-                continue
-            stats, is_warning = analyze_communication(args, dest_dir, package_dict, communication)
-            if stats:
-                stats_all_list.append(stats)
-            if is_warning:
-                stats_warning_list.append(stats)
+    for stats, is_warning in result_list:
+        if stats:
+            stats_all_list.append(stats)
+        if is_warning:
+            stats_warning_list.append(stats)
 
     stats_all_list = sorted(stats_all_list, key=lambda x: x['callback_name'])
     stats_warning_list = sorted(stats_warning_list, key=lambda x: x['callback_name'])
 
-    with open(f'{dest_dir}/stats_callback_subscription.yaml', 'w', encoding='utf-8') as f_yaml:
-        yaml.safe_dump(stats_all_list, f_yaml, encoding='utf-8',
-                       allow_unicode=True, sort_keys=False)
-    with open(f'{dest_dir}/stats_callback_subscription_warning.yaml', 'w', encoding='utf-8') as f_yaml:
-        yaml.safe_dump(stats_warning_list, f_yaml, encoding='utf-8',
-                       allow_unicode=True, sort_keys=False)
+    manifest.save()
+    with results_db.ResultsDb(str(Path(dest_dir).parent)) as db:
+        db.save_communication_stats(stats_all_list, stats_warning_list)
+    results_db.export_yaml(stats_all_list, f'{dest_dir}/stats_callback_subscription.yaml')
+    results_db.export_yaml(stats_warning_list, f'{dest_dir}/stats_callback_subscription_warning.yaml')
+
+
+def analyze_stream(args, communication_stream: CommunicationStream, dest_dir: str, catalog: Catalog):
+    """Analyze All using statistics accumulated chunk by chunk"""
+    analyze(args, list(communication_stream.communication_dict.values()), dest_dir, catalog)
 
 
 def parse_arg():
@@ -262,13 +214,22 @@ def parse_arg():
                         help='Start point[sec] to load trace data')
     parser.add_argument('-d', '--duration', type=float, default=0.0,
                         help='Duration[sec] to load trace data')
+    parser.add_argument('--event_filter', action='store_true', default=False,
+                        help='Load only events of nodes which match package_list_json and are not ignored')
     parser.add_argument('-r', '--gap_threshold_ratio', type=float, default=0.2,
                         help='Warning when callback_freq is less than "gap_threshold_ratio" * timer_period for "count_threshold" times')
     parser.add_argument('-n', '--count_threshold', type=int, default=10,
                         help='Warning when callback_freq is less than "gap_threshold_ratio" * timer_period for "count_threshold" times')
+    parser.add_argument('--freq_window', type=float, default=1.0,
+                        help='Window size[sec] to measure frequency')
+    parser.add_argument('--freq_step', type=float, default=0.0,
+                        help='Step[sec] of sliding window to measure frequency (0: windows don\'t overlap)')
     parser.add_argument('-v', '--verbose', action='store_true', default=False)
     parser.add_argument('-f', '--force', action='store_true', default=False,
                         help='Overwrite report directory')
+    parser.add_argument('-i', '--incremental', action='store_true', default=False,
+                        help='Keep report directory, and analyze only entries whose inputs are changed from the previous run')
+    utils.add_common_arguments(parser)
     args = parser.parse_args()
     return args
 
@@ -286,12 +247,36 @@ def main():
     _logger.debug(f'trace_data: {args.trace_data[0]}')
     _logger.debug(f'package_list_json: {args.package_list_json}')
     _logger.debug(f'start_point: {args.start_point}, duration: {args.duration}')
+    _logger.debug(f'event_filter: {args.event_filter}')
     dest_dir = f'report_{Path(args.trace_data[0]).stem}/check_callback_sub'
     _logger.debug(f'dest_dir: {dest_dir}')
     _logger.debug(f'gap_threshold_ratio: {args.gap_threshold_ratio}')
     _logger.debug(f'count_threshold: {args.count_threshold}')
+    _logger.debug(f'freq_window: {args.freq_window}, freq_step: {args.freq_step}')
+
+    utils.apply_common_arguments(args, Path(__file__).stem, str(Path(dest_dir).parent), _logger)
+
+    utils.make_destination_dir(dest_dir, args.force, _logger, args.incremental)
+    event_filter = make_package_event_filter(*utils.make_package_list(args.package_list_json)) \
+        if args.event_filter else None
+    cache = TraceCache(args.cache_dir, args.trace_data[0], args.start_point, args.duration, _logger,
+                       event_filter)
+    communication_record_list = cache.load('communication')
+    if communication_record_list is None:
+        lttng = utils.read_trace_data(args.trace_data[0], args.start_point, args.duration, False,
+                                      event_filter, _logger)
+        with profiler.stage('load_architecture'):
+            arch = Architecture('lttng', str(args.trace_data[0]))
+            app = Application(arch, lttng)
+        catalog = make_catalog(args, str(Path(dest_dir).parent), lttng, arch, app, _logger)
+        communication_record_list = extract_communication_records(app, _logger, catalog.communication_list)
+        cache.save('communication', communication_record_list)
+    else:
+        catalog = make_catalog(args, str(Path(dest_dir).parent), logger=_logger)
 
-    analyze(args, dest_dir)
+    analyze(args, communication_record_list, dest_dir, catalog)
+    utils.stop_png_renderer()
+    profiler.save_profile(_logger)
     _logger.info('<<< OK. All nodes are analyzed >>>')
 
 
@@ -20,97 +20,167 @@ import os
 from pathlib import Path
 import argparse
 import logging
-import statistics
-import yaml
+import numpy as np
+from bokeh.plotting import Figure, figure
 from caret_analyze import Architecture, Application
-from caret_analyze.runtime.callback import CallbackBase
-from caret_analyze.plot import Plot
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
-from common import utils
+from common import utils, results_db, profiler, timer_metrics
+from common.catalog import Catalog, make_catalog
+from common.event_filter import make_package_event_filter
+from common.manifest import Manifest, make_common_inputs
+from common.trace_cache import TraceCache, extract_callback_records
+from common.trace_stream import CallbackStream
 
 _logger: logging.Logger = None
 
 
-def create_stats(callback: CallbackBase, package_dict:dict, freq_timer,
-                 freq_callback, num_huge_gap, graph_filename) -> dict:
+def make_graph(timestamp_list: np.ndarray, frequency_list: np.ndarray, freq_timer: float) -> Figure:
+    """Create timeseries graph(callback freq vs time)"""
+    graph = figure(x_axis_label='Time [sec]', y_axis_label='Frequency [Hz]',
+                   width=1000, height=300, active_scroll='wheel_zoom')
+    graph.y_range.start = 0
+    graph.line(timestamp_list, frequency_list, legend_label='callback', line_color='blue', line_width=1)
+    graph.line([timestamp_list[0], timestamp_list[-1]], [freq_timer, freq_timer], legend_label='timer',
+               line_color='gray', line_dash='dashed')
+    return graph
+
+
+def create_stats(callback_record: dict, catalog: Catalog, metrics: dict, graph_filename: str) -> dict:
     """Create stats"""
     stats = {
-        'node_name': callback.node_name,
-        'package_name': utils.nodename2packagename(package_dict, callback.node_name),
-        'callback_name': callback.callback_name,
-        'callback_displayname': utils.make_callback_displayname(callback),
-        'freq_timer': freq_timer,
-        'freq_callback': freq_callback,
-        'num_huge_gap': num_huge_gap,
+        'node_name': callback_record['node_name'],
+        'package_name': catalog.get_package_name(callback_record['node_name']),
+        'callback_name': callback_record['callback_name'],
+        'callback_displayname': callback_record['callback_displayname'],
+        'freq_timer': metrics['freq_timer'],
+        'freq_callback': metrics['freq_callback'],
+        'num_huge_gap': metrics['num_huge_gap'],
+        'period_error_avg': metrics['period_error_avg'],
+        'period_error_max': metrics['period_error_max'],
+        'jitter': metrics['jitter'],
+        'drift': metrics['drift'],
         'graph_filename': graph_filename
     }
     return stats
 
 
-def analyze_callback(args, dest_dir, package_dict: dict, callback: CallbackBase) -> tuple(dict, bool):
-    """Analyze a timer callback function"""
-    _logger.debug(f'Processing: {callback.callback_name}')
-    freq_timer = 1e9 / float(callback.timer.period_ns)
-    freq_threshold = freq_timer * (1 - args.gap_threshold_ratio)
-    p_timeseries = Plot.create_callback_frequency_plot([callback])
-    try:
-        figure = p_timeseries.show('system_time', export_path='dummy.html')
-    except:
-        _logger.warning(f'This callback is not called: {callback.callback_name}')
+def calc_stream_metrics(args, callback_record: dict) -> dict:
+    """Calculate metrics of a timer callback from statistics accumulated chunk by chunk (streaming mode)"""
+    timestamp_list, frequency_list = callback_record['timer_frequency'].to_frequency()
+    freq_timer = 1e9 / float(callback_record['period_ns'])
+    freq_callback_list = frequency_list[:-2]  # remove the last data because freq becomes small
+    period_stats = callback_record['period_stats']
+    period_timer = callback_record['period_ns'] * 1e-6
+    return {
+        'timestamp_list': timestamp_list,
+        'frequency_list': frequency_list,
+        'freq_timer': freq_timer,
+        'freq_callback': float(np.mean(freq_callback_list)) if len(freq_callback_list) > 0 else None,
+        'num_window': len(freq_callback_list),
+        'num_huge_gap': int(np.count_nonzero(freq_callback_list <= freq_timer * (1 - args.gap_threshold_ratio))),
+        'period_error_avg': float(period_stats.avg - period_timer) if period_stats.count > 0 else None,
+        'period_error_max': float(max(abs(period_stats.max - period_timer), abs(period_stats.min - period_timer)))
+                            if period_stats.count > 0 else None,
+        'jitter': float(period_stats.std) if period_stats.count > 1 else None,
+        'drift': None,    # offset from the timer grid is not kept over chunks
+    }
+
+
+def calc_metrics_list(args, callback_record_list: list[dict]) -> list[dict]:
+    """Calculate metrics of timer callbacks. All callbacks are calculated at once except in streaming mode"""
+    if len(callback_record_list) > 0 and 'timer_frequency' in callback_record_list[0]:
+        return [calc_stream_metrics(args, callback_record) for callback_record in callback_record_list]
+    # Windows are not anchored to each callback call, so that a term without call is measured as 0 Hz
+    start_timestamps_list = [callback_record['start_timestamps'] for callback_record in callback_record_list]
+    period_ns_list = [callback_record['period_ns'] for callback_record in callback_record_list]
+    return timer_metrics.calc_timer_metrics(start_timestamps_list, period_ns_list, args.freq_window,
+                                            args.freq_step if args.freq_step > 0 else args.freq_window,
+                                            args.gap_threshold_ratio)
+
+
+def analyze_callback(args, dest_dir, catalog: Catalog, callback_record: dict, metrics: dict) -> tuple(dict, bool):
+    """Analyze a timer callback function using metrics calculated by calc_metrics_list"""
+    callback_name = callback_record['callback_name']
+    _logger.debug(f'Processing: {callback_name}')
+    if 'start_timestamps' in callback_record and len(callback_record['start_timestamps']) == 0:
+        _logger.warning(f'This callback is not called: {callback_name}')
+        return None, False
+    if len(metrics['timestamp_list']) == 0:
+        _logger.warning(f'Not enough data: {callback_name}')
         return None, False
-    figure.y_range.start = 0
-    graph_filename = callback.callback_name.replace("/", "_")[1:]
+    figure_timeseries = make_graph(metrics['timestamp_list'], metrics['frequency_list'], metrics['freq_timer'])
+    graph_filename = callback_name.replace("/", "_")[1:]
     graph_filename = graph_filename[:250]
-    utils.export_graph(figure, dest_dir, graph_filename, _logger)
+    utils.export_graph(figure_timeseries, dest_dir, graph_filename, callback_name, _logger)
 
-    measurement = p_timeseries.to_dataframe().dropna()
-    freq_callback_list = measurement.iloc[:-2, 1]  # remove the last data because freq becomes small
-    if len(freq_callback_list) < 2:
-        _logger.warning(f'Not enough data: {callback.callback_name}')
+    if metrics['num_window'] < 2:
+        _logger.warning(f'Not enough data: {callback_name}')
         return None, False
-    freq_callback_avg = statistics.mean(freq_callback_list)
-    num_huge_gap = sum(freq_callback <= freq_threshold for freq_callback in freq_callback_list)
 
-    stats = create_stats(callback, package_dict, freq_timer, freq_callback_avg, num_huge_gap, graph_filename)
+    stats = create_stats(callback_record, catalog, metrics, graph_filename)
 
     is_warning = False
-    if num_huge_gap >= args.count_threshold:
+    if metrics['num_huge_gap'] >= args.count_threshold:
         is_warning = True
     return stats, is_warning
 
 
-def analyze(args, dest_dir):
+def analyze(args, callback_record_list: list[dict], dest_dir: str, catalog: Catalog):
     """Analyze All"""
-    utils.make_destination_dir(dest_dir, args.force, _logger)
-    lttng = utils.read_trace_data(args.trace_data[0], args.start_point, args.duration, False)
-    arch = Architecture('lttng', str(args.trace_data[0]))
-    app = Application(arch, lttng)
+    manifest = Manifest(dest_dir, make_common_inputs(args), args.incremental, _logger)
 
-    package_dict, ignore_list = utils.make_package_list(args.package_list_json, _logger)
+    # Only callbacks whose inputs are changed from the previous run are analyzed
+    result_dict = {}
+    inputs_dict = {}
+    record_to_run_list = []
+    for callback_record in callback_record_list:
+        if catalog.is_ignored(callback_record['callback_name']):
+            continue
+        if 'timer_callback' == callback_record['callback_type']:
+            inputs = {
+                'package_name': catalog.get_package_name(callback_record['node_name']),
+                'gap_threshold_ratio': args.gap_threshold_ratio,
+                'count_threshold': args.count_threshold,
+                'freq_window': args.freq_window,
+                'freq_step': args.freq_step,
+            }
+            is_found, result = manifest.lookup(callback_record['callback_name'], inputs)
+            if is_found:
+                result_dict[callback_record['callback_name']] = result
+            else:
+                inputs_dict[callback_record['callback_name']] = inputs
+                record_to_run_list.append(callback_record)
+
+    with profiler.stage('timer_metrics'):
+        metrics_list = calc_metrics_list(args, record_to_run_list)
+    for callback_record, metrics in zip(record_to_run_list, metrics_list):
+        with profiler.item('callback', callback_record['callback_name']):
+            stats, is_warning = analyze_callback(args, dest_dir, catalog, callback_record, metrics)
+        manifest.update(callback_record['callback_name'], inputs_dict[callback_record['callback_name']],
+                        [stats, is_warning])
+        result_dict[callback_record['callback_name']] = [stats, is_warning]
 
     stats_all_list = []
     stats_warning_list = []
-
-    callbacks = app.callbacks
-    for callback in callbacks:
-        if utils.check_if_ignore(package_dict, ignore_list, callback.callback_name):
-            continue
-        if 'timer_callback' == callback.callback_type.type_name:
-            stats, is_warning = analyze_callback(args, dest_dir, package_dict, callback)
-            if stats:
-                stats_all_list.append(stats)
-            if is_warning:
-                stats_warning_list.append(stats)
+    for stats, is_warning in result_dict.values():
+        if stats:
+            stats_all_list.append(stats)
+        if is_warning:
+            stats_warning_list.append(stats)
 
     stats_all_list = sorted(stats_all_list, key=lambda x: x['callback_name'])
     stats_warning_list = sorted(stats_warning_list, key=lambda x: x['callback_name'])
 
-    with open(f'{dest_dir}/stats_callback_timer.yaml', 'w', encoding='utf-8') as f_yaml:
-        yaml.safe_dump(stats_all_list, f_yaml, encoding='utf-8',
-                       allow_unicode=True, sort_keys=False)
-    with open(f'{dest_dir}/stats_callback_timer_warning.yaml', 'w', encoding='utf-8') as f_yaml:
-        yaml.safe_dump(stats_warning_list, f_yaml, encoding='utf-8',
-                       allow_unicode=True, sort_keys=False)
+    manifest.save()
+    with results_db.ResultsDb(str(Path(dest_dir).parent)) as db:
+        db.save_timer_stats(stats_all_list, stats_warning_list)
+    results_db.export_yaml(stats_all_list, f'{dest_dir}/stats_callback_timer.yaml')
+    results_db.export_yaml(stats_warning_list, f'{dest_dir}/stats_callback_timer_warning.yaml')
+
+
+def analyze_stream(args, callback_stream: CallbackStream, dest_dir: str, catalog: Catalog):
+    """Analyze All using statistics accumulated chunk by chunk"""
+    analyze(args, list(callback_stream.callback_dict.values()), dest_dir, catalog)
 
 
 def parse_arg():
@@ -123,13 +193,22 @@ def parse_arg():
                         help='Start point[sec] to load trace data')
     parser.add_argument('-d', '--duration', type=float, default=0.0,
                         help='Duration[sec] to load trace data')
+    parser.add_argument('--event_filter', action='store_true', default=False,
+                        help='Load only events of nodes which match package_list_json and are not ignored')
     parser.add_argument('-r', '--gap_threshold_ratio', type=float, default=0.2,
                         help='Warning when callback_freq is less than "gap_threshold_ratio" * timer_period for "count_threshold" times')
     parser.add_argument('-n', '--count_threshold', type=int, default=10,
                         help='Warning when callback_freq is less than "gap_threshold_ratio" * timer_period for "count_threshold" times')
+    parser.add_argument('--freq_window', type=float, default=1.0,
+                        help='Window size[sec] to measure frequency')
+    parser.add_argument('--freq_step', type=float, default=0.0,
+                        help='Step[sec] of sliding window to measure frequency (0: windows don\'t overlap)')
     parser.add_argument('-v', '--verbose', action='store_true', default=False)
     parser.add_argument('-f', '--force', action='store_true', default=False,
                         help='Overwrite report directory')
+    parser.add_argument('-i', '--incremental', action='store_true', default=False,
+                        help='Keep report directory, and analyze only entries whose inputs are changed from the previous run')
+    utils.add_common_arguments(parser)
     args = parser.parse_args()
     return args
 
@@ -147,12 +226,39 @@ def main():
     _logger.debug(f'trace_data: {args.trace_data[0]}')
     _logger.debug(f'package_list_json: {args.package_list_json}')
     _logger.debug(f'start_point: {args.start_point}, duration: {args.duration}')
+    _logger.debug(f'event_filter: {args.event_filter}')
     dest_dir = f'report_{Path(args.trace_data[0]).stem}/check_callback_timer'
     _logger.debug(f'dest_dir: {dest_dir}')
     _logger.debug(f'gap_threshold_ratio: {args.gap_threshold_ratio}')
     _logger.debug(f'count_threshold: {args.count_threshold}')
+    _logger.debug(f'freq_window: {args.freq_window}, freq_step: {args.freq_step}')
+
+    utils.apply_common_arguments(args, Path(__file__).stem, str(Path(dest_dir).parent), _logger)
+
+    utils.make_destination_dir(dest_dir, args.force, _logger, args.incremental)
+    event_filter = make_package_event_filter(*utils.make_package_list(args.package_list_json)) \
+        if args.event_filter else None
+    cache = TraceCache(args.cache_dir, args.trace_data[0], args.start_point, args.duration, _logger,
+                       event_filter)
+    # Records of all callbacks are cached by make_report. Otherwise only timer callbacks are extracted and cached
+    callback_record_list = cache.load('callback')
+    if callback_record_list is None:
+        callback_record_list = cache.load('timer_callback')
+    if callback_record_list is None:
+        lttng = utils.read_trace_data(args.trace_data[0], args.start_point, args.duration, False,
+                                      event_filter, _logger)
+        with profiler.stage('load_architecture'):
+            arch = Architecture('lttng', str(args.trace_data[0]))
+            app = Application(arch, lttng)
+        catalog = make_catalog(args, str(Path(dest_dir).parent), lttng, arch, app, _logger)
+        callback_record_list = extract_callback_records(app, _logger, catalog.get_callback_list('timer_callback'))
+        cache.save('timer_callback', callback_record_list)
+    else:
+        catalog = make_catalog(args, str(Path(dest_dir).parent), logger=_logger)
 
-    analyze(args, dest_dir)
+    analyze(args, callback_record_list, dest_dir, catalog)
+    utils.stop_png_renderer()
+    profiler.save_profile(_logger)
     _logger.info('<<< OK. All nodes are analyzed >>>')
 
 
@@ -14,17 +14,21 @@
 """
 Script to make report page
 """
-import glob
+from __future__ import annotations
+import os
 import argparse
 from pathlib import Path
 import sys
-import yaml
 import flask
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+from common import profiler, graph_bundle
+from common.results_db import ResultsDb
 
 app = flask.Flask(__name__)
 
 
-def render_page(stats, report_name, destination_path, template_path):
+@profiler.stage_function('render_page')
+def render_page(stats, report_name, destination_path, template_path, graph_bundle_script=''):
     """Render html page"""
     with app.app_context():
         with open(template_path, 'r', encoding='utf-8') as f_html:
@@ -32,26 +36,23 @@ def render_page(stats, report_name, destination_path, template_path):
             rendered = flask.render_template_string(
                 template_string,
                 title=f'Check Timer Callback: {report_name}',
-                stats=stats
+                stats=stats,
+                graph_bundle_script=graph_bundle_script
             )
 
         with open(destination_path, 'w', encoding='utf-8') as f_html:
             f_html.write(rendered)
 
 
-def make_report(stats_path: str, index_filename: str='index'):
+def make_report(report_dir: str, stats: list[dict], index_filename: str='index', graph_bundle_script: str=''):
     """Make report page"""
-    stats = None
-    with open(stats_path, 'r', encoding='utf-8') as f_yaml:
-        stats = yaml.safe_load(f_yaml)
-
-    stats_dir = Path(stats_path).resolve().parent
-    report_name = stats_path.split('/')[-3]
+    stats_dir = f'{report_dir}/check_callback_timer'
+    report_name = Path(report_dir).resolve().name
 
     # report using graph as html
     destination_path = f'{stats_dir}/{index_filename}.html'
     template_path = f'{Path(__file__).resolve().parent}/template_report_timer.html'
-    render_page(stats, report_name, destination_path, template_path)
+    render_page(stats, report_name, destination_path, template_path, graph_bundle_script)
 
 
 def parse_arg():
@@ -63,22 +64,23 @@ def parse_arg():
     return args
 
 
+def make_reports(report_dir: str):
+    """Make report pages (all callbacks and callbacks with warning)"""
+    if not ResultsDb.exists(report_dir) or not os.path.isdir(f'{report_dir}/check_callback_timer'):
+        print('Warning. No stats exists.', file=sys.stderr)
+    else:
+        # Both pages show graphs in the same bundle
+        graph_bundle_script = graph_bundle.make_graph_bundle(f'{report_dir}/check_callback_timer')
+        with ResultsDb(report_dir) as db:
+            make_report(report_dir, db.load_timer_stats(), 'index', graph_bundle_script)
+            make_report(report_dir, db.load_timer_stats(warning_only=True), 'index_warning', graph_bundle_script)
+        print('<<< OK. report page is created >>>')
+
+
 def main():
     """Main function"""
     args = parse_arg()
-
-    report_dir = args.report_directory[0]
-    stats_all_path_list = glob.glob(f'{report_dir}/**/stats_callback_timer.yaml',
-                                      recursive=True)
-    stats_warning_path_list = glob.glob(f'{report_dir}/**/stats_callback_timer_warning.yaml',
-                                          recursive=True)
-
-    if len(stats_all_path_list) == 0 or len(stats_warning_path_list)== 0:
-        print('Warning. No stats file exists.', file=sys.stderr)
-    else:
-        make_report(stats_all_path_list[0], 'index')
-        make_report(stats_warning_path_list[0], 'index_warning')
-        print('<<< OK. report page is created >>>')
+    make_reports(args.report_directory[0])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,180 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Catalog of nodes, topics, callbacks and communications in trace data
+
+Package names and ignore flags are classified once with precompiled regular expressions and cached.
+The catalog is saved as catalog.json in the report directory, so that each analysis script reuses it.
+"""
+from __future__ import annotations
+import os
+import re
+import json
+import logging
+from caret_analyze import Lttng, Architecture, Application
+from common import utils, profiler
+from common.manifest import make_common_inputs
+from common.trace_cache import make_callback_info
+
+CATALOG_VERSION = 3
+CATALOG_FILENAME = 'catalog.json'
+
+
+class Catalog:
+    """Nodes, topics, callbacks and communications with package names and ignore flags"""
+
+    def __init__(self, package_dict: dict, ignore_list: list[str], inputs: dict = None):
+        self.package_dict = package_dict
+        self.ignore_list = ignore_list
+        self.inputs = inputs or {}
+        self._package_regexp_list = [(package_name, re.compile(regexp))
+                                     for package_name, regexp in package_dict.items()]
+        self._ignore_regexp = re.compile('|'.join(f'(?:{ignore})' for ignore in ignore_list)) \
+            if ignore_list else None
+        self._name_dict: dict[str, tuple[list[str], bool]] = {}    # name: (package names, is_ignored)
+
+        self.is_indexed = False
+        self.node_name_list: list[str] = []
+        self.topic_name_list: list[str] = []
+        self.callback_dict: dict[str, dict] = {}    # callback_name: callback information
+        self.communication_list: list[dict] = []
+
+    def _classify(self, name: str) -> tuple[list[str], bool]:
+        classification = self._name_dict.get(name)
+        if classification is None:
+            package_name_list = [package_name for package_name, regexp in self._package_regexp_list
+                                 if regexp.search(name)]
+            is_ignored = bool(self._ignore_regexp and self._ignore_regexp.search(name))
+            classification = (package_name_list, is_ignored)
+            self._name_dict[name] = classification
+        return classification
+
+    def get_package_name(self, node_name: str) -> str:
+        """Convert node name to package name (the first package which matches, '' if nothing matches)"""
+        package_name_list, _ = self._classify(node_name)
+        return package_name_list[0] if package_name_list else ''
+
+    def is_ignored(self, name: str) -> bool:
+        """Check if the node or callback should be ignored"""
+        return self._classify(name)[1]
+
+    def get_node_name_list(self, package_name: str, node_name_list: list[str] = None) -> list[str]:
+        """Get sorted node names which match the package and are not ignored (indexed nodes are used if node_name_list is None)"""
+        if node_name_list is None:
+            node_name_list = self.node_name_list
+        return sorted(node_name for node_name in node_name_list
+                      if package_name in self._classify(node_name)[0] and not self.is_ignored(node_name))
+
+    def get_callback_list(self, callback_type: str = None) -> list[dict]:
+        """Get callbacks of the type (e.g. 'timer_callback'). All callbacks are returned if callback_type is None"""
+        return [callback for callback in self.callback_dict.values()
+                if callback_type is None or callback['callback_type'] == callback_type]
+
+    @profiler.stage_function('index_catalog')
+    def index(self, lttng: Lttng, arch: Architecture, app: Application, logger: logging.Logger = None):
+        """Index nodes, topics, callbacks and communications in trace data"""
+        self.node_name_list = sorted({node.node_name for node in lttng.get_nodes()})
+        self.topic_name_list = [item[0] for item in lttng.get_count(['topic_name']).iterrows()]
+
+        self.callback_dict = {}
+        for callback in app.callbacks:
+            callback_info = make_callback_info(callback)
+            callback_info['package_name'] = self.get_package_name(callback.node_name)
+            callback_info['is_ignored'] = self.is_ignored(callback.callback_name)
+            self.callback_dict[callback.callback_name] = callback_info
+
+        topic_name_set = set(self.topic_name_list)
+        self.communication_list = []
+        for communication in arch.communications:
+            if communication.topic_name not in topic_name_set:
+                continue
+            callback_name = communication.subscribe_callback_name
+            self.communication_list.append({
+                'topic_name': communication.topic_name,
+                'publish_node_name': communication.publish_node_name,
+                'subscribe_node_name': communication.subscribe_node_name,
+                'callback_name': callback_name,
+                'package_name': self.get_package_name(communication.subscribe_node_name),
+                'is_ignored': self.is_ignored(callback_name) if callback_name else False,
+            })
+        self.is_indexed = True
+        if logger:
+            logger.debug(f'Catalog: {len(self.node_name_list)} nodes, {len(self.topic_name_list)} topics, '
+                         f'{len(self.callback_dict)} callbacks, {len(self.communication_list)} communications')
+
+    def save(self, report_dir: str):
+        """Save as catalog.json in the report directory"""
+        catalog = {
+            'version': CATALOG_VERSION,
+            'inputs': self.inputs,
+            'package_dict': self.package_dict,
+            'ignore_list': self.ignore_list,
+            'is_indexed': self.is_indexed,
+            'node_name_list': self.node_name_list,
+            'topic_name_list': self.topic_name_list,
+            'callback_dict': self.callback_dict,
+            'communication_list': self.communication_list,
+        }
+        with open(f'{report_dir}/{CATALOG_FILENAME}', 'w', encoding='UTF-8') as f_json:
+            json.dump(catalog, f_json)
+
+    @staticmethod
+    def load(report_dir: str, package_dict: dict, ignore_list: list[str], inputs: dict,
+             logger: logging.Logger = None) -> Catalog:
+        """Load catalog.json. None is returned if it doesn't exist or it's made for other inputs"""
+        catalog_path = f'{report_dir}/{CATALOG_FILENAME}'
+        if not os.path.isfile(catalog_path):
+            return None
+        try:
+            with open(catalog_path, encoding='UTF-8') as f_json:
+                catalog_json = json.load(f_json)
+        except:
+            if logger:
+                logger.warning(f'Unable to read catalog: {catalog_path}')
+            return None
+        if catalog_json['version'] != CATALOG_VERSION or catalog_json['inputs'] != inputs \
+                or catalog_json['package_dict'] != package_dict or catalog_json['ignore_list'] != ignore_list:
+            return None
+        catalog = Catalog(package_dict, ignore_list, inputs)
+        catalog.is_indexed = catalog_json['is_indexed']
+        catalog.node_name_list = catalog_json['node_name_list']
+        catalog.topic_name_list = catalog_json['topic_name_list']
+        catalog.callback_dict = catalog_json['callback_dict']
+        catalog.communication_list = catalog_json['communication_list']
+        if logger:
+            logger.info(f'Use catalog: {catalog_path}')
+        return catalog
+
+
+def make_catalog(args, report_dir: str, lttng: Lttng = None, arch: Architecture = None,
+                 app: Application = None, logger: logging.Logger = None) -> Catalog:
+    """
+    Get catalog saved in the report directory, or make a new one
+
+    Trace data is indexed when lttng, arch and app are given.
+    Otherwise, the catalog is used only to classify package names and ignore flags
+    """
+    package_dict, ignore_list = utils.make_package_list(args.package_list_json, logger)
+    # Inputs are converted in the same way as JSON to compare with the saved catalog
+    inputs = json.loads(json.dumps(make_common_inputs(args)))
+    os.makedirs(report_dir, exist_ok=True)
+    catalog = Catalog.load(report_dir, package_dict, ignore_list, inputs, logger)
+    if catalog is None:
+        catalog = Catalog(package_dict, ignore_list, inputs)
+    elif catalog.is_indexed or lttng is None:
+        return catalog
+    if lttng is not None:
+        catalog.index(lttng, arch, app, logger)
+    catalog.save(report_dir)
+    return catalog
@@ -0,0 +1,84 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Functions to downsample lines and markers in graphs keeping peaks (no dependency on caret_analyze)
+"""
+from __future__ import annotations
+import numpy as np
+from bokeh.plotting import Figure
+from bokeh.models import GlyphRenderer
+from bokeh.models.glyphs import Line, Marker
+
+
+def downsample_lttb(x_list: np.ndarray, y_list: np.ndarray, num_points: int) -> np.ndarray:
+    """
+    Select points to draw line using Largest-Triangle-Three-Buckets algorithm
+
+    The first and the last points are always selected, and one point is selected from each bucket
+    so that the triangle made with the previous selected point and the average of the next bucket is the largest.
+    Peaks are kept because they make large triangles.
+
+    Returns
+    -------
+    index_list : np.ndarray
+        indices of the selected points (sorted)
+    """
+    num_data = len(x_list)
+    if num_points >= num_data or num_points < 3:
+        return np.arange(num_data)
+    x_list = np.asarray(x_list, dtype=float)
+    y_list = np.asarray(y_list, dtype=float)
+    # Buckets for points except the first and the last
+    bucket_edge_list = np.linspace(1, num_data - 1, num_points - 1).astype(np.int64)
+    index_list = np.zeros(num_points, dtype=np.int64)
+    index_list[-1] = num_data - 1
+    index_a = 0
+    for i in range(num_points - 2):
+        start, end = bucket_edge_list[i], bucket_edge_list[i + 1]
+        if i + 2 < len(bucket_edge_list):
+            next_start, next_end = bucket_edge_list[i + 1], bucket_edge_list[i + 2]
+        else:
+            next_start, next_end = num_data - 1, num_data
+        x_c = np.mean(x_list[next_start:next_end])
+        y_c = np.mean(y_list[next_start:next_end])
+        area_list = np.abs((x_list[index_a] - x_c) * (y_list[start:end] - y_list[index_a])
+                           - (x_list[index_a] - x_list[start:end]) * (y_c - y_list[index_a]))
+        index_a = start + int(np.argmax(area_list))
+        index_list[i + 1] = index_a
+    return index_list
+
+
+def downsample_figure(figure: Figure, max_points: int):
+    """
+    Downsample data of line and marker (e.g. circle and scatter) graphs in the figure
+    which have more than max_points points
+
+    Markers are selected with LTTB in the same way as lines, so a line and markers on the same data keep the same points
+    """
+    for renderer in figure.renderers:
+        if not isinstance(renderer, GlyphRenderer) or not isinstance(renderer.glyph, (Line, Marker)):
+            continue
+        x_name, y_name = renderer.glyph.x, renderer.glyph.y
+        data = renderer.data_source.data
+        if not isinstance(x_name, str) or not isinstance(y_name, str) or x_name not in data or y_name not in data:
+            continue
+        if len(data[x_name]) <= max_points:
+            continue
+        x_list = np.asarray(data[x_name], dtype=float)
+        y_list = np.asarray(data[y_name], dtype=float)
+        # NaN (gap of line) is not drawn, so it's removed before selecting points
+        is_valid_list = np.isfinite(x_list) & np.isfinite(y_list)
+        valid_index_list = np.flatnonzero(is_valid_list)
+        index_list = valid_index_list[downsample_lttb(x_list[is_valid_list], y_list[is_valid_list], max_points)]
+        renderer.data_source.data = {name: np.asarray(column)[index_list] for name, column in data.items()}
@@ -0,0 +1,188 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Event filter to load only events of nodes (and topics) to be analyzed (enabled by --event_filter option)
+
+Initialization events are always loaded, so that architecture and names of all nodes are kept.
+Handles created by initialization events are linked to their node, and runtime events
+(callback, publish and take) of nodes not to be analyzed are rejected while loading trace data.
+Publish events of such nodes are kept when the topic is subscribed by a node to be analyzed,
+so that communications to the node are still measured.
+Runtime events whose handle is not known (e.g. initialization events are not recorded) are always loaded.
+"""
+from __future__ import annotations
+from typing import Callable
+import re
+import json
+from caret_analyze import Architecture, LttngEventFilter
+from common.catalog import Catalog
+
+# Runtime events to be filtered and the field to find its handle
+_RUNTIME_EVENT_DICT = {
+    'ros2:callback_start': 'callback',
+    'ros2:callback_end': 'callback',
+    'ros2:dispatch_subscription_callback': 'callback',
+    'ros2:dispatch_intra_process_subscription_callback': 'callback',
+    'ros2:rclcpp_publish': 'publisher_handle',
+    'ros2:rclcpp_intra_publish': 'publisher_handle',
+    'ros2:rcl_publish': 'publisher_handle',
+    'ros2:rmw_take': 'rmw_subscription_handle',
+}
+
+
+class NodeEventFilter(LttngEventFilter):
+    """
+    Reject runtime events of nodes and topics not to be analyzed
+
+    node_filter returns False for nodes not to be analyzed.
+    topic_filter returns False for topics whose publish events are not needed
+    (subscriptions are kept, because they may be a part of callback chains in the node).
+    key describes the filter, and it's used to distinguish cache made with the filter
+    """
+
+    def __init__(self, node_filter: Callable[[str], bool], topic_filter: Callable[[str], bool] = None,
+                 key: str = ''):
+        self.node_filter = node_filter
+        self.topic_filter = topic_filter if topic_filter else lambda topic_name: True
+        self.key = key
+        self.num_rejected = 0
+        # Handles are unique only in a process, so all handles are stored with vpid
+        self._rejected_set: set[tuple] = set()    # (vpid, field name, handle) of runtime events to be rejected
+        self._excluded_node_set: set[tuple] = set()
+        self._excluded_subscription_set: set[tuple] = set()
+        self._excluded_timer_set: set[tuple] = set()
+        self._excluded_service_set: set[tuple] = set()
+        self._timer_callback_dict: dict[tuple, int] = {}
+        self._subscribed_topic_set: set[str] = set()    # topics subscribed by nodes to be analyzed
+        self._pending_publisher_dict: dict[str, list[tuple]] = {}    # topic name: publishers rejected for now
+        self._init_handler_dict = {}
+        for name, handler in [('rcl_node_init', self._on_node_init),
+                              ('rcl_subscription_init', self._on_subscription_init),
+                              ('rclcpp_subscription_init', self._on_rclcpp_subscription_init),
+                              ('rclcpp_subscription_callback_added', self._on_subscription_callback_added),
+                              ('rclcpp_timer_callback_added', self._on_timer_callback_added),
+                              ('rclcpp_timer_link_node', self._on_timer_link_node),
+                              ('rcl_service_init', self._on_service_init),
+                              ('rclcpp_service_callback_added', self._on_service_callback_added),
+                              ('rcl_publisher_init', self._on_publisher_init)]:
+            # CARET records initialization events again with its own provider while tracing
+            self._init_handler_dict[f'ros2:{name}'] = handler
+            self._init_handler_dict[f'ros2_caret:{name}'] = handler
+
+    def accept(self, event: dict, common: LttngEventFilter.Common) -> bool:
+        name = event[LttngEventFilter.NAME]
+        field_name = _RUNTIME_EVENT_DICT.get(name)
+        if field_name:
+            if (event.get(LttngEventFilter.VPID), field_name, event.get(field_name)) in self._rejected_set:
+                self.num_rejected += 1
+                return False
+            return True
+        handler = self._init_handler_dict.get(name)
+        if handler:
+            handler(event.get(LttngEventFilter.VPID), event)
+        return True
+
+    def _on_node_init(self, vpid: int, event: dict):
+        namespace = event['namespace']
+        node_name = f"{namespace.rstrip('/')}/{event['node_name']}"
+        if not self.node_filter(node_name):
+            self._excluded_node_set.add((vpid, event['node_handle']))
+
+    def _on_subscription_init(self, vpid: int, event: dict):
+        topic_name = event['topic_name']
+        if (vpid, event['node_handle']) in self._excluded_node_set:
+            self._excluded_subscription_set.add((vpid, event['subscription_handle']))
+            self._rejected_set.add((vpid, 'rmw_subscription_handle', event['rmw_subscription_handle']))
+        elif topic_name not in self._subscribed_topic_set:
+            self._subscribed_topic_set.add(topic_name)
+            for publisher in self._pending_publisher_dict.pop(topic_name, []):
+                self._rejected_set.discard(publisher)
+
+    def _on_rclcpp_subscription_init(self, vpid: int, event: dict):
+        if (vpid, event['subscription_handle']) in self._excluded_subscription_set:
+            self._excluded_subscription_set.add((vpid, event['subscription']))
+
+    def _on_subscription_callback_added(self, vpid: int, event: dict):
+        if (vpid, event['subscription']) in self._excluded_subscription_set:
+            self._rejected_set.add((vpid, 'callback', event['callback']))
+
+    def _on_timer_callback_added(self, vpid: int, event: dict):
+        # The callback is added before the timer is linked to node
+        timer = (vpid, event['timer_handle'])
+        self._timer_callback_dict[timer] = event['callback']
+        if timer in self._excluded_timer_set:
+            self._rejected_set.add((vpid, 'callback', event['callback']))
+
+    def _on_timer_link_node(self, vpid: int, event: dict):
+        timer = (vpid, event['timer_handle'])
+        if (vpid, event['node_handle']) in self._excluded_node_set:
+            self._excluded_timer_set.add(timer)
+            if timer in self._timer_callback_dict:
+                self._rejected_set.add((vpid, 'callback', self._timer_callback_dict[timer]))
+
+    def _on_service_init(self, vpid: int, event: dict):
+        if (vpid, event['node_handle']) in self._excluded_node_set:
+            self._excluded_service_set.add((vpid, event['service_handle']))
+
+    def _on_service_callback_added(self, vpid: int, event: dict):
+        if (vpid, event['service_handle']) in self._excluded_service_set:
+            self._rejected_set.add((vpid, 'callback', event['callback']))
+
+    def _on_publisher_init(self, vpid: int, event: dict):
+        topic_name = event['topic_name']
+        publisher = (vpid, 'publisher_handle', event['publisher_handle'])
+        if not self.topic_filter(topic_name):
+            self._rejected_set.add(publisher)
+        elif (vpid, event['node_handle']) in self._excluded_node_set and topic_name not in self._subscribed_topic_set:
+            # Released when a node to be analyzed subscribes the topic
+            self._rejected_set.add(publisher)
+            self._pending_publisher_dict.setdefault(topic_name, []).append(publisher)
+
+
+def make_package_event_filter(package_dict: dict, ignore_list: list[str],
+                              path_node_regexp_list: list[str] = None) -> NodeEventFilter:
+    """
+    Make filter to load only nodes which match package_list.json and are not ignored
+
+    Nodes which match one of path_node_regexp_list (node names in target path JSON) are also loaded
+    """
+    catalog = Catalog(package_dict, ignore_list)
+    path_node_regexp_list = path_node_regexp_list or []
+    path_node_regexp = re.compile('|'.join(f'(?:{regexp})' for regexp in path_node_regexp_list)) \
+        if path_node_regexp_list else None
+
+    def node_filter(node_name: str) -> bool:
+        if catalog.get_package_name(node_name) != '' and not catalog.is_ignored(node_name):
+            return True
+        return bool(path_node_regexp and path_node_regexp.fullmatch(node_name))
+
+    key = json.dumps([package_dict, ignore_list, path_node_regexp_list], sort_keys=True)
+    return NodeEventFilter(node_filter, key=key)
+
+
+def make_path_event_filter(arch: Architecture) -> NodeEventFilter:
+    """
+    Make filter to load only nodes and topics in paths of the architecture
+
+    Paths are found by add_path_to_architecture with its node_filter and comm_filter,
+    so nodes excluded by them and publish events of topics excluded by them (e.g. /tf) are not loaded
+    """
+    node_name_set, topic_name_set = set(), set()
+    for target_path_name in arch.path_names:
+        path = arch.get_path(target_path_name)
+        node_name_set.update(path.node_names)
+        topic_name_set.update(path.topic_names)
+    key = json.dumps([sorted(node_name_set), sorted(topic_name_set)])
+    return NodeEventFilter(lambda node_name: node_name in node_name_set,
+                           lambda topic_name: topic_name in topic_name_set, key)
@@ -0,0 +1,177 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Functions to measure frequency from timestamps, and to match publishment and subscription frequency
+"""
+from __future__ import annotations
+import logging
+import numpy as np
+
+
+def calc_frequency(timestamps: np.ndarray, window_s: float = 1.0,
+                   step_s: float = 0.0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Measure frequency per window
+
+    Parameters
+    ----------
+    timestamps : np.ndarray
+        timestamps [nsec] (not need to be sorted)
+    window_s : float
+        window size [sec]
+    step_s : float
+        0: the first window starts at the first timestamp, and each next window starts at
+           the first timestamp which is not in the previous window (windows don't overlap)
+        > 0: windows start every step_s from the first timestamp.
+             windows overlap when step_s < window_s (sliding window), and windows without timestamp are 0 Hz
+
+    Returns
+    -------
+    timestamp_list : np.ndarray
+        start time of each window [sec] (the first timestamp is 0 [sec])
+    frequency_list : np.ndarray
+        frequency of each window [Hz]
+    """
+    if len(timestamps) < 2:
+        return np.empty(0), np.empty(0)
+    timestamps = np.sort(timestamps)
+    window_ns = int(window_s * 1e9)
+
+    if step_s > 0:
+        step_ns = int(step_s * 1e9)
+        num_window = (int(timestamps[-1]) - int(timestamps[0])) // step_ns + 1
+        window_start_list = timestamps[0] + np.arange(num_window, dtype=np.int64) * step_ns
+        count_list = (np.searchsorted(timestamps, window_start_list + window_ns, 'left')
+                      - np.searchsorted(timestamps, window_start_list, 'left'))
+    else:
+        # Loop for each window (not for each timestamp), and find the end of window by binary search
+        window_start_index_list = []
+        index = 0
+        while index < len(timestamps):
+            window_start_index_list.append(index)
+            index = int(np.searchsorted(timestamps, timestamps[index] + window_ns, 'left'))
+        window_start_index_list = np.array(window_start_index_list, dtype=np.int64)
+        window_start_list = timestamps[window_start_index_list]
+        count_list = np.diff(np.append(window_start_index_list, len(timestamps)))
+        # The first timestamp is counted twice in the first window as the original implementation
+        # (check_callback_sub.calc_frequency in the previous version) did, to keep the same result
+        count_list[0] += 1
+
+    timestamp_list = (window_start_list - timestamps[0]) * 1e-9
+    frequency_list = count_list / window_s
+    return timestamp_list, frequency_list
+
+
+def match_pubsub_freq(pub_freq: tuple[np.ndarray, np.ndarray],
+                      sub_freq: tuple[np.ndarray, np.ndarray],
+                      maximum_gap_time: float = 1.0,
+                      logger: logging.Logger = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Make pubsub freq list whose timestamps match
+
+    Parameters
+    ----------
+    pub_freq : tuple[np.ndarray, np.ndarray]
+        timestamp [sec] and frequency [Hz] of publishment
+    sub_freq : tuple[np.ndarray, np.ndarray]
+        timestamp [sec] and frequency [Hz] of subscription
+    maximum_gap_time : float
+        maximum gap [sec] between publishment timestamp and subscription timestamp
+    logger : logging.Logger
+        logger to output publishments which are not matched (debug)
+
+    Returns
+    -------
+    timestamp_list : np.ndarray
+        list of timestamp [sec]
+    pub_freq_list : np.ndarray
+        list of publishment frequency [Hz]
+    sub_freq_list : np.ndarray
+        list of subscription frequency [Hz]
+
+    Note
+    ---
+    Each publishment is matched to the nearest following subscription which is not matched yet.
+    In case there is not corresponding subscription(*), the publish event is ignored
+    (*: gap between publishment timestamp and subscription timestamp >= maximum_gap_time)
+    The last subscription is not used, because frequency may be calculated incorrectly
+    """
+    pub_time_list, pub_value_list = np.asarray(pub_freq[0]), np.asarray(pub_freq[1])
+    sub_time_list, sub_value_list = np.asarray(sub_freq[0]), np.asarray(sub_freq[1])
+    num_pub = len(pub_time_list)
+    num_sub = len(sub_time_list) - 1    # ignore the last one
+    nearest_sub_index_list = np.searchsorted(sub_time_list, pub_time_list, 'left')
+
+    matched_pub_index_list = []
+    matched_sub_index_list = []
+    index_pub = 0
+    index_sub_to_start_check = 0
+    block_size = 64
+    while index_pub < num_pub and num_sub > 0:
+        # Assuming all publishments in the block are matched, each one is matched to
+        # max(nearest subscription, subscription matched to the previous publishment + 1)
+        index_pub_end = min(index_pub + block_size, num_pub)
+        offset = np.arange(index_pub_end - index_pub)
+        sub_index_list = offset + np.maximum.accumulate(
+            np.maximum(nearest_sub_index_list[index_pub:index_pub_end] - offset, index_sub_to_start_check))
+        is_valid_list = sub_index_list < num_sub
+        gap_time_list = sub_time_list[np.minimum(sub_index_list, num_sub)] - pub_time_list[index_pub:index_pub_end]
+        is_matched_list = is_valid_list & (gap_time_list < maximum_gap_time)
+
+        # The assumption holds until the first publishment which is not matched
+        num_matched = len(offset) if is_matched_list.all() else int(np.argmin(is_matched_list))
+        matched_pub_index_list.append(np.arange(index_pub, index_pub + num_matched))
+        matched_sub_index_list.append(sub_index_list[:num_matched])
+        if num_matched > 0:
+            index_sub_to_start_check = int(sub_index_list[num_matched - 1]) + 1
+        if num_matched == len(offset):
+            index_pub = index_pub_end
+            block_size *= 2
+            continue
+        if not is_valid_list[num_matched]:
+            break    # no more subscription to be matched
+        if logger:
+            logger.debug(f'Corresponding subscription is not found: {pub_time_list[index_pub + num_matched]:.3f} [sec]')
+        index_pub += num_matched + 1
+        block_size = 64
+
+    matched_pub_index_list = np.concatenate(matched_pub_index_list) if matched_pub_index_list else np.empty(0, dtype=np.int64)
+    matched_sub_index_list = np.concatenate(matched_sub_index_list) if matched_sub_index_list else np.empty(0, dtype=np.int64)
+    return (pub_time_list[matched_pub_index_list], pub_value_list[matched_pub_index_list],
+            sub_value_list[matched_sub_index_list])
+
+
+class FrequencyMemo:
+    """
+    Memo of frequency of publishers and subscriptions shared by communications of a topic
+
+    A topic with N publishers and M subscriptions has N * M communications, but frequency is
+    calculated only N + M times. Entries of a topic are released after all its communications are done.
+    """
+
+    def __init__(self, window_s: float = 1.0, step_s: float = 0.0):
+        self.window_s = window_s
+        self.step_s = step_s
+        self.memo_dict: dict[str, dict[tuple, tuple[np.ndarray, np.ndarray]]] = {}    # {topic_name: {key: frequency}}
+
+    def calc_frequency(self, topic_name: str, key: tuple, timestamps: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Measure frequency (see calc_frequency), or get the memo of the same key"""
+        topic_memo = self.memo_dict.setdefault(topic_name, {})
+        if key not in topic_memo:
+            topic_memo[key] = calc_frequency(timestamps, self.window_s, self.step_s)
+        return topic_memo[key]
+
+    def release(self, topic_name: str):
+        """Release entries of the topic"""
+        self.memo_dict.pop(topic_name, None)
@@ -0,0 +1,157 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Bundle of graphs shown in a report page (enabled by --html=bundle option)
+
+Instead of saving one standalone html file for each graph, each graph is serialized by bokeh.embed.json_item
+and appended to a part file of the process (graph_bundle_part_{pid}.jsonl) in the destination directory,
+so that worker processes don't write the same file.
+When the report page is made, part files are merged into graph_bundle.jsonl, and graph_bundle.js is created from it.
+The page loads graph_bundle.js, and each graph link (<a href="{filename}.html"><img></a>) is replaced
+with the graph when it's scrolled into view. Text links show the graph below it when clicked.
+"""
+from __future__ import annotations
+import os
+import glob
+import json
+from bokeh.plotting import Figure
+from bokeh.embed import json_item
+from bokeh.document import Document
+from bokeh.resources import CDN
+
+GRAPH_BUNDLE_FILENAME = 'graph_bundle'
+_PART_PREFIX = f'{GRAPH_BUNDLE_FILENAME}_part_'
+
+_LAZY_EMBED_SCRIPT = '''
+<script type="text/javascript">
+  // Graphs are embedded when they are scrolled into view (or clicked), not to draw all graphs at once
+  (function() {
+    let graph_index = 0;
+    function embed_graph(filename, element) {
+      element.id = "graph_bundle_" + (graph_index++);
+      Bokeh.embed.embed_item(caret_graph_bundle[filename], element.id);
+    }
+    const observer = new IntersectionObserver(function(entry_list) {
+      entry_list.forEach(function(entry) {
+        if (!entry.isIntersecting) {
+          return;
+        }
+        observer.unobserve(entry.target);
+        const element = document.createElement("div");
+        entry.target.replaceWith(element);
+        embed_graph(entry.target.getAttribute("data-graph"), element);
+      });
+    }, {rootMargin: "200px"});
+    document.querySelectorAll("a[href$='.html']").forEach(function(anchor) {
+      const filename = anchor.getAttribute("href").slice(0, -".html".length);
+      if (!(filename in caret_graph_bundle)) {
+        return;
+      }
+      anchor.setAttribute("data-graph", filename);
+      if (anchor.querySelector("img")) {
+        observer.observe(anchor);
+      } else {
+        anchor.addEventListener("click", function(event) {
+          event.preventDefault();
+          if (!anchor.nextElementSibling || anchor.nextElementSibling.getAttribute("data-graph") !== filename) {
+            const element = document.createElement("div");
+            element.setAttribute("data-graph", filename);
+            anchor.after(element);
+            embed_graph(filename, element);
+          }
+        });
+      }
+    });
+  })();
+</script>
+'''
+
+
+def add_graph(figure: Figure, dest_dir: str, filename: str):
+    """Add graph to the bundle in dest_dir. Standalone html file of the previous run is removed not to be shown"""
+    line = json.dumps({'filename': filename, 'item': json_item(figure)})
+    # Each process has its own part file, so that lines are not mixed
+    with open(f'{dest_dir}/{_PART_PREFIX}{os.getpid()}.jsonl', 'a', encoding='utf-8') as f_part:
+        f_part.write(line + '\n')
+    if os.path.isfile(f'{dest_dir}/{filename}.html'):
+        os.remove(f'{dest_dir}/{filename}.html')
+
+
+def remove_graph(dest_dir: str, filename: str):
+    """Remove graph from the bundle in dest_dir (the graph is removed when the bundle is loaded next time)"""
+    if not os.path.isfile(f'{dest_dir}/{GRAPH_BUNDLE_FILENAME}.jsonl') \
+            and not glob.glob(f'{dest_dir}/{_PART_PREFIX}*.jsonl'):
+        return
+    with open(f'{dest_dir}/{_PART_PREFIX}{os.getpid()}.jsonl', 'a', encoding='utf-8') as f_part:
+        f_part.write(json.dumps({'filename': filename, 'item': None}) + '\n')
+
+
+def _read_lines(path: str, item_dict: dict[str, dict]):
+    with open(path, encoding='utf-8') as f_jsonl:
+        for line in f_jsonl:
+            if line.strip():
+                entry = json.loads(line)
+                item_dict[entry['filename']] = entry['item']
+
+
+def load_graph_bundle(dest_dir: str) -> dict[str, dict]:
+    """
+    Load graphs in the bundle ({filename: json_item}). Empty if no graph is bundled
+
+    The later one is used for the same filename, and graphs exported as standalone html file later
+    or removed by remove_graph are not used
+    """
+    item_dict = {}
+    bundle_path = f'{dest_dir}/{GRAPH_BUNDLE_FILENAME}.jsonl'
+    if os.path.isfile(bundle_path):
+        _read_lines(bundle_path, item_dict)
+    for part_path in sorted(glob.glob(f'{dest_dir}/{_PART_PREFIX}*.jsonl'), key=os.path.getmtime):
+        _read_lines(part_path, item_dict)
+    return {filename: item for filename, item in item_dict.items()
+            if item is not None and not os.path.isfile(f'{dest_dir}/{filename}.html')}
+
+
+def load_figure(item: dict) -> Figure:
+    """Restore figure from json_item in the bundle (e.g. to export png file)"""
+    return Document.from_json(item['doc']).roots[0]
+
+
+def make_graph_bundle(dest_dir: str) -> str:
+    """
+    Merge part files into graph_bundle.jsonl, and create graph_bundle.js to be loaded by the report page
+
+    Html to load the bundle and embed graphs is returned ('' if no graph is bundled)
+    """
+    item_dict = load_graph_bundle(dest_dir)
+    part_path_list = glob.glob(f'{dest_dir}/{_PART_PREFIX}*.jsonl')
+    bundle_path = f'{dest_dir}/{GRAPH_BUNDLE_FILENAME}'
+    if not item_dict:
+        for path in part_path_list + [f'{bundle_path}.jsonl', f'{bundle_path}.js']:
+            if os.path.isfile(path):
+                os.remove(path)
+        return ''
+
+    # Write into temporary files first not to lose graphs
+    with open(f'{bundle_path}.jsonl.tmp', 'w', encoding='utf-8') as f_jsonl:
+        for filename, item in item_dict.items():
+            f_jsonl.write(json.dumps({'filename': filename, 'item': item}) + '\n')
+    os.replace(f'{bundle_path}.jsonl.tmp', f'{bundle_path}.jsonl')
+    for part_path in part_path_list:
+        os.remove(part_path)
+    with open(f'{bundle_path}.js.tmp', 'w', encoding='utf-8') as f_js:
+        f_js.write(f'var caret_graph_bundle = {json.dumps(item_dict)};\n')
+    os.replace(f'{bundle_path}.js.tmp', f'{bundle_path}.js')
+
+    return CDN.render_js() + f'<script type="text/javascript" src="{GRAPH_BUNDLE_FILENAME}.js"></script>' \
+        + _LAZY_EMBED_SCRIPT
@@ -0,0 +1,125 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Manifest of analysis results for incremental re-analysis
+
+Each entry (node, communication, callback or path) has a hash of its inputs and its result (stats).
+When the same inputs are given again, the result is reused, and graph files created in the previous run are kept.
+Graph files of entries which are not analyzed any more (e.g. removed from package_list.json) are deleted.
+"""
+from __future__ import annotations
+import os
+import hashlib
+import json
+import logging
+from common import graph_bundle
+from common.trace_cache import calc_trace_hash
+
+MANIFEST_VERSION = 7
+MANIFEST_FILENAME = 'manifest.json'
+
+
+def make_common_inputs(args) -> dict:
+    """Make inputs shared by all entries (trace data, time window and events to load, and how to export graphs)"""
+    inputs = {
+        'trace_id': calc_trace_hash(args.trace_data[0]),
+        'start_point': args.start_point,
+        'duration': args.duration,
+        'chunk_duration': getattr(args, 'chunk_duration', 0.0),
+        'event_filter': getattr(args, 'event_filter', False),
+        # Graphs of the previous run are not reused when they are drawn or exported in the other way
+        'max_points': getattr(args, 'max_points', 0),
+        'html': getattr(args, 'html', 'standalone'),
+        'png': getattr(args, 'png', 'immediate'),
+    }
+    return inputs
+
+
+def _find_graph_filenames(result, is_filename: bool = False) -> set[str]:
+    """Find graph filenames in result (values of 'filename', 'graph_filename' and 'filename_*' keys)"""
+    filename_set = set()
+    if isinstance(result, dict):
+        for key, value in result.items():
+            filename_set |= _find_graph_filenames(
+                value, is_filename or key in ['filename', 'graph_filename'] or key.startswith('filename_'))
+    elif isinstance(result, list):
+        for value in result:
+            filename_set |= _find_graph_filenames(value, is_filename)
+    elif is_filename and isinstance(result, str) and result:
+        filename_set.add(result)
+    return filename_set
+
+
+class Manifest:
+    """Hash of inputs and result of each entry, saved as manifest.json in the destination directory"""
+
+    def __init__(self, dest_dir: str, common_inputs: dict, incremental: bool, logger: logging.Logger = None):
+        self.dest_dir = dest_dir
+        self.manifest_path = f'{dest_dir}/{MANIFEST_FILENAME}'
+        self.common_inputs = common_inputs
+        self.logger = logger
+        self.entry_dict: dict[str, dict] = {}
+        self.prev_entry_dict: dict[str, dict] = {}
+        if incremental and os.path.isfile(self.manifest_path):
+            try:
+                with open(self.manifest_path, encoding='UTF-8') as f_json:
+                    manifest = json.load(f_json)
+                if manifest['version'] == MANIFEST_VERSION:
+                    self.prev_entry_dict = manifest['entries']
+            except:
+                if self.logger:
+                    self.logger.warning(f'Unable to read manifest: {self.manifest_path}')
+
+    def _calc_hash(self, inputs: dict) -> str:
+        inputs = {'common': self.common_inputs, 'entry': inputs}
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+    def lookup(self, key: str, inputs: dict) -> tuple[bool, object]:
+        """Get result of the previous run. (True, result) is returned if inputs are not changed"""
+        entry = self.prev_entry_dict.get(key)
+        if entry is None or entry['hash'] != self._calc_hash(inputs):
+            return False, None
+        self.entry_dict[key] = entry
+        if self.logger:
+            self.logger.debug(f'Reuse result: {key}')
+        return True, entry['result']
+
+    def update(self, key: str, inputs: dict, result: object, graph_dir: str = ''):
+        """Set result of an entry. Graph files in the result are in graph_dir (relative to dest_dir)"""
+        self.entry_dict[key] = {'hash': self._calc_hash(inputs), 'result': result, 'graph_dir': graph_dir}
+
+    def _find_graph_paths(self, entry_dict: dict[str, dict]) -> set[str]:
+        path_set = set()
+        for entry in entry_dict.values():
+            graph_dir = f"{self.dest_dir}/{entry['graph_dir']}" if entry['graph_dir'] else self.dest_dir
+            path_set.update(f'{graph_dir}/{filename}' for filename in _find_graph_filenames(entry['result']))
+        return path_set
+
+    def remove_stale_graphs(self):
+        """Delete graph files of entries in the previous run which are not looked up or updated in this run"""
+        stale_entry_dict = {key: entry for key, entry in self.prev_entry_dict.items() if key not in self.entry_dict}
+        for path in sorted(self._find_graph_paths(stale_entry_dict) - self._find_graph_paths(self.entry_dict)):
+            for extension in ['html', 'png']:
+                if os.path.isfile(f'{path}.{extension}'):
+                    os.remove(f'{path}.{extension}')
+            if os.path.isdir(os.path.dirname(path)):
+                graph_bundle.remove_graph(os.path.dirname(path), os.path.basename(path))
+            if self.logger:
+                self.logger.debug(f'Remove graph of the previous run: {path}')
+
+    def save(self):
+        """Save entries looked up or updated in this run, and delete graph files of the other entries"""
+        self.remove_stale_graphs()
+        with open(self.manifest_path, 'w', encoding='UTF-8') as f_json:
+            json.dump({'version': MANIFEST_VERSION, 'entries': self.entry_dict}, f_json)
@@ -0,0 +1,94 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Functions to calculate frequency, period and latency of all callbacks in a node at once
+
+Timestamps of all callbacks are concatenated into one array, and each metrics is calculated
+for all callbacks by one vectorized operation, then split for each callback.
+Metrics are the same as streaming mode (trace_stream.CallbackStream):
+    Frequency: the number of calls per window [Hz]. Windows start at the first call of each callback
+    Period   : time from the previous call [msec] at each call (except the first call)
+    Latency  : time from callback start to callback end [msec] at each call
+"""
+from __future__ import annotations
+import numpy as np
+
+METRICS_STR_DICT = {'Frequency': 'frequency [Hz]',
+                    'Period': 'period [ms]',
+                    'Latency': 'latency [ms]'}
+
+
+def _split(array: np.ndarray, offset_list: np.ndarray) -> list[np.ndarray]:
+    """Split array into each callback (offset_list has the start index of each callback and the end)"""
+    return [array[offset_list[i]:offset_list[i + 1]] for i in range(len(offset_list) - 1)]
+
+
+def calc_node_metrics(callback_record_list: list[dict], window_ns: int = 10**9) -> list[dict]:
+    """
+    Calculate metrics of callbacks in a node
+
+    Parameters
+    ----------
+    callback_record_list : list[dict]
+        records made by trace_cache.extract_callback_records ('start_timestamps' and 'end_timestamps')
+    window_ns : int
+        window size [nsec] to measure frequency
+
+    Returns
+    -------
+    metrics_list : list[dict]
+        {'Frequency', 'Period', 'Latency': (timestamp_list [nsec], value_list)} of each callback
+        in the same order as callback_record_list
+    """
+    num_callback = len(callback_record_list)
+    length_list = np.array([len(record['start_timestamps']) for record in callback_record_list], dtype=np.int64)
+    offset_list = np.append(0, np.cumsum(length_list))
+    start_list = np.concatenate([np.asarray(record['start_timestamps'], dtype=np.int64)
+                                 for record in callback_record_list] + [np.empty(0, dtype=np.int64)])
+    end_list = np.concatenate([np.asarray(record['end_timestamps'], dtype=np.int64)
+                               for record in callback_record_list] + [np.empty(0, dtype=np.int64)])
+    group_list = np.repeat(np.arange(num_callback), length_list)
+
+    latency_list = (end_list - start_list) * 1e-6
+
+    # Period is not calculated across callbacks
+    period_index_list = np.flatnonzero(group_list[1:] == group_list[:-1]) + 1
+    period_list = (start_list[period_index_list] - start_list[period_index_list - 1]) * 1e-6
+    period_offset_list = np.searchsorted(group_list[period_index_list], np.arange(num_callback + 1), 'left')
+
+    # Windows of all callbacks are laid out in one array (bin_offset_list has the first window of each callback)
+    is_called = length_list > 0
+    first_list = start_list[np.clip(offset_list[:-1], 0, len(start_list) - 1)] if len(start_list) > 0 \
+        else np.zeros(num_callback, dtype=np.int64)
+    last_list = start_list[np.clip(offset_list[1:] - 1, 0, None)] if len(start_list) > 0 else first_list
+    num_bin_list = np.where(is_called, (last_list - first_list) // window_ns + 1, 0)
+    bin_offset_list = np.append(0, np.cumsum(num_bin_list))
+    bin_index_list = bin_offset_list[group_list] + (start_list - first_list[group_list]) // window_ns
+    count_list = np.bincount(bin_index_list, minlength=bin_offset_list[-1])
+    bin_group_list = np.repeat(np.arange(num_callback), num_bin_list)
+    window_start_list = first_list[bin_group_list] \
+        + (np.arange(bin_offset_list[-1]) - bin_offset_list[bin_group_list]) * window_ns
+    frequency_list = count_list / (window_ns * 1e-9)
+
+    metrics_list = []
+    for window_start, frequency, start, latency, period_start, period in zip(
+            _split(window_start_list, bin_offset_list), _split(frequency_list, bin_offset_list),
+            _split(start_list, offset_list), _split(latency_list, offset_list),
+            _split(start_list[period_index_list], period_offset_list), _split(period_list, period_offset_list)):
+        metrics_list.append({
+            'Frequency': (window_start, frequency),
+            'Period': (period_start, period),
+            'Latency': (start, latency),
+        })
+    return metrics_list
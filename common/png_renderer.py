@@ -0,0 +1,121 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Renderer to export figures as png files using a pool of web drivers
+"""
+from __future__ import annotations
+import os
+import logging
+import queue
+import threading
+import concurrent.futures
+from bokeh.plotting import Figure
+from bokeh.io import export_png
+from bokeh.io.export import wait_until_render_complete
+
+
+class PngRenderer:
+    """
+    Export figures as png files concurrently
+
+    Web drivers (headless browser) are created up to num_workers and kept running until close() is called,
+    so that browser start-up time is not paid for each figure.
+    """
+
+    def __init__(self, num_workers: int, logger: logging.Logger = None):
+        self.num_workers = num_workers
+        self.logger = logger
+        self.pid = os.getpid()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_workers)
+        self._future_list: list[concurrent.futures.Future] = []
+        self._driver_queue = queue.Queue()
+        self._driver_list = []
+        self._lock = threading.Lock()
+        self._is_driver_available = True
+
+    def _get_driver(self):
+        """Get an idle web driver, or create a new one"""
+        try:
+            return self._driver_queue.get_nowait()
+        except queue.Empty:
+            pass
+        from bokeh.io.webdriver import webdriver_control
+        with self._lock:
+            driver = webdriver_control.create()
+            self._driver_list.append(driver)
+        return driver
+
+    def _render(self, export_func, filename: str) -> bool:
+        """Export a png file using a web driver in the pool"""
+        if not self._is_driver_available:
+            return False
+        try:
+            driver = self._get_driver()
+        except Exception as e:
+            # Don't retry for other figures, because it fails in the same way
+            with self._lock:
+                if self._is_driver_available and self.logger:
+                    self.logger.warning(f'Unable to export png. Web driver is not available: {e}')
+                self._is_driver_available = False
+            return False
+        try:
+            export_func(driver)
+            return True
+        except Exception as e:
+            if self.logger:
+                self.logger.warning(f'Unable to export png: {filename}: {e}')
+            return False
+        finally:
+            self._driver_queue.put(driver)
+
+    def submit(self, figure: Figure, filename: str) -> concurrent.futures.Future:
+        """Request to export a figure. The figure must not be modified until wait() returns"""
+        def _export_figure(driver):
+            export_png(figure, filename=filename, webdriver=driver)
+        future = self._executor.submit(self._render, _export_figure, filename)
+        self._future_list.append(future)
+        return future
+
+    def submit_html(self, html_filename: str, filename: str) -> concurrent.futures.Future:
+        """Request to export a graph saved as html file (bokeh standalone html)"""
+        def _export_html(driver):
+            driver.get(f'file://{os.path.abspath(html_filename)}')
+            wait_until_render_complete(driver, 10)
+            driver.find_element('css selector', '.bk-root').screenshot(filename)
+        future = self._executor.submit(self._render, _export_html, filename)
+        self._future_list.append(future)
+        return future
+
+    def render(self, job_list: list[tuple[Figure, str]]) -> list[bool]:
+        """Export a batch of figures and wait for completion. Results (success or not) are returned"""
+        future_list = [self.submit(figure, filename) for figure, filename in job_list]
+        return [future.result() for future in future_list]
+
+    def wait(self):
+        """Wait until all requested figures are exported"""
+        future_list, self._future_list = self._future_list, []
+        concurrent.futures.wait(future_list)
+
+    def close(self):
+        """Wait until all requested figures are exported, then quit web drivers"""
+        self.wait()
+        self._executor.shutdown()
+        from bokeh.io.webdriver import webdriver_control
+        with self._lock:
+            for driver in self._driver_list:
+                try:
+                    webdriver_control.terminate(driver)
+                except Exception:
+                    pass
+            self._driver_list = []
@@ -0,0 +1,236 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Profiler to find where the time goes in analysis (enabled by start_profile, i.e. --profile option)
+
+Wall time, CPU time and increase of peak RSS are recorded for each stage (e.g. loading trace data, exporting graphs)
+and for each item (node, communication, callback and path).
+A stage may be entered many times and stages may be nested, so the total of each stage is recorded
+and time of inner stages is included in outer stages.
+Records of each script are saved in profile.json in the report directory, and shown in the top page.
+cProfile output of the slowest items is saved in profile/ directory when num_cprofile > 0.
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import resource
+import logging
+import contextlib
+import functools
+import cProfile
+from datetime import datetime
+
+PROFILE_VERSION = 1
+PROFILE_FILENAME = 'profile.json'
+CPROFILE_DIRNAME = 'profile'
+_profiler: Profiler = None
+
+
+def _get_peak_rss_mb() -> float:
+    """Get peak RSS [MB] of this process so far (ru_maxrss is in kilobytes on Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Profiler:
+    """Records of stages and items in a script"""
+
+    def __init__(self, script_name: str, report_dir: str, num_cprofile: int = 0):
+        self.script_name = script_name
+        self.report_dir = report_dir
+        self.num_cprofile = num_cprofile
+        self.pid = os.getpid()
+        self.start_wall_time = time.perf_counter()
+        self.start_cpu_time = time.process_time()
+        self.stage_dict: dict[str, dict] = {}
+        self.item_list: list[dict] = []
+        self._cprofile_item_list: list[dict] = []    # items whose cProfile output is saved
+        self._is_cprofile_running = False
+
+    def _check_process(self):
+        """Forget records copied from the parent process when it's used in a forked worker process"""
+        if os.getpid() != self.pid:
+            self.pid = os.getpid()
+            self.stage_dict = {}
+            self.item_list = []
+            self._cprofile_item_list = []
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Measure a stage. Records of the same name are summed up"""
+        self._check_process()
+        start_wall_time, start_cpu_time, start_rss = time.perf_counter(), time.process_time(), _get_peak_rss_mb()
+        try:
+            yield
+        finally:
+            peak_rss = _get_peak_rss_mb()
+            stage = self.stage_dict.setdefault(name, {'name': name, 'count': 0, 'wall_time': 0.0, 'cpu_time': 0.0,
+                                                      'rss_increase_mb': 0.0, 'peak_rss_mb': 0.0})
+            stage['count'] += 1
+            stage['wall_time'] += time.perf_counter() - start_wall_time
+            stage['cpu_time'] += time.process_time() - start_cpu_time
+            stage['rss_increase_mb'] += peak_rss - start_rss
+            stage['peak_rss_mb'] = max(stage['peak_rss_mb'], peak_rss)
+
+    @contextlib.contextmanager
+    def item(self, category: str, name: str):
+        """Measure an item (e.g. category='node', name=node_name), and run cProfile if enabled"""
+        self._check_process()
+        cprofile = None
+        if self.num_cprofile > 0 and not self._is_cprofile_running:
+            cprofile = cProfile.Profile()
+            self._is_cprofile_running = True
+            cprofile.enable()
+        start_wall_time, start_cpu_time, start_rss = time.perf_counter(), time.process_time(), _get_peak_rss_mb()
+        try:
+            yield
+        finally:
+            item = {
+                'category': category,
+                'name': name,
+                'wall_time': time.perf_counter() - start_wall_time,
+                'cpu_time': time.process_time() - start_cpu_time,
+                'rss_increase_mb': _get_peak_rss_mb() - start_rss,
+            }
+            if cprofile:
+                cprofile.disable()
+                self._is_cprofile_running = False
+                self._save_cprofile(item, cprofile)
+            self.item_list.append(item)
+
+    def _save_cprofile(self, item: dict, cprofile: cProfile.Profile):
+        """Save cProfile output if the item is one of the slowest items so far"""
+        if len(self._cprofile_item_list) >= self.num_cprofile \
+                and item['wall_time'] <= self._cprofile_item_list[-1]['wall_time']:
+            return
+        cprofile_dir = f'{self.report_dir}/{CPROFILE_DIRNAME}'
+        os.makedirs(cprofile_dir, exist_ok=True)
+        filename = f"{item['category']}{item['name']}".replace('/', '_')[:200] + f'_{os.getpid()}.prof'
+        cprofile.dump_stats(f'{cprofile_dir}/{filename}')
+        item['cprofile_file'] = f'{CPROFILE_DIRNAME}/{filename}'
+        self._cprofile_item_list.append(item)
+        self._cprofile_item_list.sort(key=lambda x: x['wall_time'], reverse=True)
+        for removed_item in self._cprofile_item_list[self.num_cprofile:]:
+            _remove_cprofile(self.report_dir, removed_item)
+        del self._cprofile_item_list[self.num_cprofile:]
+
+    def pop_records(self) -> dict:
+        """Get records made after the last call (used to send records from worker process)"""
+        self._check_process()
+        records = {'stage_dict': self.stage_dict, 'item_list': self.item_list}
+        self.stage_dict = {}
+        self.item_list = []
+        return records
+
+    def merge_records(self, records: dict):
+        """Merge records made in worker process. Time of workers running concurrently is summed up"""
+        for name, worker_stage in records['stage_dict'].items():
+            stage = self.stage_dict.setdefault(name, dict(worker_stage, count=0, wall_time=0.0, cpu_time=0.0,
+                                                          rss_increase_mb=0.0, peak_rss_mb=0.0))
+            for key in ['count', 'wall_time', 'cpu_time', 'rss_increase_mb']:
+                stage[key] += worker_stage[key]
+            stage['peak_rss_mb'] = max(stage['peak_rss_mb'], worker_stage['peak_rss_mb'])
+        self.item_list.extend(records['item_list'])
+
+    def to_dict(self) -> dict:
+        """Make records of this script. Only cProfile output of the slowest items is kept"""
+        item_list = sorted(self.item_list, key=lambda x: x['wall_time'], reverse=True)
+        # Each worker process keeps its own slowest items, and files may be removed after records are sent
+        num_kept = 0
+        for item in item_list:
+            if 'cprofile_file' not in item:
+                continue
+            if num_kept < self.num_cprofile and os.path.isfile(f"{self.report_dir}/{item['cprofile_file']}"):
+                num_kept += 1
+            else:
+                _remove_cprofile(self.report_dir, item)
+        return {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'wall_time': time.perf_counter() - self.start_wall_time,
+            'cpu_time': time.process_time() - self.start_cpu_time,
+            'peak_rss_mb': _get_peak_rss_mb(),
+            'stage_list': sorted(self.stage_dict.values(), key=lambda x: x['wall_time'], reverse=True),
+            'item_list': item_list,
+        }
+
+
+def _remove_cprofile(report_dir: str, item: dict):
+    cprofile_path = f"{report_dir}/{item.pop('cprofile_file')}"
+    if os.path.isfile(cprofile_path):
+        os.remove(cprofile_path)
+
+
+def start_profile(script_name: str, report_dir: str, num_cprofile: int = 0):
+    """Start recording stages and items of the script"""
+    global _profiler
+    _profiler = Profiler(script_name, report_dir, num_cprofile)
+
+
+def stage(name: str):
+    """Context manager to measure a stage. Nothing is done if profiler is not started"""
+    return _profiler.stage(name) if _profiler else contextlib.nullcontext()
+
+
+def stage_function(name: str):
+    """Decorator to measure a function as a stage"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def item(category: str, name: str):
+    """Context manager to measure an item. Nothing is done if profiler is not started"""
+    return _profiler.item(category, name) if _profiler else contextlib.nullcontext()
+
+
+def pop_records() -> dict:
+    """Get records made in worker process after the last call (None if profiler is not started)"""
+    return _profiler.pop_records() if _profiler else None
+
+
+def merge_records(records: dict):
+    """Merge records made in worker process"""
+    if _profiler and records:
+        _profiler.merge_records(records)
+
+
+def load_profile(report_dir: str) -> dict:
+    """Load profile.json in the report directory ({script_name: records}). Empty if it doesn't exist"""
+    profile_path = f'{report_dir}/{PROFILE_FILENAME}'
+    if not os.path.isfile(profile_path):
+        return {}
+    try:
+        with open(profile_path, encoding='utf-8') as f_json:
+            profile = json.load(f_json)
+    except:
+        return {}
+    return profile['scripts'] if profile.get('version') == PROFILE_VERSION else {}
+
+
+def save_profile(logger: logging.Logger = None):
+    """Save records of this script into profile.json (records of the other scripts are kept)"""
+    if _profiler is None:
+        return
+    script_dict = load_profile(_profiler.report_dir)
+    script_dict[_profiler.script_name] = _profiler.to_dict()
+    os.makedirs(_profiler.report_dir, exist_ok=True)
+    profile_path = f'{_profiler.report_dir}/{PROFILE_FILENAME}'
+    with open(profile_path, 'w', encoding='utf-8') as f_json:
+        json.dump({'version': PROFILE_VERSION, 'scripts': script_dict}, f_json, indent=2)
+    if logger:
+        logger.info(f'Profile is saved: {profile_path}')
@@ -0,0 +1,191 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Functions to calculate response time of a path from records
+
+Each input message is assigned to the first output which the input (or a later input) reaches.
+Inputs assigned to the same output make a group:
+    best case : output - the latest input in the group
+    worst case: output - the earliest input in the group (just after the previous group)
+    total     : output - each input in the group
+"""
+from __future__ import annotations
+import math
+import numpy as np
+
+PERCENTILE_LIST = [50, 90, 99, 99.9]
+
+
+def extract_input_output(records) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Get input timestamps and output timestamps from records (RecordsInterface) as arrays
+
+    Returns
+    -------
+    input_list : np.ndarray
+        input timestamp [nsec] of each message, sorted
+    output_list : np.ndarray
+        output timestamp [nsec] of each message (-1 if the message doesn't reach output)
+    """
+    input_column = records.columns[0]
+    output_column = records.columns[-1]
+    records_df = records.to_dataframe()
+    if input_column not in records_df.columns:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    # Columns are nullable integer, so timestamps are converted without float (missing values become -1)
+    is_input = records_df[input_column].notna().to_numpy()
+    input_list = records_df[input_column].to_numpy(dtype=np.int64, na_value=-1)
+    if output_column in records_df.columns:
+        output_list = records_df[output_column].to_numpy(dtype=np.int64, na_value=-1)
+    else:
+        output_list = np.full(len(input_list), -1, dtype=np.int64)
+    input_list = input_list[is_input]
+    output_list = output_list[is_input]
+    order = np.argsort(input_list, kind='stable')
+    return input_list[order], output_list[order]
+
+
+def calc_response_time(input_list: np.ndarray, output_list: np.ndarray) -> dict:
+    """
+    Calculate response time from input/output timestamps (sorted by input)
+
+    Returns
+    -------
+    response_time : dict
+        'input_min', 'input_max', 'output': timestamps [nsec] of each group
+        'best', 'worst': response time [nsec] of each group
+        'total': response time [nsec] of each input until the output of its group.
+                 Inputs which don't reach output (dropped) are counted until the output of the next input,
+                 and only inputs after the last output are excluded
+    """
+    is_reached = output_list >= 0
+    reached_index_list = np.flatnonzero(is_reached)
+    reached_output_list = output_list[reached_index_list]
+    # The last input before the output changes makes a group (use the latest message for the same output)
+    is_group_end = np.append(reached_output_list[1:] != reached_output_list[:-1], True) \
+        if len(reached_index_list) > 0 else np.empty(0, dtype=bool)
+    group_end_index_list = reached_index_list[is_group_end]
+
+    # Inputs after the last group never reach output
+    num_input = int(group_end_index_list[-1]) + 1 if len(group_end_index_list) > 0 else 0
+    group_id_list = np.searchsorted(group_end_index_list, np.arange(num_input), 'left')
+    group_start_index_list = np.append(0, group_end_index_list[:-1] + 1)[:len(group_end_index_list)]
+
+    input_min_list = input_list[group_start_index_list]
+    input_max_list = input_list[group_end_index_list]
+    group_output_list = output_list[group_end_index_list]
+    return {
+        'input_min': input_min_list,
+        'input_max': input_max_list,
+        'output': group_output_list,
+        'best': group_output_list - input_max_list,
+        'worst': group_output_list - input_min_list,
+        'total': group_output_list[group_id_list] - input_list[:num_input],
+    }
+
+
+def merge_response_time(response_time_list: list[dict]) -> dict:
+    """Merge response time calculated for each chunk of trace data"""
+    return {key: np.concatenate([response_time_dict[key] for response_time_dict in response_time_list])
+            for key in response_time_list[0]}
+
+
+def calc_stats(response_time_list: np.ndarray, prefix: str) -> dict:
+    """Calculate avg/min/max, percentiles, std [msec] and the number of response time [nsec]"""
+    if len(response_time_list) == 0:
+        return {}
+    response_time_list = response_time_list * 1e-6
+    stats = {
+        f'{prefix}_avg': float(np.mean(response_time_list)),
+        f'{prefix}_min': float(np.min(response_time_list)),
+        f'{prefix}_max': float(np.max(response_time_list)),
+    }
+    for percentile, value in zip(PERCENTILE_LIST, np.percentile(response_time_list, PERCENTILE_LIST)):
+        stats[f'{prefix}_p{str(percentile).replace(".", "")}'] = float(value)
+    stats[f'{prefix}_std'] = float(np.std(response_time_list, ddof=1)) if len(response_time_list) > 1 else 0.0
+    stats[f'{prefix}_count'] = len(response_time_list)
+    return stats
+
+
+def calc_histogram(response_time_list: np.ndarray, binsize: float = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Make histogram of response time. binsize is calculated from range when 0 is set"""
+    if binsize <= 0:
+        binsize = (np.max(response_time_list) - np.min(response_time_list)) / 30
+    binsize = max(1, binsize)
+    range_min = math.floor(np.min(response_time_list) / binsize) * binsize
+    range_max = math.ceil(np.max(response_time_list) / binsize) * binsize + binsize
+    bin_num = math.ceil((range_max - range_min) / binsize)
+    return np.histogram(response_time_list, bins=bin_num, range=(range_min, range_max))
+
+
+def to_timeseries(timestamp_list: np.ndarray, response_time_list: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Convert timestamp [nsec] and response time [nsec] into time [sec] from the first and response time [msec]"""
+    return (timestamp_list - timestamp_list[0]) * 1e-9, response_time_list * 1e-6
+
+
+def find_worst_windows(input_list: np.ndarray, output_list: np.ndarray, response_time_dict: dict,
+                       num_window: int, window_ns: int) -> list[dict]:
+    """
+    Find time windows where response time is the longest, or messages are dropped the most
+
+    Windows are at least window_ns wide, centered on the group whose worst case response time is the longest
+    (wider if the group is longer), and don't overlap each other.
+    When some inputs never reach output and num_window >= 2, one of windows is used for the time
+    where most of them are dropped.
+
+    Returns
+    -------
+    window_list : list[dict]
+        'kind' ('response_time' or 'drop'), 'start', 'end' [nsec], 'worst' (the longest response time [nsec]
+        of groups whose output is in the window) and 'num_drop' of each window, in order of importance
+    """
+    if num_window <= 0 or len(response_time_dict['output']) == 0:
+        return []
+    num_input = int(np.searchsorted(input_list, response_time_dict['input_max'][-1], 'right'))
+    drop_timestamp_list = input_list[:num_input][output_list[:num_input] < 0]
+
+    def make_window(kind: str, start: int, end: int) -> dict:
+        is_in_window = (response_time_dict['output'] >= start) & (response_time_dict['output'] < end)
+        worst_list = response_time_dict['worst'][is_in_window]
+        return {
+            'kind': kind,
+            'start': int(start),
+            'end': int(end),
+            'worst': int(np.max(worst_list)) if len(worst_list) > 0 else 0,
+            'num_drop': int(np.count_nonzero((drop_timestamp_list >= start) & (drop_timestamp_list < end))),
+        }
+
+    def is_overlapped(start: int, end: int, window_list: list[dict]) -> bool:
+        return any(start < window['end'] and window['start'] < end for window in window_list)
+
+    drop_window = None
+    if len(drop_timestamp_list) > 0 and num_window >= 2:
+        bin_index_list = (drop_timestamp_list - input_list[0]) // window_ns
+        bin_index = int(np.argmax(np.bincount(bin_index_list)))
+        start = int(input_list[0]) + bin_index * window_ns
+        drop_window = make_window('drop', start, start + window_ns)
+
+    window_list = [drop_window] if drop_window else []
+    for group_index in np.argsort(-response_time_dict['worst'], kind='stable'):
+        if len(window_list) >= num_window:
+            break
+        input_min = int(response_time_dict['input_min'][group_index])
+        output = int(response_time_dict['output'][group_index])
+        width = max(window_ns, output - input_min + 1)
+        start = (input_min + output) // 2 - width // 2
+        if not is_overlapped(start, start + width, window_list):
+            window_list.append(make_window('response_time', start, start + width))
+
+    # Windows of the longest response time come first
+    return window_list[1:] + window_list[:1] if drop_window else window_list
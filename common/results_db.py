@@ -0,0 +1,241 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Results of all analyses saved in one SQLite database per report (results.db in the report directory)
+
+Each analysis writes stats into its tables, and report pages query them.
+Stats which are not calculated ('-' or '---') are saved as NULL and restored when read.
+stats_*.yaml files are exported only when set_export_yaml(True) is called.
+"""
+from __future__ import annotations
+import os
+import json
+import sqlite3
+import yaml
+from common import profiler
+
+RESULTS_DB_VERSION = 4
+RESULTS_DB_FILENAME = 'results.db'
+_export_yaml = False
+
+CALLBACK_STATS_KEY_LIST = ['avg', 'min', 'max', 'std', 'p50', 'p95', 'p99']
+PATH_STATS_KEY_LIST = [f'{case}_{key}' for case in ['worst', 'best', 'total']
+                       for key in ['avg', 'min', 'max', 'p50', 'p90', 'p99', 'p999', 'std', 'count']]
+
+# Columns of each table: (name, SQL type). Type 'JSON' is saved as TEXT
+_TABLE_DICT = {
+    'packages': [
+        ('package_name', 'TEXT'),
+    ],
+    'nodes': [
+        ('package_name', 'TEXT'), ('node_name', 'TEXT'), ('filename_timeseries', 'JSON'),
+    ],
+    'callbacks': [
+        ('package_name', 'TEXT'), ('node_name', 'TEXT'), ('callback_name', 'TEXT'), ('displayname', 'TEXT'),
+        ('metrics', 'TEXT'),
+    ] + [(key, 'REAL') for key in CALLBACK_STATS_KEY_LIST] + [
+        ('count', 'INTEGER'), ('filename_hist', 'TEXT'),
+    ],
+    'communications': [
+        ('title', 'TEXT'), ('graph_filename', 'TEXT'), ('topic_name', 'TEXT'), ('publisher_name', 'TEXT'),
+        ('node_name', 'TEXT'), ('package_name', 'TEXT'), ('callback_name', 'TEXT'), ('callback_displayname', 'TEXT'),
+        ('publishment_freq', 'REAL'), ('subscription_freq', 'REAL'), ('num_huge_gap', 'INTEGER'),
+        ('is_warning', 'INTEGER'),
+    ],
+    'timers': [
+        ('node_name', 'TEXT'), ('package_name', 'TEXT'), ('callback_name', 'TEXT'), ('callback_displayname', 'TEXT'),
+        ('freq_timer', 'REAL'), ('freq_callback', 'REAL'), ('num_huge_gap', 'INTEGER'),
+        ('period_error_avg', 'REAL'), ('period_error_max', 'REAL'), ('jitter', 'REAL'), ('drift', 'REAL'),
+        ('graph_filename', 'TEXT'),
+        ('is_warning', 'INTEGER'),
+    ],
+    'paths': [
+        ('target_path_name', 'TEXT'), ('node_names', 'JSON'),
+    ] + [(key, 'REAL') for key in PATH_STATS_KEY_LIST] + [
+        ('filename_messageflow', 'TEXT'), ('filename_messageflow_short', 'TEXT'),
+        ('messageflow_window_list', 'JSON'),
+        ('filename_hist_total', 'TEXT'), ('filename_hist_best', 'TEXT'), ('filename_timeseries_best', 'TEXT'),
+        ('filename_hist_worst', 'TEXT'), ('filename_timeseries_worst', 'TEXT'),
+    ],
+}
+
+# Value used in stats when the stats is not calculated
+_EMPTY_VALUE_DICT = {'callbacks': '-', 'paths': '---'}
+
+
+def set_export_yaml(export_yaml: bool):
+    """Set whether to export stats_*.yaml files in addition to the database"""
+    global _export_yaml
+    _export_yaml = export_yaml
+
+
+def export_yaml(stats, stats_file_path: str):
+    """Export stats as yaml file if it's enabled by set_export_yaml"""
+    if _export_yaml:
+        with profiler.stage('export_yaml'), open(stats_file_path, 'w', encoding='utf-8') as f_yaml:
+            yaml.safe_dump(stats, f_yaml, encoding='utf-8', allow_unicode=True, sort_keys=False)
+
+
+class ResultsDb:
+    """SQLite database of stats of nodes, callbacks, communications, timers and paths"""
+
+    def __init__(self, report_dir: str):
+        self.db_path = f'{report_dir}/{RESULTS_DB_FILENAME}'
+        os.makedirs(report_dir, exist_ok=True)
+        self.connection = sqlite3.connect(self.db_path)
+        self.connection.row_factory = sqlite3.Row
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != RESULTS_DB_VERSION:
+            for table in _TABLE_DICT:
+                self.connection.execute(f'DROP TABLE IF EXISTS {table}')
+            self.connection.execute(f'PRAGMA user_version = {RESULTS_DB_VERSION}')
+        for table, column_list in _TABLE_DICT.items():
+            columns = ', '.join(f'{name} {"TEXT" if sql_type == "JSON" else sql_type}' for name, sql_type in column_list)
+            self.connection.execute(f'CREATE TABLE IF NOT EXISTS {table} ({columns})')
+        self.connection.commit()
+
+    @staticmethod
+    def exists(report_dir: str) -> bool:
+        return os.path.isfile(f'{report_dir}/{RESULTS_DB_FILENAME}')
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    @profiler.stage_function('save_results_db')
+    def _insert(self, table: str, row_list: list[dict]):
+        column_list = _TABLE_DICT[table]
+        empty_value = _EMPTY_VALUE_DICT.get(table)
+        value_list_list = []
+        for row in row_list:
+            value_list = []
+            for name, sql_type in column_list:
+                value = row.get(name)
+                if sql_type == 'JSON':
+                    value = json.dumps(value)
+                elif sql_type == 'REAL' and (value == empty_value or not isinstance(value, (int, float))):
+                    value = None
+                value_list.append(value)
+            value_list_list.append(value_list)
+        placeholders = ', '.join(['?'] * len(column_list))
+        self.connection.executemany(f'INSERT INTO {table} VALUES ({placeholders})', value_list_list)
+
+    def _select(self, table: str, where: str = '', parameters: tuple = (), order_by: str = 'rowid') -> list[dict]:
+        column_list = _TABLE_DICT[table]
+        empty_value = _EMPTY_VALUE_DICT.get(table)
+        where = f'WHERE {where}' if where else ''
+        row_list = []
+        for row in self.connection.execute(f'SELECT * FROM {table} {where} ORDER BY {order_by}', parameters):
+            row_dict = {}
+            for name, sql_type in column_list:
+                value = row[name]
+                if sql_type == 'JSON':
+                    value = json.loads(value)
+                elif sql_type == 'REAL' and value is None and empty_value:
+                    value = empty_value
+                row_dict[name] = value
+            row_list.append(row_dict)
+        return row_list
+
+    def clear_node_stats(self):
+        """Delete stats of all packages (before analyzing nodes)"""
+        with self.connection:
+            for table in ['packages', 'nodes', 'callbacks']:
+                self.connection.execute(f'DELETE FROM {table}')
+
+    def save_node_stats(self, package_name: str, stats: dict):
+        """Save stats of nodes in a package ({node_name: node_stats} made by node analysis)"""
+        node_row_list = []
+        callback_row_list = []
+        for node_name, node_stats in stats.items():
+            node_row_list.append({'package_name': package_name, 'node_name': node_name,
+                                  'filename_timeseries': node_stats['filename_timeseries']})
+            for callback_name, callback_stats in node_stats['callbacks'].items():
+                for metrics, metrics_stats in callback_stats.items():
+                    if metrics == 'displayname' or not metrics_stats:
+                        continue
+                    callback_row_list.append(dict(metrics_stats, package_name=package_name, node_name=node_name,
+                                                  callback_name=callback_name, metrics=metrics,
+                                                  displayname=callback_stats['displayname']))
+        with self.connection:
+            for table in ['packages', 'nodes', 'callbacks']:
+                self.connection.execute(f'DELETE FROM {table} WHERE package_name = ?', (package_name, ))
+            self._insert('packages', [{'package_name': package_name}])
+            self._insert('nodes', node_row_list)
+            self._insert('callbacks', callback_row_list)
+
+    def get_package_list(self) -> list[str]:
+        """Get sorted package names"""
+        return sorted(row['package_name'] for row in self._select('packages'))
+
+    def load_node_stats(self, package_name: str) -> dict:
+        """Load stats of nodes in a package in the same format as save_node_stats"""
+        stats = {}
+        for row in self._select('nodes', 'package_name = ?', (package_name, )):
+            stats[row['node_name']] = {'filename_timeseries': row['filename_timeseries'], 'callbacks': {}}
+        for row in self._select('callbacks', 'package_name = ?', (package_name, )):
+            callback_stats = stats[row['node_name']]['callbacks'].setdefault(row['callback_name'], {})
+            callback_stats[row['metrics']] = {key: row[key] for key in CALLBACK_STATS_KEY_LIST + ['count', 'filename_hist']}
+            callback_stats['displayname'] = row['displayname']
+        return stats
+
+    def get_latency_topk(self, package_name: str, numk: int, sort_key: str = 'avg') -> list[dict]:
+        """Get callbacks in a package whose latency (sort_key: avg or p99) is the longest"""
+        if sort_key not in CALLBACK_STATS_KEY_LIST:
+            raise ValueError(f'Invalid sort key: {sort_key}')
+        return self._select('callbacks', "package_name = ? AND metrics = 'Latency'", (package_name, ),
+                            order_by=f'COALESCE({sort_key}, 0) DESC, rowid LIMIT {int(numk)}')
+
+    def save_communication_stats(self, stats_list: list[dict], stats_warning_list: list[dict]):
+        """Save stats of subscription callbacks (stats_warning_list is a subset of stats_list)"""
+        self._save_with_warning('communications', stats_list, stats_warning_list)
+
+    def load_communication_stats(self, warning_only: bool = False) -> list[dict]:
+        """Load stats of subscription callbacks sorted by callback name"""
+        return self._load_with_warning('communications', warning_only)
+
+    def save_timer_stats(self, stats_list: list[dict], stats_warning_list: list[dict]):
+        """Save stats of timer callbacks (stats_warning_list is a subset of stats_list)"""
+        self._save_with_warning('timers', stats_list, stats_warning_list)
+
+    def load_timer_stats(self, warning_only: bool = False) -> list[dict]:
+        """Load stats of timer callbacks sorted by callback name"""
+        return self._load_with_warning('timers', warning_only)
+
+    def _save_with_warning(self, table: str, stats_list: list[dict], stats_warning_list: list[dict]):
+        warning_id_set = {id(stats) for stats in stats_warning_list}
+        with self.connection:
+            self.connection.execute(f'DELETE FROM {table}')
+            self._insert(table, [dict(stats, is_warning=int(id(stats) in warning_id_set)) for stats in stats_list])
+
+    def _load_with_warning(self, table: str, warning_only: bool) -> list[dict]:
+        row_list = self._select(table, 'is_warning = 1' if warning_only else '', order_by='callback_name, rowid')
+        for row in row_list:
+            del row['is_warning']
+        return row_list
+
+    def save_path_stats(self, stats_list: list[dict]):
+        """Save stats of paths"""
+        with self.connection:
+            self.connection.execute('DELETE FROM paths')
+            self._insert('paths', stats_list)
+
+    def load_path_stats(self) -> list[dict]:
+        """Load stats of paths"""
+        return self._select('paths')
@@ -0,0 +1,335 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Mergeable statistics to analyze trace data chunk by chunk
+
+Partial results of each chunk (or process) are added or merged without keeping all data in memory.
+"""
+from __future__ import annotations
+import math
+import numpy as np
+
+_MAX_BIN_NUM = 1000
+
+
+def _extend(array: np.ndarray, size: int) -> np.ndarray:
+    """Extend array with zeros"""
+    if len(array) >= size:
+        return array
+    return np.concatenate([array, np.zeros(size - len(array), dtype=array.dtype)])
+
+
+class QuantileSketch:
+    """
+    Quantile sketch with relative accuracy (log-scale buckets, like HDR histogram and DDSketch)
+
+    Bucket i covers (gamma^(i-1), gamma^i], so the estimated quantile is within relative_accuracy of the true value.
+    Sketches with the same relative_accuracy can be merged.
+    Negative values are kept in another set of buckets, and zero is counted separately.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.zero_count = 0
+        self.positive = (np.zeros(0, dtype=np.int64), 0)    # (counts, bucket index of counts[0])
+        self.negative = (np.zeros(0, dtype=np.int64), 0)
+
+    @property
+    def count(self) -> int:
+        return int(self.zero_count + np.sum(self.positive[0]) + np.sum(self.negative[0]))
+
+    def _to_bucket(self, values: np.ndarray) -> tuple[np.ndarray, int]:
+        index_list = np.ceil(np.log(values) / math.log(self.gamma)).astype(np.int64)
+        index_min = int(np.min(index_list))
+        return np.bincount(index_list - index_min), index_min
+
+    def add(self, values: np.ndarray):
+        """Add values"""
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        self.zero_count += int(np.count_nonzero(values == 0))
+        if np.any(values > 0):
+            self.positive = _add_bins(self.positive, self._to_bucket(values[values > 0]))
+        if np.any(values < 0):
+            self.negative = _add_bins(self.negative, self._to_bucket(-values[values < 0]))
+
+    def merge(self, other: QuantileSketch):
+        """Merge another sketch"""
+        if not math.isclose(self.relative_accuracy, other.relative_accuracy):
+            raise ValueError('Unable to merge sketches with different relative_accuracy')
+        self.zero_count += other.zero_count
+        self.positive = _add_bins(self.positive, other.positive)
+        self.negative = _add_bins(self.negative, other.negative)
+
+    def quantile(self, q: float) -> float:
+        """Get estimated q-quantile (0 <= q <= 1). None is returned if no value is added"""
+        count = self.count
+        if count == 0:
+            return None
+        rank = q * (count - 1)
+        # Values in ascending order: negative (from the largest bucket), zero, positive
+        negative_counts = self.negative[0][::-1]
+        negative_cumsum = np.cumsum(negative_counts)
+        if len(negative_cumsum) and rank < negative_cumsum[-1]:
+            i = int(np.searchsorted(negative_cumsum, rank, 'right'))
+            return -self._bucket_value(self.negative[1] + len(negative_counts) - 1 - i)
+        rank -= negative_cumsum[-1] if len(negative_cumsum) else 0
+        if rank < self.zero_count:
+            return 0.0
+        rank -= self.zero_count
+        positive_cumsum = np.cumsum(self.positive[0])
+        i = min(int(np.searchsorted(positive_cumsum, rank, 'right')), len(positive_cumsum) - 1)
+        return self._bucket_value(self.positive[1] + i)
+
+    def _bucket_value(self, index: int) -> float:
+        """Representative value of bucket which has relative error less than relative_accuracy"""
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+
+def _add_bins(bins: tuple[np.ndarray, int], other_bins: tuple[np.ndarray, int]) -> tuple[np.ndarray, int]:
+    """Add counts of bins. Each bins is a tuple of counts and bin index of counts[0]"""
+    (counts, start), (other_counts, other_start) = bins, other_bins
+    if len(other_counts) == 0:
+        return bins
+    if len(counts) == 0:
+        return other_counts.astype(np.int64), other_start
+    new_start = min(start, other_start)
+    new_counts = np.zeros(max(start + len(counts), other_start + len(other_counts)) - new_start, dtype=np.int64)
+    new_counts[start - new_start:start - new_start + len(counts)] += counts
+    new_counts[other_start - new_start:other_start - new_start + len(other_counts)] += other_counts
+    return new_counts, new_start
+
+
+class StatsAccumulator:
+    """
+    Count, mean, variance (Welford's algorithm), min, max, quantiles and fixed-width histogram of values
+
+    Bin i of the histogram covers [i * bin_width, (i + 1) * bin_width).
+    When bin_width is not set, it's decided from the range of the first values (range / 30, same as node analysis)
+    and rounded up to a power of 2. When the histogram becomes too wide, bin_width is doubled, so accumulators
+    can be merged as long as their bin widths are the same or power-of-2 multiples of each other.
+    """
+
+    def __init__(self, bin_width: float = 0, relative_accuracy: float = 0.01):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0    # sum of squares of differences from the mean
+        self.min = None
+        self.max = None
+        self.sketch = QuantileSketch(relative_accuracy)
+        self.bin_width = bin_width
+        self.hist = np.zeros(0, dtype=np.int64)
+        self.hist_start = 0    # bin index of hist[0]
+
+    def _merge_moments(self, count: int, mean: float, m2: float):
+        """Merge mean and variance of another set of values (Chan's parallel algorithm)"""
+        total_count = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total_count
+        self.m2 += m2 + delta * delta * self.count * count / total_count
+        self.count = total_count
+
+    def add(self, values: np.ndarray):
+        """Add values"""
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        value_min = float(np.min(values))
+        value_max = float(np.max(values))
+        mean = float(np.mean(values))
+        self._merge_moments(len(values), mean, float(np.sum((values - mean) ** 2)))
+        self.min = value_min if self.min is None else min(self.min, value_min)
+        self.max = value_max if self.max is None else max(self.max, value_max)
+        self.sketch.add(values)
+
+        if self.bin_width <= 0:
+            self.bin_width = _auto_bin_width(value_max - value_min)
+        index_list = np.floor(values / self.bin_width).astype(np.int64)
+        self._add_hist(int(np.min(index_list)), np.bincount(index_list - np.min(index_list)))
+
+    def merge(self, other: StatsAccumulator):
+        """Merge another accumulator"""
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.bin_width = self.bin_width if self.bin_width > 0 else other.bin_width
+        self._merge_moments(other.count, other.mean, other.m2)
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.sketch.merge(other.sketch)
+
+        other_hist, other_hist_start, other_bin_width = other.hist, other.hist_start, other.bin_width
+        while other_bin_width < self.bin_width and not math.isclose(other_bin_width, self.bin_width):
+            other_hist, other_hist_start = _coarsen(other_hist, other_hist_start, 2)
+            other_bin_width *= 2
+        while self.bin_width < other_bin_width and not math.isclose(other_bin_width, self.bin_width):
+            self.hist, self.hist_start = _coarsen(self.hist, self.hist_start, 2)
+            self.bin_width *= 2
+        if not math.isclose(other_bin_width, self.bin_width):
+            raise ValueError(f'Unable to merge histogram: bin_width = {self.bin_width}, {other.bin_width}')
+        self._add_hist(other_hist_start, other_hist)
+
+    def _add_hist(self, hist_start: int, hist: np.ndarray):
+        """Add histogram counts whose first bin index is hist_start"""
+        if len(self.hist) == 0:
+            self.hist, self.hist_start = hist.astype(np.int64), hist_start
+        else:
+            new_start = min(self.hist_start, hist_start)
+            new_end = max(self.hist_start + len(self.hist), hist_start + len(hist))
+            new_hist = np.zeros(new_end - new_start, dtype=np.int64)
+            new_hist[self.hist_start - new_start:self.hist_start - new_start + len(self.hist)] += self.hist
+            new_hist[hist_start - new_start:hist_start - new_start + len(hist)] += hist
+            self.hist, self.hist_start = new_hist, new_start
+        while len(self.hist) > _MAX_BIN_NUM:
+            self.hist, self.hist_start = _coarsen(self.hist, self.hist_start, 2)
+            self.bin_width *= 2
+
+    @property
+    def avg(self) -> float:
+        return self.mean
+
+    @property
+    def std(self) -> float:
+        """Sample standard deviation (same as pandas)"""
+        return math.sqrt(self.m2 / (self.count - 1))
+
+    def quantile(self, q: float) -> float:
+        """Get estimated q-quantile (0 <= q <= 1)"""
+        value = self.sketch.quantile(q)
+        return value if value is None else min(max(value, self.min), self.max)
+
+    def to_stats(self) -> dict:
+        """Make stats in the same format as node analysis"""
+        stats = {
+            'avg': '-',
+            'min': '-',
+            'max': '-',
+            'std': '-',
+            'p50': '-',
+            'p95': '-',
+            'p99': '-',
+            'count': int(self.count),
+        }
+        if self.count > 1:
+            stats['avg'] = float(self.avg)
+            stats['std'] = float(self.std)
+        if self.count > 0:
+            stats['min'] = float(self.min)
+            stats['max'] = float(self.max)
+            stats['p50'] = float(self.quantile(0.50))
+            stats['p95'] = float(self.quantile(0.95))
+            stats['p99'] = float(self.quantile(0.99))
+        return stats
+
+    def to_histogram(self, bin_num: int = 30) -> tuple[np.ndarray, np.ndarray]:
+        """Get histogram (hist, bin_edges) which has about bin_num bins"""
+        nonzero_index_list = np.flatnonzero(self.hist)
+        if len(nonzero_index_list) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(1)
+        hist = self.hist[nonzero_index_list[0]:nonzero_index_list[-1] + 1]
+        hist_start = self.hist_start + int(nonzero_index_list[0])
+        factor = max(1, math.ceil(len(hist) / bin_num))
+        hist, hist_start = _coarsen(hist, hist_start, factor)
+        bin_width = self.bin_width * factor
+        bin_edges = (hist_start + np.arange(len(hist) + 1)) * bin_width
+        return hist, bin_edges
+
+
+def _auto_bin_width(value_range: float) -> float:
+    """Bin width for values in value_range. Power of 2 (>= 1), so that automatic widths can always be merged"""
+    return float(2 ** math.ceil(math.log2(max(1, value_range / 30))))
+
+
+def _coarsen(hist: np.ndarray, hist_start: int, factor: int) -> tuple[np.ndarray, int]:
+    """Merge every factor bins. Bin i is merged into bin floor(i / factor)"""
+    if factor == 1 or len(hist) == 0:
+        return hist, hist_start
+    new_start = hist_start // factor
+    padding = hist_start - new_start * factor
+    hist = np.concatenate([np.zeros(padding, dtype=hist.dtype), hist])
+    hist = _extend(hist, math.ceil(len(hist) / factor) * factor)
+    return hist.reshape(-1, factor).sum(axis=1), new_start
+
+
+class TimeBinAccumulator:
+    """
+    Count and sum of values in each time window
+
+    Windows don't overlap, and the first window starts at the first timestamp.
+    Timestamps need to be added in order of window (e.g. chunk by chunk)
+    """
+
+    def __init__(self, window_ns: int):
+        self.window_ns = int(window_ns)
+        self.origin = None
+        self.count_list = np.zeros(0, dtype=np.int64)
+        self.sum_list = np.zeros(0)
+
+    def add(self, timestamps: np.ndarray, values: np.ndarray = None):
+        """Add timestamps [nsec] (and values at each timestamp)"""
+        if len(timestamps) == 0:
+            return
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        if self.origin is None:
+            self.origin = int(np.min(timestamps))
+        index_list = (timestamps - self.origin) // self.window_ns
+        if np.min(index_list) < 0:
+            raise ValueError('Timestamps before the first window are added')
+        size = max(len(self.count_list), int(np.max(index_list)) + 1)
+        self.count_list = _extend(self.count_list, size) + np.bincount(index_list, minlength=size)
+        if values is not None:
+            self.sum_list = _extend(self.sum_list, size) + np.bincount(index_list, weights=values, minlength=size)
+
+    def merge(self, other: TimeBinAccumulator):
+        """Merge another accumulator whose windows are aligned with this"""
+        if other.origin is None:
+            return
+        if self.origin is None:
+            self.origin = other.origin
+        if other.window_ns != self.window_ns or (other.origin - self.origin) % self.window_ns != 0:
+            raise ValueError('Unable to merge time windows which are not aligned')
+        offset = (other.origin - self.origin) // self.window_ns
+        if offset < 0:
+            self.count_list = np.concatenate([np.zeros(-offset, dtype=np.int64), self.count_list])
+            self.sum_list = np.concatenate([np.zeros(-offset), self.sum_list]) if len(self.sum_list) else self.sum_list
+            self.origin = other.origin
+            offset = 0
+        size = max(len(self.count_list), offset + len(other.count_list))
+        self.count_list = _extend(self.count_list, size)
+        self.count_list[offset:offset + len(other.count_list)] += other.count_list
+        if len(other.sum_list):
+            self.sum_list = _extend(self.sum_list, size)
+            self.sum_list[offset:offset + len(other.sum_list)] += other.sum_list
+
+    @property
+    def window_start_list(self) -> np.ndarray:
+        """Start timestamp [nsec] of each window"""
+        if self.origin is None:
+            return np.zeros(0, dtype=np.int64)
+        return self.origin + np.arange(len(self.count_list), dtype=np.int64) * self.window_ns
+
+    def to_frequency(self) -> tuple[np.ndarray, np.ndarray]:
+        """Get start time [sec] (the first timestamp is 0 [sec]) and frequency [Hz] of each window"""
+        timestamp_list = np.arange(len(self.count_list)) * self.window_ns * 1e-9
+        return timestamp_list, self.count_list / (self.window_ns * 1e-9)
+
+    def to_average(self) -> np.ndarray:
+        """Get average value of each window (nan for window without value)"""
+        sum_list = _extend(self.sum_list, len(self.count_list))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count_list > 0, sum_list / self.count_list, np.nan)
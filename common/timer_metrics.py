@@ -0,0 +1,144 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Functions to calculate frequency and period error of all timer callbacks at once
+
+Timestamps of all timer callbacks are concatenated into one array, and each metrics is calculated
+for all callbacks by one vectorized operation:
+    Frequency       : the number of calls per window [Hz] (the same as frequency.calc_frequency with step_s > 0)
+    Period error    : period of each call - timer period [msec]
+    Jitter          : standard deviation of period [msec]
+    Drift           : slope of the offset of each call from the timer grid (first call + n * timer period) [msec/sec]
+                      (the number of periods from the previous call is rounded, so that skipped calls are counted)
+"""
+from __future__ import annotations
+import numpy as np
+
+
+def _to_list(value_list: np.ndarray) -> list:
+    """Convert array into list of float (None for nan)"""
+    return [None if np.isnan(value) else float(value) for value in value_list]
+
+
+def calc_timer_metrics(start_timestamps_list: list[np.ndarray], period_ns_list: list[int],
+                       window_s: float = 1.0, step_s: float = 1.0, gap_threshold_ratio: float = 0.2) -> list[dict]:
+    """
+    Calculate metrics of timer callbacks
+
+    Parameters
+    ----------
+    start_timestamps_list : list[np.ndarray]
+        sorted callback start timestamps [nsec] of each timer callback
+    period_ns_list : list[int]
+        timer period [nsec] of each timer callback
+    window_s, step_s : float
+        window size [sec] and step [sec] of windows to measure frequency
+    gap_threshold_ratio : float
+        a window is counted as huge gap when frequency <= (1 - gap_threshold_ratio) * timer frequency
+
+    Returns
+    -------
+    metrics_list : list[dict]
+        metrics of each timer callback in the same order as start_timestamps_list:
+        'timestamp_list' (start time of each window [sec] from the first call), 'frequency_list' [Hz],
+        'freq_timer', 'freq_callback' (avg frequency except the last 2 windows) [Hz], 'num_window' (except the last 2),
+        'num_huge_gap', 'period_error_avg', 'period_error_max' (max of absolute value), 'jitter' [msec]
+        and 'drift' [msec/sec]. Values which cannot be calculated are None
+    """
+    num_callback = len(start_timestamps_list)
+    length_list = np.array([len(timestamps) for timestamps in start_timestamps_list], dtype=np.int64)
+    offset_list = np.append(0, np.cumsum(length_list))
+    timestamp_list = np.concatenate([np.asarray(timestamps, dtype=np.int64) for timestamps in start_timestamps_list]
+                                    + [np.empty(0, dtype=np.int64)])
+    group_list = np.repeat(np.arange(num_callback), length_list)
+    period_ns_list = np.asarray(period_ns_list, dtype=np.float64)
+    window_ns = int(window_s * 1e9)
+    step_ns = int(step_s * 1e9)
+
+    if len(timestamp_list) > 0:
+        first_list = timestamp_list[np.clip(offset_list[:-1], 0, len(timestamp_list) - 1)]
+        last_list = np.where(length_list > 0, timestamp_list[np.clip(offset_list[1:] - 1, 0, None)], first_list)
+    else:
+        first_list = last_list = np.zeros(num_callback, dtype=np.int64)
+    elapsed_list = timestamp_list - first_list[group_list]
+
+    # Frequency: timestamps of each callback are laid out on one time axis without overlap,
+    # so that windows of all callbacks are counted by one binary search
+    num_window_list = np.where(length_list >= 2, (last_list - first_list) // step_ns + 1, 0)
+    base_list = np.append(0, np.cumsum(last_list - first_list + window_ns + 1))[:-1]
+    key_list = base_list[group_list] + elapsed_list
+    window_offset_list = np.append(0, np.cumsum(num_window_list))
+    window_group_list = np.repeat(np.arange(num_callback), num_window_list)
+    window_index_list = np.arange(window_offset_list[-1]) - window_offset_list[window_group_list]
+    window_start_list = base_list[window_group_list] + window_index_list * step_ns
+    count_list = (np.searchsorted(key_list, window_start_list + window_ns, 'left')
+                  - np.searchsorted(key_list, window_start_list, 'left'))
+    frequency_list = count_list / window_s
+
+    # The last 2 windows are not used for stats because freq becomes small
+    freq_timer_list = 1e9 / period_ns_list
+    is_used = window_index_list < num_window_list[window_group_list] - 2
+    num_used_list = np.bincount(window_group_list[is_used], minlength=num_callback)
+    freq_sum_list = np.bincount(window_group_list[is_used], weights=frequency_list[is_used], minlength=num_callback)
+    is_huge_gap = is_used & (frequency_list <= freq_timer_list[window_group_list] * (1 - gap_threshold_ratio))
+    num_huge_gap_list = np.bincount(window_group_list[is_huge_gap], minlength=num_callback)
+
+    # Period error and jitter of each call (period is not calculated across callbacks)
+    period_index_list = np.flatnonzero(group_list[1:] == group_list[:-1]) + 1
+    period_group_list = group_list[period_index_list]
+    period_list = timestamp_list[period_index_list] - timestamp_list[period_index_list - 1]
+    period_error_list = (period_list - period_ns_list[period_group_list]) * 1e-6
+    num_period_list = np.bincount(period_group_list, minlength=num_callback)
+    period_error_max_list = np.full(num_callback, np.nan)
+    np.fmax.at(period_error_max_list, period_group_list, np.abs(period_error_list))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        freq_callback_list = np.where(num_used_list > 0, freq_sum_list / num_used_list, np.nan)
+        period_error_avg_list = np.bincount(period_group_list, weights=period_error_list,
+                                            minlength=num_callback) / num_period_list
+        deviation_list = period_error_list - period_error_avg_list[period_group_list]
+        jitter_list = np.sqrt(np.bincount(period_group_list, weights=deviation_list ** 2,
+                                          minlength=num_callback) / (num_period_list - 1))
+        jitter_list = np.where(num_period_list > 1, jitter_list, np.nan)
+
+        # Drift: least squares slope of offset from the timer grid over elapsed time.
+        # Each call is assigned to a grid point by counting periods from the previous call (skipped calls are counted)
+        num_step_list = np.zeros(len(timestamp_list))
+        num_step_list[period_index_list] = np.round(period_list / period_ns_list[period_group_list])
+        num_step_list = np.cumsum(num_step_list)
+        grid_index_list = num_step_list - num_step_list[np.clip(offset_list[:-1], 0, None)[group_list]]
+        x_list = elapsed_list * 1e-9
+        y_list = (elapsed_list - grid_index_list * period_ns_list[group_list]) * 1e-6
+        sum_x, sum_y, sum_xx, sum_xy = [np.bincount(group_list, weights=weights, minlength=num_callback)
+                                        for weights in [x_list, y_list, x_list * x_list, x_list * y_list]]
+        drift_list = (length_list * sum_xy - sum_x * sum_y) / (length_list * sum_xx - sum_x * sum_x)
+        drift_list = np.where(length_list > 2, drift_list, np.nan)
+
+    metrics_list = []
+    for index, (freq_callback, period_error_avg, period_error_max, jitter, drift) in enumerate(zip(
+            _to_list(freq_callback_list), _to_list(period_error_avg_list), _to_list(period_error_max_list),
+            _to_list(jitter_list), _to_list(drift_list))):
+        window_slice = slice(window_offset_list[index], window_offset_list[index + 1])
+        metrics_list.append({
+            'timestamp_list': window_index_list[window_slice] * step_ns * 1e-9,
+            'frequency_list': frequency_list[window_slice],
+            'freq_timer': float(freq_timer_list[index]),
+            'freq_callback': freq_callback,
+            'num_window': int(num_used_list[index]),
+            'num_huge_gap': int(num_huge_gap_list[index]),
+            'period_error_avg': period_error_avg,
+            'period_error_max': period_error_max,
+            'jitter': jitter,
+            'drift': drift,
+        })
+    return metrics_list
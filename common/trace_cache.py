@@ -0,0 +1,294 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Cache of timestamp records extracted from trace data
+
+Records are a list of dict. Each dict has information (str, int, float, None) and timestamp arrays (np.ndarray[int64, ns]).
+Timestamp arrays are saved in NPZ as one concatenated column and offsets for each array name,
+and information is saved in JSON.
+Architecture made from trace data is cached as well, so that analyses with cached records don't load trace data.
+"""
+from __future__ import annotations
+import os
+from pathlib import Path
+import hashlib
+import json
+import functools
+import logging
+import numpy as np
+from caret_analyze import Architecture, LttngEventFilter, Application
+from common import utils, profiler
+
+CACHE_VERSION = 1
+CALLBACK_INFO_KEYS = ['callback_name', 'callback_type', 'callback_displayname', 'node_name',
+                      'period_ns', 'subscribe_topic_name']
+ARCHITECTURE_FILENAME = 'architecture.yaml'
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@functools.lru_cache()
+def calc_trace_hash(trace_data: str) -> str:
+    """Calculate hash of trace data (path, size, head and tail of each file)"""
+    trace_hash = hashlib.sha1()
+    for dirpath, dirnames, filenames in os.walk(trace_data):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            filepath = os.path.join(dirpath, filename)
+            size = os.path.getsize(filepath)
+            trace_hash.update(f'{os.path.relpath(filepath, trace_data)}:{size}'.encode())
+            # CTF stream files are only appended, so head and tail are enough to detect difference
+            with open(filepath, 'rb') as f_trace:
+                trace_hash.update(f_trace.read(_HASH_CHUNK_SIZE))
+                if size > _HASH_CHUNK_SIZE:
+                    f_trace.seek(max(size - _HASH_CHUNK_SIZE, _HASH_CHUNK_SIZE))
+                    trace_hash.update(f_trace.read(_HASH_CHUNK_SIZE))
+    return trace_hash.hexdigest()
+
+
+class TraceCache:
+    """On-disk cache of timestamp records for trace data and time window to load"""
+
+    def __init__(self, cache_dir: str, trace_data: str, start_point: float, duration: float,
+                 logger: logging.Logger = None, event_filter: LttngEventFilter = None):
+        self.logger = logger
+        self.cache_path = None
+        if not cache_dir:
+            return
+        key = f'{calc_trace_hash(trace_data)}_{start_point}_{duration}_{CACHE_VERSION}'
+        if event_filter:
+            key += f'_{event_filter.key}'
+        key = hashlib.sha1(key.encode()).hexdigest()[:16]
+        self.cache_path = f'{cache_dir}/{Path(trace_data).stem}_{key}'
+
+    def load(self, kind: str) -> list[dict]:
+        """Load records. None is returned when cache doesn't exist"""
+        if not self.cache_path:
+            return None
+        info_path = f'{self.cache_path}/{kind}.json'
+        array_path = f'{self.cache_path}/{kind}.npz'
+        if not os.path.isfile(info_path) or not os.path.isfile(array_path):
+            return None
+        try:
+            with open(info_path, encoding='UTF-8') as f_json:
+                info = json.load(f_json)
+            record_list = info['records']
+            with np.load(array_path) as arrays:
+                for array_name in info['array_names']:
+                    values = arrays[f'{array_name}_values']
+                    offsets = arrays[f'{array_name}_offsets']
+                    for i, record in enumerate(record_list):
+                        record[array_name] = values[offsets[i]:offsets[i + 1]]
+        except:
+            if self.logger:
+                self.logger.warning(f'Unable to read cache: {self.cache_path}/{kind}')
+            return None
+        if self.logger:
+            self.logger.info(f'Use cache: {self.cache_path}/{kind}')
+        return record_list
+
+    def save(self, kind: str, record_list: list[dict]):
+        """Save records"""
+        if not self.cache_path:
+            return
+        os.makedirs(self.cache_path, exist_ok=True)
+        array_names = sorted({key for record in record_list for key, value in record.items()
+                              if isinstance(value, np.ndarray)})
+        arrays = {}
+        for array_name in array_names:
+            array_list = [record.get(array_name, np.empty(0, dtype=np.int64)) for record in record_list]
+            offsets = np.zeros(len(array_list) + 1, dtype=np.int64)
+            np.cumsum([len(array) for array in array_list], out=offsets[1:])
+            arrays[f'{array_name}_values'] = np.concatenate(array_list) if array_list else np.empty(0, dtype=np.int64)
+            arrays[f'{array_name}_offsets'] = offsets
+        info = {
+            'array_names': array_names,
+            'records': [{key: value for key, value in record.items() if key not in array_names}
+                        for record in record_list],
+        }
+
+        # Write into temporary files first not to leave broken cache
+        with open(f'{self.cache_path}/{kind}.npz.tmp', 'wb') as f_npz:
+            np.savez(f_npz, **arrays)
+        with open(f'{self.cache_path}/{kind}.json.tmp', 'w', encoding='UTF-8') as f_json:
+            json.dump(info, f_json)
+        os.replace(f'{self.cache_path}/{kind}.npz.tmp', f'{self.cache_path}/{kind}.npz')
+        os.replace(f'{self.cache_path}/{kind}.json.tmp', f'{self.cache_path}/{kind}.json')
+        if self.logger:
+            self.logger.debug(f'Save cache: {self.cache_path}/{kind}')
+
+    def load_architecture(self) -> Architecture:
+        """Load architecture made from trace data. None is returned when cache doesn't exist"""
+        if not self.cache_path:
+            return None
+        architecture_path = f'{self.cache_path}/{ARCHITECTURE_FILENAME}'
+        if not os.path.isfile(architecture_path):
+            return None
+        try:
+            arch = Architecture('yaml', architecture_path)
+        except:
+            if self.logger:
+                self.logger.warning(f'Unable to read cache: {architecture_path}')
+            return None
+        if self.logger:
+            self.logger.info(f'Use cache: {architecture_path}')
+        return arch
+
+    def save_architecture(self, arch: Architecture):
+        """Save architecture made from trace data, so that it's not made again from trace data"""
+        if not self.cache_path:
+            return
+        os.makedirs(self.cache_path, exist_ok=True)
+        arch.export(f'{self.cache_path}/tmp_{ARCHITECTURE_FILENAME}', force=True)
+        os.replace(f'{self.cache_path}/tmp_{ARCHITECTURE_FILENAME}', f'{self.cache_path}/{ARCHITECTURE_FILENAME}')
+
+
+def get_timestamps(timestamp_df, timestamp_name: str) -> np.ndarray:
+    """Get sorted timestamp array [nsec] of the column which contains timestamp_name"""
+    timestamp_name = [s for s in timestamp_df.columns if timestamp_name in s][0]
+    timestamp_series = timestamp_df[timestamp_name].dropna()
+    return np.sort(timestamp_series.to_numpy(dtype=np.int64))
+
+
+def make_callback_info(callback) -> dict:
+    """Make information of a callback (shared by the catalog and callback records)"""
+    callback_type = callback.callback_type.type_name
+    return {
+        'callback_name': callback.callback_name,
+        'callback_type': callback_type,
+        'callback_displayname': utils.make_callback_displayname(callback),
+        'node_name': callback.node_name,
+        'period_ns': callback.timer.period_ns if 'timer' in callback_type else None,
+        'subscribe_topic_name': callback.subscribe_topic_name if 'subscription' in callback_type else None,
+    }
+
+
+def _make_callback_record(callback, callback_info: dict = None, logger: logging.Logger = None) -> dict:
+    """Make a record of callback start/end timestamps (None if data is unavailable)"""
+    try:
+        callback_df = callback.to_dataframe().dropna()
+        start_timestamps = get_timestamps(callback_df, 'callback_start_timestamp')
+        end_timestamps = get_timestamps(callback_df, 'callback_end_timestamp')
+    except:
+        if logger:
+            logger.warning(f'Failed to get callback data: {callback.callback_name}')
+        return None
+    if callback_info is None:
+        callback_info = make_callback_info(callback)
+    # Only callback information is kept, because package name and ignore flag depend on package_list.json
+    record = {key: callback_info[key] for key in CALLBACK_INFO_KEYS}
+    record['start_timestamps'] = start_timestamps
+    record['end_timestamps'] = end_timestamps
+    return record
+
+
+@profiler.stage_function('extract_records')
+def extract_callback_records(app: Application, logger: logging.Logger = None,
+                             callback_list: list[dict] = None) -> list[dict]:
+    """
+    Extract callback start/end timestamps
+
+    Parameters
+    ----------
+    app : Application
+        Application of trace data
+    logger : logging.Logger
+        Logger to warn callbacks without data
+    callback_list : list[dict]
+        Callbacks to extract in the catalog (Catalog.get_callback_list). All callbacks are extracted if None
+
+    Returns
+    -------
+    list[dict]
+        Records of callbacks which have data
+    """
+    if callback_list is None:
+        record_list = [_make_callback_record(callback, None, logger) for callback in app.callbacks]
+    else:
+        callback_dict = {callback.callback_name: callback for callback in app.callbacks}
+        record_list = [_make_callback_record(callback_dict[callback_info['callback_name']], callback_info, logger)
+                       for callback_info in callback_list if callback_info['callback_name'] in callback_dict]
+    return [record for record in record_list if record]
+
+
+def _make_communication_key(topic_name: str, publish_node_name: str, subscribe_node_name: str,
+                            callback_name: str) -> str:
+    """Make key of a communication (the same as the manifest key in check_callback_sub)"""
+    return f'{topic_name}:{publish_node_name}->{subscribe_node_name}:{callback_name}'
+
+
+@profiler.stage_function('extract_records')
+def extract_communication_records(app: Application, logger: logging.Logger = None,
+                                  communication_list: list[dict] = None) -> list[dict]:
+    """
+    Extract publish/subscribe timestamps of communications
+
+    Parameters
+    ----------
+    app : Application
+        Application of trace data
+    logger : logging.Logger
+        Logger to warn communications without data
+    communication_list : list[dict]
+        Communications to extract in the catalog (Catalog.communication_list).
+        If None, all communications are extracted and ones without any pub/sub event are skipped
+
+    Returns
+    -------
+    list[dict]
+        Records of communications
+    """
+    key_set = None
+    if communication_list is not None:
+        key_set = {_make_communication_key(communication['topic_name'], communication['publish_node_name'],
+                                           communication['subscribe_node_name'], communication['callback_name'])
+                   for communication in communication_list}
+
+    # Publishers and subscriptions are shared by communications of a topic, so each one is extracted once
+    pub_timestamps_dict = {}
+    sub_timestamps_dict = {}
+    record_list = []
+    for communication in app.communications:
+        title = f'{communication.topic_name} : {communication.publish_node_name} -> {communication.subscribe_node_name}'
+        try:
+            callback_subscription = communication.callback_subscription
+            if key_set is not None and _make_communication_key(
+                    communication.topic_name, communication.publish_node_name, communication.subscribe_node_name,
+                    callback_subscription.callback_name) not in key_set:
+                continue
+            pub_key = (communication.topic_name, communication.publish_node_name)
+            if pub_key not in pub_timestamps_dict:
+                pub_timestamps_dict[pub_key] = get_timestamps(communication.publisher.to_dataframe(),
+                                                              'rclcpp_publish_timestamp')
+            sub_key = callback_subscription.callback_name
+            if sub_key not in sub_timestamps_dict:
+                sub_timestamps_dict[sub_key] = get_timestamps(communication.subscription.to_dataframe(),
+                                                              'callback_start_timestamp')
+            pub_timestamps = pub_timestamps_dict[pub_key]
+            sub_timestamps = sub_timestamps_dict[sub_key]
+        except:
+            if logger:
+                logger.warning(f'Failed to get pub/sub data: {title}')
+            continue
+        if key_set is None and len(pub_timestamps) == 0 and len(sub_timestamps) == 0:
+            continue    # the topic is not in the trace data (or the chunk)
+        record_list.append({
+            'topic_name': communication.topic_name,
+            'publish_node_name': communication.publish_node_name,
+            'subscribe_node_name': communication.subscribe_node_name,
+            'callback_name': callback_subscription.callback_name,
+            'callback_displayname': utils.make_callback_displayname(callback_subscription),
+            'pub_timestamps': pub_timestamps,
+            'sub_timestamps': sub_timestamps,
+        })
+    return record_list
@@ -0,0 +1,155 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Streaming analysis which reads trace data chunk by chunk
+
+Only one chunk of trace data is loaded at a time, and statistics of each chunk are merged
+into accumulators, so that peak memory usage doesn't depend on the length of trace data.
+"""
+from __future__ import annotations
+from typing import Iterator
+import gc
+import logging
+import numpy as np
+from caret_analyze import Lttng, LttngEventFilter
+from common import profiler
+from common.stats_accumulator import StatsAccumulator, TimeBinAccumulator
+
+
+class _TraceRangeFilter(LttngEventFilter):
+    """Filter which accepts all events, and gets the length of trace data [sec] from the first and last event"""
+
+    def __init__(self):
+        self.trace_length = None
+
+    def accept(self, event: dict, common: LttngEventFilter.Common) -> bool:
+        if self.trace_length is None:
+            self.trace_length = (common.end_time - common.start_time) * 1e-9
+        return True
+
+
+def read_trace_chunks(trace_data: str, start_point: float, duration: float, chunk_duration: float,
+                      logger: logging.Logger = None, event_filter: LttngEventFilter = None) -> Iterator[Lttng]:
+    """
+    Read LTTng trace data for each chunk_duration [sec]
+
+    When duration is 0, chunks are read until the last event of trace data.
+    Note that caret_analyze reads whole trace data and filters events of the chunk,
+    so time to read all chunks is proportional to (number of chunks) x (length of trace data).
+    event_filter (e.g. event_filter.NodeEventFilter) is shared by all chunks
+    """
+    chunk_start = start_point
+    end_point = start_point + duration if duration > 0 else None
+    range_filter = _TraceRangeFilter()
+    while end_point is None or chunk_start < end_point:
+        chunk_duration_to_read = chunk_duration if end_point is None else min(chunk_duration, end_point - chunk_start)
+        if logger:
+            logger.info(f'Load trace data: {chunk_start:.1f} - {chunk_start + chunk_duration_to_read:.1f} [sec]')
+        with profiler.stage('load_trace'):
+            # The range filter is needed only for the first chunk, and it needs to see all events
+            event_filters = [range_filter] if range_filter.trace_length is None else []
+            event_filters += [event_filter] if event_filter else []
+            event_filters.append(LttngEventFilter.duration_filter(chunk_duration_to_read, chunk_start))
+            lttng = Lttng(trace_data, force_conversion=False, event_filters=event_filters)
+        yield lttng
+        del lttng
+        gc.collect()
+        chunk_start += chunk_duration
+        if range_filter.trace_length is None or chunk_start > range_filter.trace_length:
+            break    # reached the end of trace data (or trace data has no event)
+
+
+def _make_info(record: dict) -> dict:
+    """Get information (not timestamp arrays) of a record"""
+    return {key: value for key, value in record.items() if not isinstance(value, np.ndarray)}
+
+
+class CallbackStream:
+    """Statistics of callbacks merged over chunks (records are made by trace_cache.extract_callback_records)"""
+
+    def __init__(self, freq_window: float = 1.0):
+        self.freq_window_ns = int(freq_window * 1e9)
+        self.callback_dict: dict[str, dict] = {}
+
+    def add(self, callback_record_list: list[dict]):
+        """Add callback records of a chunk"""
+        for record in callback_record_list:
+            callback = self.callback_dict.get(record['callback_name'])
+            if callback is None:
+                callback = _make_info(record)
+                # Frequency, period and latency per 1 second are kept to draw timeseries graph
+                callback['frequency'] = TimeBinAccumulator(10**9)
+                callback['period'] = TimeBinAccumulator(10**9)
+                callback['latency'] = TimeBinAccumulator(10**9)
+                callback['period_stats'] = StatsAccumulator()
+                callback['latency_stats'] = StatsAccumulator()
+                callback['timer_frequency'] = TimeBinAccumulator(self.freq_window_ns)
+                callback['last_start_timestamp'] = None
+                self.callback_dict[record['callback_name']] = callback
+
+            start_timestamps = record['start_timestamps']
+            end_timestamps = record['end_timestamps']
+            if len(start_timestamps) == 0:
+                continue
+            latency_list = (end_timestamps - start_timestamps) * 1e-6    # [msec]
+            if callback['last_start_timestamp'] is None:
+                period_timestamps = start_timestamps[1:]
+                period_list = np.diff(start_timestamps) * 1e-6    # [msec]
+            else:
+                # Period between the last call in the previous chunk and the first call in this chunk is included
+                period_timestamps = start_timestamps
+                period_list = np.diff(start_timestamps, prepend=callback['last_start_timestamp']) * 1e-6
+            callback['last_start_timestamp'] = int(start_timestamps[-1])
+
+            callback['frequency'].add(start_timestamps)
+            callback['period'].add(period_timestamps, period_list)
+            callback['latency'].add(start_timestamps, latency_list)
+            callback['period_stats'].add(period_list)
+            callback['latency_stats'].add(latency_list)
+            if callback['period_ns'] is not None:
+                callback['timer_frequency'].add(start_timestamps)
+
+
+class CommunicationStream:
+    """
+    Pub/Sub frequency of communications merged over chunks (records are made by trace_cache.extract_communication_records)
+
+    Frequency of a publisher (or a subscription) is accumulated once and shared by its communications
+    """
+
+    def __init__(self, freq_window: float = 1.0):
+        self.freq_window_ns = int(freq_window * 1e9)
+        self.communication_dict: dict[tuple, dict] = {}
+        self.frequency_dict: dict[tuple, TimeBinAccumulator] = {}
+
+    def add(self, communication_record_list: list[dict]):
+        """Add communication records of a chunk"""
+        added_key_set = set()
+        for record in communication_record_list:
+            key = (record['topic_name'], record['publish_node_name'], record['subscribe_node_name'],
+                   record['callback_name'])
+            pub_key = ('pub', record['topic_name'], record['publish_node_name'])
+            sub_key = ('sub', record['topic_name'], record['callback_name'])
+            communication = self.communication_dict.get(key)
+            if communication is None:
+                communication = _make_info(record)
+                communication['pub_frequency'] = self.frequency_dict.setdefault(
+                    pub_key, TimeBinAccumulator(self.freq_window_ns))
+                communication['sub_frequency'] = self.frequency_dict.setdefault(
+                    sub_key, TimeBinAccumulator(self.freq_window_ns))
+                self.communication_dict[key] = communication
+            for frequency_key, timestamps in [(pub_key, record['pub_timestamps']), (sub_key, record['sub_timestamps'])]:
+                if frequency_key not in added_key_set:
+                    self.frequency_dict[frequency_key].add(timestamps)
+                    added_key_set.add(frequency_key)
@@ -19,13 +19,24 @@ import os
 import sys
 import shutil
 import logging
-import re
 import json
+import argparse
+import multiprocessing
+import concurrent.futures
 from caret_analyze import Lttng, LttngEventFilter
 from caret_analyze.runtime.callback import CallbackBase
 from bokeh.plotting import Figure, save
 from bokeh.resources import CDN
 from bokeh.io import export_png
+from common.png_renderer import PngRenderer
+from common import profiler, graph_bundle, results_db
+from common.downsample import downsample_figure
+
+_png_renderer: PngRenderer = None
+_png_mode = 'immediate'
+_html_mode = 'standalone'
+_max_points = 0
+PNG_PENDING_FILENAME = 'png_pending.txt'
 
 
 def create_logger(name, level: int=logging.DEBUG, log_filename: str=None) -> logging.Logger:
@@ -47,11 +58,12 @@ def create_logger(name, level: int=logging.DEBUG, log_filename: str=None) -> log
     return logger
 
 
-def make_destination_dir(dest_dir: str, force: bool=False, logger: logging.Logger=None):
-    """Make directory"""
+def make_destination_dir(dest_dir: str, force: bool=False, logger: logging.Logger=None,
+                         incremental: bool=False):
+    """Make directory. In incremental mode, the existing directory is kept to reuse the previous results"""
     if not os.path.isdir(dest_dir):
         os.makedirs(dest_dir)
-    else:
+    elif not incremental:
         if force:
             shutil.rmtree(dest_dir)
             os.makedirs(dest_dir)
@@ -61,19 +73,24 @@ def make_destination_dir(dest_dir: str, force: bool=False, logger: logging.Logge
             sys.exit(-1)
 
 
+@profiler.stage_function('load_trace')
 def read_trace_data(trace_data: str, start_point: float, duration: float,
-                    force_conversion=False) -> Lttng:
-    """Read LTTng trace data"""
+                    force_conversion=False, event_filter: LttngEventFilter = None,
+                    logger: logging.Logger = None) -> Lttng:
+    """Read LTTng trace data. Events are also filtered by event_filter (e.g. event_filter.NodeEventFilter)"""
+    # event_filter is applied first to see all initialization events
+    event_filters = [event_filter] if event_filter else []
     if start_point > 0 and duration == 0:
-        return Lttng(trace_data, force_conversion=force_conversion, event_filters=[
-            LttngEventFilter.strip_filter(start_point, None)
-        ])
+        event_filters.append(LttngEventFilter.strip_filter(start_point, None))
     elif start_point >= 0 and duration > 0:
-        return Lttng(trace_data, force_conversion=force_conversion, event_filters=[
-            LttngEventFilter.duration_filter(duration, start_point)
-        ])
-    else:
+        event_filters.append(LttngEventFilter.duration_filter(duration, start_point))
+    if len(event_filters) == 0:
         return Lttng(trace_data, force_conversion=force_conversion)
+    num_rejected = event_filter.num_rejected if event_filter else 0
+    lttng = Lttng(trace_data, force_conversion=force_conversion, event_filters=event_filters)
+    if event_filter and logger:
+        logger.info(f'Events rejected by event filter: {event_filter.num_rejected - num_rejected}')
+    return lttng
 
 
 def make_callback_displayname(callback: CallbackBase) -> str:
@@ -88,15 +105,137 @@ def make_callback_displayname(callback: CallbackBase) -> str:
     return displayname
 
 
+def add_common_arguments(parser: argparse.ArgumentParser, use_cache: bool = True):
+    """Add options which are common to report scripts. Call apply_common_arguments with the parsed arguments"""
+    if use_cache:
+        parser.add_argument('--cache_dir', type=str, default='caret_report_cache',
+                            help='Directory to cache timestamp records. Set empty string not to use cache')
+    parser.add_argument('--html', type=str, default='standalone', choices=['standalone', 'bundle'],
+                        help='standalone: export html file for each graph, bundle: bundle graphs of each report page into one file, and draw them when they are scrolled into view')
+    parser.add_argument('--png', type=str, default='immediate', choices=['immediate', 'deferred'],
+                        help='immediate: export png files with html files, deferred: export png files later using render_png.py')
+    parser.add_argument('--png_workers', type=int, default=0,
+                        help='The number of web drivers to export png files concurrently (0: one by one)')
+    parser.add_argument('--max_points', type=int, default=10000,
+                        help='The maximum number of points of each line (and markers) in timeseries graphs. Points are downsampled keeping peaks (0: not downsampled)')
+    parser.add_argument('--export_yaml', action='store_true', default=False,
+                        help='Export stats_*.yaml files in addition to results.db')
+    parser.add_argument('--profile', action='store_true', default=False,
+                        help='Save wall time, CPU time and peak memory of each stage and item in profile.json')
+    parser.add_argument('--profile_cprofile', type=int, default=0,
+                        help='Save cProfile output of the slowest N items with --profile')
+
+
+def apply_common_arguments(args: argparse.Namespace, script_name: str, report_dir: str,
+                           logger: logging.Logger = None):
+    """
+    Apply options added by add_common_arguments
+
+    Profiler is started with --profile, and png renderer is started with --png_workers.
+    Call stop_png_renderer and profiler.save_profile at the end of the script
+    """
+    if args.profile:
+        profiler.start_profile(script_name, report_dir, args.profile_cprofile)
+    set_png_mode(args.png)
+    set_html_mode(args.html)
+    set_max_points(args.max_points)
+    results_db.set_export_yaml(args.export_yaml)
+    start_png_renderer(args.png_workers, logger)
+
+
+def start_png_renderer(num_workers: int, logger: logging.Logger = None):
+    """Start renderer to export png files concurrently in export_graph. Nothing is done if num_workers is 0"""
+    global _png_renderer
+    if num_workers > 0:
+        _png_renderer = PngRenderer(num_workers, logger)
+
+
+def set_png_mode(png_mode: str):
+    """
+    Set how to export png files in export_graph
+
+    immediate: export png file with html file
+    deferred: export html file only, and add the file name to the list of pending png files.
+              png files are created later using render_png/render_png.py
+    """
+    global _png_mode
+    _png_mode = png_mode
+
+
+def set_html_mode(html_mode: str):
+    """
+    Set how to export html files in export_graph
+
+    standalone: export standalone html file for each graph
+    bundle: add graph to the bundle of the destination directory (graph_bundle.py).
+            Graphs are drawn in the report page when they are scrolled into view
+    """
+    global _html_mode
+    _html_mode = html_mode
+
+
+def set_max_points(max_points: int):
+    """Set the maximum number of points of each line in graphs exported by export_graph (0: not downsampled)"""
+    global _max_points
+    _max_points = max_points
+
+
+def stop_png_renderer():
+    """Wait until all png files are exported, and stop renderer"""
+    global _png_renderer
+    if _png_renderer:
+        with profiler.stage('wait_png'):
+            _png_renderer.close()
+        _png_renderer = None
+
+
 def export_graph(figure: Figure, dest_dir: str, filename: str, title='graph',
                  logger: logging.Logger = None) -> None:
-    """Export graph as html and image"""
-    save(figure, filename=f'{dest_dir}/{filename}.html', title=title, resources=CDN)
+    """Export graph as html (or into the bundle) and image"""
+    with profiler.stage('export_html'):
+        if _max_points > 0:
+            downsample_figure(figure, _max_points)
+        if _html_mode == 'bundle':
+            graph_bundle.add_graph(figure, dest_dir, filename)
+        else:
+            save(figure, filename=f'{dest_dir}/{filename}.html', title=title, resources=CDN)
+    if _png_mode == 'deferred':
+        # Each line is short enough to be appended atomically from worker processes
+        with open(f'{dest_dir}/{PNG_PENDING_FILENAME}', 'a', encoding='utf-8') as f_pending:
+            f_pending.write(filename + '\n')
+        return
+    # Renderer cannot be used in forked worker processes because its threads and web drivers are not copied
+    if _png_renderer and _png_renderer.pid == os.getpid():
+        _png_renderer.submit(figure, f'{dest_dir}/{filename}.png')
+        return
     try:
-        export_png(figure, filename=f'{dest_dir}/{filename}.png')
+        with profiler.stage('export_png'):
+            export_png(figure, filename=f'{dest_dir}/{filename}.png')
     except:
         if logger:
-            logger.warning('Unable to export png')
+            logger.warning(f'Unable to export png: {dest_dir}/{filename}.png')
+
+
+def run_in_process_pool(func, item_list: list, jobs: int, logger: logging.Logger = None) -> list:
+    """
+    Run func for each item using process pool, and return results in the same order as item_list
+
+    Worker processes are forked, so objects which func refers to via global variables
+    (e.g. trace data) are shared with workers without pickling.
+    None is stored as a result when func fails for the item, and the other items are still processed.
+    """
+    result_list = [None] * len(item_list)
+    mp_context = multiprocessing.get_context('fork')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, mp_context=mp_context) as executor:
+        future_index_dict = {executor.submit(func, item): index for index, item in enumerate(item_list)}
+        for future in concurrent.futures.as_completed(future_index_dict):
+            index = future_index_dict[future]
+            try:
+                result_list[index] = future.result()
+            except Exception as e:
+                if logger:
+                    logger.error(f'Failed to process {item_list[index]}: {e}')
+    return result_list
 
 
 def make_package_list(package_list_json_path: str, logger: logging.Logger = None) -> tuple[dict, list]:
@@ -128,21 +267,3 @@ def make_package_list(package_list_json_path: str, logger: logging.Logger = None
         logger.debug(f'ignore_list = {ignore_list}')
 
     return package_dict, ignore_list
-
-
-def nodename2packagename(package_dict: dict, node_name: str) -> str:
-    """Convert node name to package name"""
-    for package_name, regexp in package_dict.items():
-        if re.search(regexp, node_name):
-            return package_name
-    return ''
-
-
-def check_if_ignore(package_dict: dict, ignore_list: list[str], callback_name: str) -> bool:
-    """Check if the callback should be ignored"""
-    # if nodename2packagename(package_dict, callback_name) == '':
-    #     return True
-    for ignore in ignore_list:
-        if re.search(ignore, callback_name):
-            return True
-    return False
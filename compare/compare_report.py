@@ -0,0 +1,290 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Script to compare two reports and find performance regression
+
+Callbacks, communications, timers and paths are aligned by name.
+Entries which are not found by name (e.g. renamed nodes) are aligned by package name and callback display name,
+if it's unique in the package.
+"""
+from __future__ import annotations
+import sys
+import os
+import math
+from pathlib import Path
+import argparse
+import logging
+import yaml
+import flask
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+from common import utils
+from common.results_db import ResultsDb
+
+_logger: logging.Logger = None
+app = flask.Flask(__name__)
+
+# Metrics to compare for each kind: (metrics name, key of value, key of std, key of count, higher is worse)
+METRICS_DICT = {
+    'callback': [
+        ('latency_avg', 'Latency_avg', 'Latency_std', 'Latency_count', True),
+        ('latency_p99', 'Latency_p99', None, None, True),
+        ('frequency_avg', 'Frequency_avg', 'Frequency_std', 'Frequency_count', False),
+    ],
+    'communication': [
+        ('subscription_freq', 'subscription_freq', None, None, False),
+        ('num_huge_gap', 'num_huge_gap', None, None, True),
+    ],
+    'timer': [
+        ('freq_callback', 'freq_callback', None, None, False),
+        ('num_huge_gap', 'num_huge_gap', None, None, True),
+        ('jitter', 'jitter', None, None, True),
+    ],
+    'path': [
+        ('response_time_avg', 'total_avg', 'total_std', 'total_count', True),
+        ('response_time_p99', 'total_p99', None, None, True),
+        ('response_time_worst_p99', 'worst_p99', None, None, True),
+    ],
+}
+
+
+def load_entries(report_dir: str) -> dict[str, list[dict]]:
+    """
+    Load entries of each kind from results.db
+
+    Each entry has 'name' and 'key' to align by name, 'alt_key' to align renamed entries, and values of metrics
+    """
+    entry_dict = {'callback': [], 'communication': [], 'timer': [], 'path': []}
+    with ResultsDb(report_dir) as db:
+        # A node may match multiple packages. The first package is used
+        callback_dict = {}
+        for package_name in db.get_package_list():
+            for node_name, node_stats in db.load_node_stats(package_name).items():
+                for callback_name, callback_stats in node_stats['callbacks'].items():
+                    entry = callback_dict.setdefault(callback_name, {
+                        'name': callback_name,
+                        'key': (node_name, callback_name),
+                        'alt_key': (package_name, callback_stats['displayname']),
+                    })
+                    for metrics in ['Latency', 'Frequency']:
+                        for key, value in (callback_stats.get(metrics) or {}).items():
+                            entry[f'{metrics}_{key}'] = value
+        entry_dict['callback'] = list(callback_dict.values())
+
+        for stats in db.load_communication_stats():
+            entry_dict['communication'].append(dict(stats, name=stats['title'],
+                key=(stats['topic_name'], stats['publisher_name'], stats['node_name'], stats['callback_name']),
+                alt_key=(stats['package_name'], stats['topic_name'], stats['callback_displayname'])))
+        for stats in db.load_timer_stats():
+            entry_dict['timer'].append(dict(stats, name=stats['callback_name'], key=(stats['callback_name'], ),
+                                            alt_key=(stats['package_name'], stats['callback_displayname'])))
+        for stats in db.load_path_stats():
+            entry_dict['path'].append(dict(stats, name=stats['target_path_name'], key=(stats['target_path_name'], ),
+                                           alt_key=None))
+    return entry_dict
+
+
+def align_entries(entry_list_old: list[dict], entry_list_new: list[dict]) -> tuple[list, list, list]:
+    """
+    Align entries by key, then by alt_key for the rest
+
+    Returns
+    -------
+    pair_list : list[tuple[dict, dict]]
+        pairs of old entry and new entry
+    removed_list : list[dict]
+        old entries which are not found in new
+    added_list : list[dict]
+        new entries which are not found in old
+    """
+    new_dict = {entry['key']: entry for entry in entry_list_new}
+    pair_list = []
+    rest_old_list = []
+    for entry in entry_list_old:
+        if entry['key'] in new_dict:
+            pair_list.append((entry, new_dict.pop(entry['key'])))
+        else:
+            rest_old_list.append(entry)
+    rest_new_list = list(new_dict.values())
+
+    def _make_unique_dict(entry_list: list[dict]) -> dict:
+        alt_key_count = {}
+        for entry in entry_list:
+            alt_key_count[entry['alt_key']] = alt_key_count.get(entry['alt_key'], 0) + 1
+        return {entry['alt_key']: entry for entry in entry_list
+                if entry['alt_key'] is not None and alt_key_count[entry['alt_key']] == 1}
+
+    unique_old_dict = _make_unique_dict(rest_old_list)
+    unique_new_dict = _make_unique_dict(rest_new_list)
+    renamed_pair_list = [(entry, unique_new_dict[alt_key]) for alt_key, entry in unique_old_dict.items()
+                         if alt_key in unique_new_dict]
+    renamed_id_set = {id(entry) for pair in renamed_pair_list for entry in pair}
+    pair_list.extend(renamed_pair_list)
+    removed_list = [entry for entry in rest_old_list if id(entry) not in renamed_id_set]
+    added_list = [entry for entry in rest_new_list if id(entry) not in renamed_id_set]
+    return pair_list, removed_list, added_list
+
+
+def calc_z_score(avg_old: float, std_old: float, count_old: int,
+                 avg_new: float, std_new: float, count_new: int) -> float:
+    """Calculate z score of difference of two means (Welch's t-test). None is returned if it can't be calculated"""
+    if not all(isinstance(value, (int, float)) for value in [std_old, count_old, std_new, count_new]) \
+            or count_old < 2 or count_new < 2:
+        return None
+    standard_error = math.sqrt(std_old ** 2 / count_old + std_new ** 2 / count_new)
+    if standard_error == 0:
+        return 0.0 if avg_new == avg_old else math.copysign(math.inf, avg_new - avg_old)
+    return (avg_new - avg_old) / standard_error
+
+
+def compare_pair(kind: str, entry_old: dict, entry_new: dict, threshold_ratio: float, z_threshold: float) -> list[dict]:
+    """Compare metrics of a pair of entries"""
+    result_list = []
+    name = entry_new['name'] if entry_old['name'] == entry_new['name'] else f"{entry_old['name']} -> {entry_new['name']}"
+    for metrics, value_key, std_key, count_key, higher_is_worse in METRICS_DICT[kind]:
+        value_old = entry_old.get(value_key)
+        value_new = entry_new.get(value_key)
+        if not isinstance(value_old, (int, float)) or not isinstance(value_new, (int, float)):
+            continue
+        delta = value_new - value_old
+        worse_delta = delta if higher_is_worse else -delta
+        if value_old != 0:
+            worse_ratio = worse_delta / abs(value_old)
+        else:
+            worse_ratio = 0.0 if worse_delta == 0 else math.copysign(math.inf, worse_delta)
+        z_score = None
+        if std_key:
+            z_score = calc_z_score(value_old, entry_old.get(std_key), entry_old.get(count_key),
+                                   value_new, entry_new.get(std_key), entry_new.get(count_key))
+        is_significant = z_score is None or abs(z_score) >= z_threshold
+        result_list.append({
+            'kind': kind,
+            'name': name,
+            'metrics': metrics,
+            'old': float(value_old),
+            'new': float(value_new),
+            'delta': float(delta),
+            'worse_ratio': float(worse_ratio),
+            'z_score': z_score,
+            'is_significant': is_significant,
+            'is_regression': worse_delta > 0 and worse_ratio > threshold_ratio and is_significant,
+        })
+    return result_list
+
+
+def compare(report_dir_old: str, report_dir_new: str, threshold_ratio: float, z_threshold: float) -> dict:
+    """Compare two reports"""
+    entry_dict_old = load_entries(report_dir_old)
+    entry_dict_new = load_entries(report_dir_new)
+    result_list = []
+    removed_list = []
+    added_list = []
+    for kind in METRICS_DICT:
+        pair_list, removed, added = align_entries(entry_dict_old[kind], entry_dict_new[kind])
+        for entry_old, entry_new in pair_list:
+            result_list.extend(compare_pair(kind, entry_old, entry_new, threshold_ratio, z_threshold))
+        removed_list.extend([{'kind': kind, 'name': entry['name']} for entry in removed])
+        added_list.extend([{'kind': kind, 'name': entry['name']} for entry in added])
+
+    # The biggest regressions first
+    result_list = sorted(result_list, key=lambda x: (not x['is_regression'], -x['worse_ratio']))
+    return {
+        'regression_list': [dict(result) for result in result_list if result['is_regression']],
+        'result_list': result_list,
+        'removed_list': removed_list,
+        'added_list': added_list,
+    }
+
+
+def render_page(destination_path, template_path, title, comparison, threshold_ratio, z_threshold):
+    """Render html page"""
+    with app.app_context():
+        with open(template_path, 'r', encoding='utf-8') as f_html:
+            template_string = f_html.read()
+            rendered = flask.render_template_string(
+                template_string,
+                title=title,
+                comparison=comparison,
+                threshold_ratio=threshold_ratio,
+                z_threshold=z_threshold,
+            )
+
+        with open(destination_path, 'w', encoding='utf-8') as f_html:
+            f_html.write(rendered)
+
+
+def check_report_dir(report_dir: str):
+    """Check if the directory is a report created by make_report.py"""
+    if not ResultsDb.exists(report_dir):
+        _logger.error(f'results.db is not found in {report_dir}. '
+                      'Create report using make_report.py first (trace data can\'t be compared directly)')
+        sys.exit(-1)
+
+
+def parse_arg():
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(
+                description='Script to compare two reports and find performance regression')
+    parser.add_argument('report_directory_old', nargs=1, type=str)
+    parser.add_argument('report_directory_new', nargs=1, type=str)
+    parser.add_argument('-o', '--output_directory', type=str, default='',
+                        help='Directory to create comparison report (default: compare_{old}_{new})')
+    parser.add_argument('--threshold_ratio', type=float, default=0.1,
+                        help='Regression when a metrics gets worse more than this ratio (e.g. 0.1 = 10%%)')
+    parser.add_argument('--z_threshold', type=float, default=3.0,
+                        help='Regression of avg only when z score of the difference is larger than this (statistically significant)')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    """Main function"""
+    args = parse_arg()
+
+    global _logger
+    if args.verbose:
+        _logger = utils.create_logger(__name__, logging.DEBUG)
+    else:
+        _logger = utils.create_logger(__name__, logging.INFO)
+
+    report_dir_old = str(Path(args.report_directory_old[0]))
+    report_dir_new = str(Path(args.report_directory_new[0]))
+    dest_dir = args.output_directory or f'compare_{Path(report_dir_old).name}_{Path(report_dir_new).name}'
+    _logger.debug(f'report_directory_old: {report_dir_old}')
+    _logger.debug(f'report_directory_new: {report_dir_new}')
+    _logger.debug(f'dest_dir: {dest_dir}')
+    _logger.debug(f'threshold_ratio: {args.threshold_ratio}, z_threshold: {args.z_threshold}')
+    check_report_dir(report_dir_old)
+    check_report_dir(report_dir_new)
+
+    comparison = compare(report_dir_old, report_dir_new, args.threshold_ratio, args.z_threshold)
+    os.makedirs(dest_dir, exist_ok=True)
+    with open(f'{dest_dir}/compare.yaml', 'w', encoding='utf-8') as f_yaml:
+        yaml.safe_dump(comparison, f_yaml, encoding='utf-8', allow_unicode=True, sort_keys=False)
+    title = f'Comparison: {Path(report_dir_old).resolve().name} -> {Path(report_dir_new).resolve().name}'
+    template_path = f'{Path(__file__).resolve().parent}/template_compare.html'
+    render_page(f'{dest_dir}/index.html', template_path, title, comparison, args.threshold_ratio, args.z_threshold)
+
+    regression_list = comparison['regression_list']
+    for regression in regression_list:
+        _logger.warning(f"Regression: [{regression['kind']}] {regression['name']}: {regression['metrics']} "
+                        f"{regression['old']:.3f} -> {regression['new']:.3f}")
+    if regression_list:
+        _logger.error(f'<<< NG. {len(regression_list)} regressions are found >>>')
+        sys.exit(1)
+    _logger.info('<<< OK. No regression is found >>>')
+
+
+if __name__ == '__main__':
+    main()
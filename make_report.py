@@ -0,0 +1,301 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Script to make all reports in one process (trace data is loaded only once)
+"""
+from __future__ import annotations
+import sys
+import os
+from pathlib import Path
+import argparse
+from distutils.util import strtobool
+import logging
+import shutil
+from caret_analyze import Architecture, Application
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from common import utils, profiler
+from common.catalog import Catalog, make_catalog
+from common.event_filter import NodeEventFilter, make_package_event_filter
+from common.trace_cache import TraceCache, extract_callback_records, extract_communication_records
+from common.trace_stream import CallbackStream, CommunicationStream, read_trace_chunks
+from analyze_node import analyze_node, make_report_node
+from check_callback_sub import check_callback_sub, make_report_sub
+from check_callback_timer import check_callback_timer, make_report_timer
+from analyze_path import add_path_to_architecture, analyze_path, make_report_path
+from top import make_report_top
+
+_logger: logging.Logger = None
+
+
+def make_event_filter(args) -> NodeEventFilter:
+    """Make filter to load only nodes in packages and nodes in target paths (None if not enabled)"""
+    if not args.event_filter:
+        return None
+    package_dict, ignore_list = utils.make_package_list(args.package_list_json)
+    target_path_list = add_path_to_architecture.read_target_path_json(args.target_path_json)
+    path_node_regexp_list = [add_path_to_architecture.get_node_topic(info)[0]
+                             for target_path in target_path_list for info in target_path['path']]
+    return make_package_event_filter(package_dict, ignore_list, path_node_regexp_list)
+
+
+def check_callbacks(args, communication_record_list: list[dict], callback_record_list: list[dict],
+                    report_dir: str, catalog: Catalog):
+    """Check subscription and timer callbacks (trace data is not needed)"""
+    _logger.info('Check subscription callbacks')
+    with profiler.stage('check_callback_sub'):
+        check_callback_sub.analyze(args, communication_record_list, f'{report_dir}/check_callback_sub', catalog)
+    _logger.info('Check timer callbacks')
+    with profiler.stage('check_callback_timer'):
+        check_callback_timer.analyze(args, callback_record_list, f'{report_dir}/check_callback_timer', catalog)
+
+
+def load_trace_data(args, event_filter: NodeEventFilter):
+    """Load trace data"""
+    _logger.info('Load trace data')
+    return utils.read_trace_data(args.trace_data[0], args.start_point, args.duration, False,
+                                 event_filter, _logger)
+
+
+def make_report(args, report_dir: str):
+    """Run all analysis"""
+    dest_dir_node = f'{report_dir}/node'
+    dest_dir_sub = f'{report_dir}/check_callback_sub'
+    dest_dir_timer = f'{report_dir}/check_callback_timer'
+    dest_dir_path = f'{report_dir}/path'
+
+    # Check destination before loading trace data, because loading takes long time
+    for dest_dir in [dest_dir_node, dest_dir_sub, dest_dir_timer, dest_dir_path]:
+        utils.make_destination_dir(dest_dir, args.force, _logger, args.incremental)
+
+    # All analyses except for paths use cached records and architecture. Trace data is loaded only when
+    # one of them is not cached, or when a path needs to be analyzed again
+    event_filter = make_event_filter(args)
+    cache = TraceCache(args.cache_dir, args.trace_data[0], args.start_point, args.duration, _logger,
+                       event_filter)
+    communication_record_list = cache.load('communication')
+    callback_record_list = cache.load('callback')
+    arch = cache.load_architecture()
+    lttng = None
+    if communication_record_list is None or callback_record_list is None or arch is None:
+        lttng = load_trace_data(args, event_filter)
+        with profiler.stage('load_architecture'):
+            if arch is None:
+                arch = Architecture('lttng', str(args.trace_data[0]))
+                cache.save_architecture(arch)
+            app = Application(arch, lttng)
+        catalog = make_catalog(args, report_dir, lttng, arch, app, _logger)
+        if communication_record_list is None:
+            communication_record_list = extract_communication_records(app, _logger, catalog.communication_list)
+            cache.save('communication', communication_record_list)
+        if callback_record_list is None:
+            callback_record_list = extract_callback_records(app, _logger, catalog.get_callback_list())
+            cache.save('callback', callback_record_list)
+        del app
+    else:
+        catalog = make_catalog(args, report_dir, logger=_logger)
+
+    _logger.info('Analyze nodes')
+    with profiler.stage('analyze_node'):
+        analyze_node.analyze(args, arch, callback_record_list, dest_dir_node, catalog)
+    check_callbacks(args, communication_record_list, callback_record_list, report_dir, catalog)
+
+    _logger.info('Analyze paths')
+    with profiler.stage('analyze_path'):
+        target_path_list = add_path_to_architecture.read_target_path_json(args.target_path_json)
+        add_path_to_architecture.add_path_to_architecture(args, arch, target_path_list)
+        # Architecture is reloaded because context_type is modified in the exported file
+        arch_path = Architecture('yaml', args.architecture_file_dst)
+        shutil.copy(args.architecture_file_dst, dest_dir_path)
+        app_path = None
+        if lttng is None and not analyze_path.is_analyzed(args, arch_path, dest_dir_path):
+            lttng = load_trace_data(args, event_filter)
+        if lttng is not None:
+            app_path = Application(arch_path, lttng)
+        analyze_path.analyze(args, arch_path, app_path, dest_dir_path)
+
+
+def make_report_stream(args, report_dir: str):
+    """Run all analysis reading trace data chunk by chunk"""
+    dest_dir_node = f'{report_dir}/node'
+    dest_dir_sub = f'{report_dir}/check_callback_sub'
+    dest_dir_timer = f'{report_dir}/check_callback_timer'
+    dest_dir_path = f'{report_dir}/path'
+    for dest_dir in [dest_dir_node, dest_dir_sub, dest_dir_timer, dest_dir_path]:
+        utils.make_destination_dir(dest_dir, args.force, _logger)
+
+    if args.architecture_file_src:
+        arch = Architecture('yaml', args.architecture_file_src)
+    else:
+        _logger.info('Load architecture (set --architecture_file_src not to load whole trace data)')
+        arch = Architecture('lttng', str(args.trace_data[0]))
+    target_path_list = add_path_to_architecture.read_target_path_json(args.target_path_json)
+    add_path_to_architecture.add_path_to_architecture(args, arch, target_path_list)
+    arch_path = Architecture('yaml', args.architecture_file_dst)
+    shutil.copy(args.architecture_file_dst, dest_dir_path)
+    analyze_path.verify_paths(arch_path)
+    catalog = make_catalog(args, report_dir, logger=_logger)
+
+    callback_stream = CallbackStream(args.freq_window)
+    communication_stream = CommunicationStream(args.freq_window)
+    response_time_list_dict = {}
+    window_state_dict = {}
+    event_filter = make_event_filter(args)
+    for lttng in read_trace_chunks(args.trace_data[0], args.start_point, args.duration,
+                                   args.chunk_duration, _logger, event_filter):
+        app = Application(arch, lttng)
+        callback_record_list = extract_callback_records(app, _logger)
+        if len(callback_record_list) == 0:
+            continue    # no callback in the chunk (e.g. idle time)
+        callback_stream.add(callback_record_list)
+        communication_stream.add(extract_communication_records(app, _logger))
+        app_path = Application(arch_path, lttng)
+        analyze_path.analyze_chunk(args, arch_path, app_path, dest_dir_path, response_time_list_dict,
+                                   window_state_dict)
+        del app, app_path
+
+    _logger.info('Analyze nodes')
+    with profiler.stage('analyze_node'):
+        analyze_node.analyze_stream(args, arch, callback_stream, dest_dir_node, catalog)
+    _logger.info('Check subscription callbacks')
+    with profiler.stage('check_callback_sub'):
+        check_callback_sub.analyze_stream(args, communication_stream, dest_dir_sub, catalog)
+    _logger.info('Check timer callbacks')
+    with profiler.stage('check_callback_timer'):
+        check_callback_timer.analyze_stream(args, callback_stream, dest_dir_timer, catalog)
+    _logger.info('Analyze paths')
+    with profiler.stage('analyze_path'):
+        analyze_path.analyze_stream(args, arch_path, response_time_list_dict, window_state_dict,
+                                     dest_dir_path)
+
+
+def make_report_pages(args, report_dir: str):
+    """Make all report pages (after all png files are exported)"""
+    _logger.info('Make report pages')
+    make_report_node.make_reports(report_dir)
+    make_report_sub.make_reports(report_dir)
+    make_report_timer.make_reports(report_dir)
+    make_report_path.make_reports(report_dir)
+    # Profile is saved only once here, so that the top page shows the whole profile including wait for png files
+    profiler.save_profile(_logger)
+    make_report_top.make_report(report_dir, 'index', args.topk_key)
+
+
+def parse_arg():
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(
+                description='Script to make all reports in one process')
+    parser.add_argument('trace_data', nargs=1, type=str)
+    parser.add_argument('--package_list_json', type=str, default='')
+    parser.add_argument('--target_path_json', type=str, required=True)
+    parser.add_argument('--architecture_file_src', type=str, default='',
+                        help='Architecture file used in streaming mode instead of reading architecture from trace data')
+    parser.add_argument('--architecture_file_dst', type=str, default='architecture_path.yaml')
+    parser.add_argument('--use_latest_message', action='store_true', default=True,
+                        help='Convert UNDEFINED context_type of callbacks to use_latest_message (default)')
+    parser.add_argument('--no_use_latest_message', dest='use_latest_message', action='store_false',
+                        help='Keep context_type of the architecture file as it is')
+    parser.add_argument('--max_node_depth', type=int, default=20,
+                        help='The maximum number of nodes in a path. Longer paths in JSON are not searched (0: not limited)')
+    parser.add_argument('-m', '--message_flow', type=strtobool, default=False,
+                        help='Output message flow graph of whole time period')
+    parser.add_argument('--messageflow_topk', type=int, default=3,
+                        help='The number of time windows where message flow graph is drawn. Windows with the longest response time or drops are chosen')
+    parser.add_argument('--messageflow_window', type=float, default=3.0,
+                        help='Width[sec] of each time window of message flow graph')
+    parser.add_argument('-s', '--start_point', type=float, default=0.0,
+                        help='Start point[sec] to load trace data')
+    parser.add_argument('-d', '--duration', type=float, default=0.0,
+                        help='Duration[sec] to load trace data')
+    parser.add_argument('--event_filter', action='store_true', default=False,
+                        help='Load only events of nodes which match package_list_json and are not ignored, and nodes in target paths')
+    parser.add_argument('-r', '--gap_threshold_ratio', type=float, default=0.2,
+                        help='Warning when callback_freq is less than "gap_threshold_ratio" * timer_period for "count_threshold" times')
+    parser.add_argument('-n', '--count_threshold', type=int, default=10,
+                        help='Warning when callback_freq is less than "gap_threshold_ratio" * timer_period for "count_threshold" times')
+    parser.add_argument('--freq_window', type=float, default=1.0,
+                        help='Window size[sec] to measure frequency')
+    parser.add_argument('--freq_step', type=float, default=0.0,
+                        help='Step[sec] of sliding window to measure frequency (0: windows don\'t overlap)')
+    parser.add_argument('--hist_binsize', type=float, default=0.0,
+                        help='Bin size[ms] of response time histogram (0: calculated from range)')
+    parser.add_argument('-f', '--force', action='store_true', default=False,
+                        help='Overwrite report directory')
+    parser.add_argument('-i', '--incremental', action='store_true', default=False,
+                        help='Keep report directory, and analyze only entries whose inputs are changed from the previous run')
+    parser.add_argument('--chunk_duration', type=float, default=0.0,
+                        help='Read trace data chunk by chunk with this duration[sec] to reduce memory usage (0: read at once)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='The number of processes to analyze nodes and paths in parallel')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    parser.add_argument('--topk_key', type=str, default='avg', choices=['avg', 'p99'],
+                        help='Latency stats to sort callbacks in Top k list')
+    utils.add_common_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    """Main function"""
+    args = parse_arg()
+
+    global _logger
+    if args.verbose:
+        _logger = utils.create_logger(__name__, logging.DEBUG)
+    else:
+        _logger = utils.create_logger(__name__, logging.INFO)
+
+    # Each analysis script outputs log using its own module logger
+    for module in [analyze_node, check_callback_sub, check_callback_timer,
+                   add_path_to_architecture, analyze_path]:
+        module._logger = _logger
+
+    _logger.debug(f'trace_data: {args.trace_data[0]}')
+    _logger.debug(f'package_list_json: {args.package_list_json}')
+    _logger.debug(f'target_path_json: {args.target_path_json}')
+    _logger.debug(f'start_point: {args.start_point}, duration: {args.duration}')
+    _logger.debug(f'event_filter: {args.event_filter}')
+    report_dir = f'report_{Path(args.trace_data[0]).stem}'
+    _logger.debug(f'report_dir: {report_dir}')
+    utils.apply_common_arguments(args, Path(__file__).stem, report_dir, _logger)
+    args.message_flow = True if args.message_flow == 1 else False
+    _logger.debug(f'message_flow: {args.message_flow}')
+    _logger.debug(f'messageflow_topk: {args.messageflow_topk}, messageflow_window: {args.messageflow_window}')
+    _logger.debug(f'hist_binsize: {args.hist_binsize}')
+    _logger.debug(f'gap_threshold_ratio: {args.gap_threshold_ratio}')
+    _logger.debug(f'count_threshold: {args.count_threshold}')
+    _logger.debug(f'freq_window: {args.freq_window}, freq_step: {args.freq_step}')
+    _logger.debug(f'jobs: {args.jobs}')
+    _logger.debug(f'chunk_duration: {args.chunk_duration}')
+    if args.chunk_duration > 0:
+        if args.freq_step > 0:
+            _logger.warning('freq_step is not supported in streaming mode. Windows don\'t overlap')
+            args.freq_step = 0.0
+        if args.message_flow:
+            _logger.warning('message_flow for whole time period is not supported in streaming mode')
+            args.message_flow = False
+        if args.incremental:
+            _logger.warning('incremental is not supported in streaming mode. All entries are analyzed')
+            args.incremental = False
+
+    if args.chunk_duration > 0:
+        make_report_stream(args, report_dir)
+    else:
+        make_report(args, report_dir)
+    utils.stop_png_renderer()
+    make_report_pages(args, report_dir)
+    _logger.info('<<< OK. All reports are created >>>')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Script to export png files which are deferred in analysis (--png=deferred)
+"""
+from __future__ import annotations
+import sys
+import os
+import glob
+from pathlib import Path
+import argparse
+import logging
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+from common import utils, graph_bundle
+from common.png_renderer import PngRenderer
+
+_logger: logging.Logger = None
+
+
+def read_pending_list(pending_path: str) -> list[str]:
+    """Read file names whose png file is not exported yet"""
+    with open(pending_path, encoding='utf-8') as f_pending:
+        filename_list = [line.strip() for line in f_pending if line.strip()]
+    return list(dict.fromkeys(filename_list))
+
+
+def write_pending_list(pending_path: str, filename_list: list[str]):
+    """Write file names whose png file is not exported yet. The file is removed if nothing remains"""
+    if filename_list:
+        with open(pending_path, 'w', encoding='utf-8') as f_pending:
+            f_pending.write(''.join(filename + '\n' for filename in filename_list))
+    else:
+        os.remove(pending_path)
+
+
+def select_filename_list(pending_path: str, filename_list: list[str],
+                         package_list: list[str], path_list: list[str]) -> list[str]:
+    """Select files to be exported. All files are selected when neither package nor path is specified"""
+    if not package_list and not path_list:
+        return filename_list
+    dir_path = Path(pending_path).parent
+    if dir_path.parent.name == 'node' and dir_path.name in package_list:
+        return filename_list
+    if dir_path.name == 'path':
+        # path name in architecture file is "{target_path_name}_{index}"
+        return [filename for filename in filename_list
+                if any(filename.startswith(f'{path_name}_') for path_name in path_list)]
+    return []
+
+
+def render_png(args):
+    """Export deferred png files"""
+    report_dir = args.report_directory[0]
+    pending_path_list = sorted(glob.glob(f'{report_dir}/**/{utils.PNG_PENDING_FILENAME}', recursive=True))
+    if not pending_path_list:
+        _logger.warning('No pending png file exists')
+        return
+
+    renderer = PngRenderer(max(1, args.png_workers), _logger)
+    num_failed = 0
+    for pending_path in pending_path_list:
+        dest_dir = str(Path(pending_path).parent)
+        filename_list = read_pending_list(pending_path)
+        target_filename_list = select_filename_list(pending_path, filename_list, args.package, args.path)
+        if not target_filename_list:
+            continue
+        _logger.info(f'Processing: {dest_dir} ({len(target_filename_list)} files)')
+        # Graphs exported with --html=bundle are restored from the bundle
+        item_dict = graph_bundle.load_graph_bundle(dest_dir)
+        future_list = [renderer.submit(graph_bundle.load_figure(item_dict[filename]), f'{dest_dir}/{filename}.png')
+                       if filename in item_dict
+                       else renderer.submit_html(f'{dest_dir}/{filename}.html', f'{dest_dir}/{filename}.png')
+                       for filename in target_filename_list]
+        failed_filename_list = [filename for filename, future in zip(target_filename_list, future_list)
+                                if not future.result()]
+        num_failed += len(failed_filename_list)
+        remaining_filename_list = [filename for filename in filename_list
+                                   if filename not in target_filename_list or filename in failed_filename_list]
+        write_pending_list(pending_path, remaining_filename_list)
+    renderer.close()
+    if num_failed > 0:
+        _logger.warning(f'{num_failed} png files are not exported. Please run again')
+
+
+def parse_arg():
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(
+                description='Script to export png files which are deferred in analysis')
+    parser.add_argument('report_directory', nargs=1, type=str)
+    parser.add_argument('--package', type=str, nargs='*', default=[],
+                        help='Package names (node analysis) to export png files')
+    parser.add_argument('--path', type=str, nargs='*', default=[],
+                        help='Target path names (path analysis) to export png files')
+    parser.add_argument('--png_workers', type=int, default=1,
+                        help='The number of web drivers to export png files concurrently')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    """Main function"""
+    args = parse_arg()
+
+    global _logger
+    if args.verbose:
+        _logger = utils.create_logger(__name__, logging.DEBUG)
+    else:
+        _logger = utils.create_logger(__name__, logging.INFO)
+
+    _logger.debug(f'report_directory: {args.report_directory[0]}')
+    _logger.debug(f'package: {args.package}')
+    _logger.debug(f'path: {args.path}')
+    _logger.debug(f'png_workers: {args.png_workers}')
+
+    render_png(args)
+    _logger.info('<<< OK. png files are exported >>>')
+
+
+if __name__ == '__main__':
+    main()
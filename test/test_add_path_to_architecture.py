@@ -0,0 +1,97 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import itertools
+import logging
+import types
+import pytest
+pytest.importorskip('caret_analyze')
+from analyze_path import add_path_to_architecture
+
+# /a branches to /b and /c (two topics to /b), and both of them reach /d
+_NODE_GRAPH = {
+    '/a': [('/t1', '/b'), ('/t1_alt', '/b'), ('/t2', '/c')],
+    '/b': [('/t3', '/d')],
+    '/c': [('/t4', '/d')],
+    '/d': [],
+    '/e': [],
+}
+
+
+class _FakeArchitecture:
+    """Architecture whose search_paths returns paths going through the nodes in node graph"""
+
+    def __init__(self):
+        self.search_list = []
+
+    def search_paths(self, *node_name_list, max_node_depth, node_filter, communication_filter):
+        self.search_list.append(list(node_name_list))
+        if node_name_list[0] == node_name_list[-1]:
+            return [types.SimpleNamespace(node_names=[node_name_list[0]], topic_names=[], summary='')]
+        topic_list_list = [[topic_name for topic_name, next_node_name in _NODE_GRAPH[node_name]
+                            if next_node_name == node_name_list[i + 1]]
+                           for i, node_name in enumerate(node_name_list[:-1])]
+        return [types.SimpleNamespace(node_names=list(node_name_list), topic_names=list(topic_list), summary='')
+                for topic_list in itertools.product(*topic_list_list)]
+
+
+@pytest.fixture(autouse=True)
+def _set_logger(monkeypatch):
+    monkeypatch.setattr(add_path_to_architecture, '_logger', logging.getLogger(__name__))
+
+
+def test_search_node_names_regex_branch():
+    assert add_path_to_architecture.search_node_names(_NODE_GRAPH, ['/a', '/(b|c)', '/d']) == \
+        [['/a', '/b', '/d'], ['/a', '/c', '/d']]
+    # Node name must match the whole regex
+    assert add_path_to_architecture.search_node_names(_NODE_GRAPH, ['/', '/b']) == []
+
+
+def test_search_node_names_topic():
+    assert add_path_to_architecture.search_node_names(_NODE_GRAPH, [['/a', '/t2'], '/.*', '/d']) == \
+        [['/a', '/c', '/d']]
+    # A node reached by two topics is visited once
+    assert add_path_to_architecture.search_node_names(_NODE_GRAPH, [['/a', '/t1.*'], '/b']) == [['/a', '/b']]
+
+
+def test_search_node_names_single_node():
+    assert add_path_to_architecture.search_node_names(_NODE_GRAPH, ['/e']) == [['/e']]
+    assert add_path_to_architecture.search_node_names(_NODE_GRAPH, ['/a', '/e']) == []
+
+
+def test_search_node_names_max_node_depth():
+    assert add_path_to_architecture.search_node_names(_NODE_GRAPH, ['/a', '/b', '/d'], 3) == [['/a', '/b', '/d']]
+    assert add_path_to_architecture.search_node_names(_NODE_GRAPH, ['/a', '/b', '/d'], 2) == []
+
+
+def test_find_path():
+    arch = _FakeArchitecture()
+    path_list = add_path_to_architecture.find_path(arch, _NODE_GRAPH, ['/a', '/(b|c)', '/d'])
+    assert arch.search_list == [['/a', '/b', '/d'], ['/a', '/c', '/d']]
+    assert [path.topic_names for path in path_list] == [['/t1', '/t3'], ['/t1_alt', '/t3'], ['/t2', '/t4']]
+
+    # Paths through other topics than JSON are excluded
+    path_list = add_path_to_architecture.find_path(arch, _NODE_GRAPH, [['/a', '/t1'], '/b', '/d'])
+    assert [path.topic_names for path in path_list] == [['/t1', '/t3']]
+
+
+def test_find_path_single_node():
+    arch = _FakeArchitecture()
+    path_list = add_path_to_architecture.find_path(arch, _NODE_GRAPH, ['/e'])
+    assert arch.search_list == [['/e', '/e']]
+    assert [path.node_names for path in path_list] == [['/e']]
+
+
+def test_find_path_not_found():
+    with pytest.raises(SystemExit):
+        add_path_to_architecture.find_path(_FakeArchitecture(), _NODE_GRAPH, ['/a', '/b', '/d'], 2)
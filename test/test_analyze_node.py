@@ -0,0 +1,73 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import types
+import numpy as np
+import pytest
+pytest.importorskip('caret_analyze')
+from analyze_node import analyze_node
+from common.catalog import Catalog
+from common.manifest import Manifest
+from common.results_db import ResultsDb
+
+
+def _analyze_node(node_name: str, callback_record_list: list[dict], dest_dir: str) -> dict:
+    """analyze_node which fails for '/fail' (in worker process)"""
+    if node_name == '/fail':
+        raise RuntimeError('failed in worker')
+    # Callbacks given to the node are returned in filename_timeseries to check them
+    return {'filename_timeseries': {'Frequency': [record['callback_name'] for record in callback_record_list]},
+            'callbacks': {}}
+
+
+def _make_callback_record(callback_name: str, node_name: str) -> dict:
+    return {'callback_name': callback_name, 'node_name': node_name,
+            'start_timestamps': np.array([0], dtype=np.int64), 'end_timestamps': np.array([1], dtype=np.int64)}
+
+
+def test_parallel_failed_node_is_not_cached(monkeypatch, tmp_path):
+    monkeypatch.setattr(analyze_node, '_logger', logging.getLogger(__name__))
+    monkeypatch.setattr(analyze_node, 'analyze_node', _analyze_node)
+    dest_dir = f'{tmp_path}/node'
+    manifest = Manifest(dest_dir, {}, True)
+    analyze_node.analyze_package_list_parallel({'package': ['/ok', '/fail']}, {}, dest_dir, 2, manifest)
+
+    assert list(manifest.entry_dict) == ['package//ok']
+    with ResultsDb(str(tmp_path)) as db:
+        assert list(db.load_node_stats('package')) == ['/ok']
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_analyze_with_callback_records(monkeypatch, tmp_path, jobs):
+    # Nodes are analyzed with cached callback records, without application (trace data)
+    monkeypatch.setattr(analyze_node, '_logger', logging.getLogger(__name__))
+    monkeypatch.setattr(analyze_node, 'analyze_node', _analyze_node)
+    trace_data = tmp_path / 'trace'
+    trace_data.mkdir()
+    (trace_data / 'metadata').write_bytes(b'trace')
+    args = types.SimpleNamespace(trace_data=[str(trace_data)], start_point=0.0, duration=0.0,
+                                 incremental=False, jobs=jobs)
+    arch = types.SimpleNamespace(export=lambda path, force: None)
+    callback_record_list = [_make_callback_record('/node_a/callback_0', '/node_a'),
+                            _make_callback_record('/node_b/callback_0', '/node_b'),
+                            _make_callback_record('/node_a/callback_1', '/node_a')]
+    catalog = Catalog({'package': '/node_'}, ['/node_b'])
+    dest_dir = f'{tmp_path}/node'
+    analyze_node.analyze(args, arch, callback_record_list, dest_dir, catalog)
+
+    # The catalog is not indexed, so nodes in records are analyzed
+    with ResultsDb(str(tmp_path)) as db:
+        stats = db.load_node_stats('package')
+    assert list(stats) == ['/node_a']
+    assert stats['/node_a']['filename_timeseries']['Frequency'] == ['/node_a/callback_0', '/node_a/callback_1']
@@ -0,0 +1,29 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import numpy as np
+import pytest
+pytest.importorskip('caret_analyze')
+from check_callback_sub import check_callback_sub
+from common.frequency import match_pubsub_freq
+
+
+def test_match_pubsub_freq_wrapper(monkeypatch):
+    # The wrapper outputs unmatched publishments with the module logger
+    monkeypatch.setattr(check_callback_sub, '_logger', logging.getLogger(__name__))
+    pub_freq = (np.array([0.0, 1.0, 5.0]), np.array([10.0, 11.0, 12.0]))
+    sub_freq = (np.array([0.1, 1.1, 1.2, 9.0]), np.array([20.0, 21.0, 22.0, 23.0]))
+    for expected_list, result_list in zip(match_pubsub_freq(pub_freq, sub_freq),
+                                          check_callback_sub.match_pubsub_freq(pub_freq, sub_freq)):
+        np.testing.assert_array_equal(result_list, expected_list)
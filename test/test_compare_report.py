@@ -0,0 +1,125 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import math
+import pytest
+pytest.importorskip('caret_analyze')
+pytest.importorskip('flask')
+from compare import compare_report
+
+
+def _make_entry(name: str, node_name: str, displayname: str, **values) -> dict:
+    return dict(values, name=name, key=(node_name, name), alt_key=('package', displayname))
+
+
+def test_align_entries():
+    entry_list_old = [
+        _make_entry('/a/callback_0', '/a', 'Timer_100ms'),
+        _make_entry('/b/callback_0', '/b', 'Sub_/topic'),     # renamed to /b_new
+        _make_entry('/c/callback_0', '/c', 'Sub_/ambiguous'),
+        _make_entry('/d/callback_0', '/d', 'Timer_10ms'),     # removed
+    ]
+    entry_list_new = [
+        _make_entry('/a/callback_0', '/a', 'Timer_100ms'),
+        _make_entry('/b_new/callback_0', '/b_new', 'Sub_/topic'),
+        # Two new entries have the same alt_key, so /c is not paired with either of them
+        _make_entry('/c1/callback_0', '/c1', 'Sub_/ambiguous'),
+        _make_entry('/c2/callback_0', '/c2', 'Sub_/ambiguous'),
+    ]
+    pair_list, removed_list, added_list = compare_report.align_entries(entry_list_old, entry_list_new)
+
+    assert [(old['name'], new['name']) for old, new in pair_list] == \
+        [('/a/callback_0', '/a/callback_0'), ('/b/callback_0', '/b_new/callback_0')]
+    assert [entry['name'] for entry in removed_list] == ['/c/callback_0', '/d/callback_0']
+    assert [entry['name'] for entry in added_list] == ['/c1/callback_0', '/c2/callback_0']
+
+
+def test_align_entries_without_alt_key():
+    entry_list_old = [{'name': '/path_0', 'key': ('/path_0', ), 'alt_key': None}]
+    entry_list_new = [{'name': '/path_1', 'key': ('/path_1', ), 'alt_key': None}]
+    pair_list, removed_list, added_list = compare_report.align_entries(entry_list_old, entry_list_new)
+    assert pair_list == [] and removed_list == entry_list_old and added_list == entry_list_new
+
+
+def test_calc_z_score():
+    assert compare_report.calc_z_score(10.0, 2.0, 4, 12.0, 2.0, 4) == pytest.approx(2.0 / math.sqrt(2.0))
+    # std 0: the difference is infinitely significant unless the means are the same
+    assert compare_report.calc_z_score(10.0, 0.0, 10, 10.0, 0.0, 10) == 0.0
+    assert compare_report.calc_z_score(10.0, 0.0, 10, 11.0, 0.0, 10) == math.inf
+    assert compare_report.calc_z_score(10.0, 0.0, 10, 9.0, 0.0, 10) == -math.inf
+    # Not calculated with less than 2 samples or without std
+    assert compare_report.calc_z_score(10.0, 1.0, 1, 20.0, 1.0, 10) is None
+    assert compare_report.calc_z_score(10.0, 1.0, 10, 20.0, 1.0, 0) is None
+    assert compare_report.calc_z_score(10.0, None, 10, 20.0, 1.0, 10) is None
+
+
+def _compare_callback(values_old: dict, values_new: dict, threshold_ratio=0.1, z_threshold=3.0) -> dict:
+    result_list = compare_report.compare_pair('callback', dict(values_old, name='/a/callback_0'),
+                                              dict(values_new, name='/a/callback_0'), threshold_ratio, z_threshold)
+    return {result['metrics']: result for result in result_list}
+
+
+def test_compare_pair_direction():
+    # Latency is worse when it's higher, and frequency is worse when it's lower
+    result_dict = _compare_callback({'Latency_p99': 10.0, 'Frequency_avg': 10.0},
+                                    {'Latency_p99': 12.0, 'Frequency_avg': 12.0})
+    assert result_dict['latency_p99']['worse_ratio'] == pytest.approx(0.2)
+    assert result_dict['latency_p99']['is_regression']
+    assert result_dict['frequency_avg']['worse_ratio'] == pytest.approx(-0.2)
+    assert not result_dict['frequency_avg']['is_regression']
+
+    result_dict = _compare_callback({'Latency_p99': 10.0, 'Frequency_avg': 10.0},
+                                    {'Latency_p99': 8.0, 'Frequency_avg': 8.0})
+    assert not result_dict['latency_p99']['is_regression']
+    assert result_dict['frequency_avg']['is_regression']
+    # Metrics without values are skipped
+    assert 'latency_avg' not in result_dict
+
+
+def test_compare_pair_threshold():
+    result_dict = _compare_callback({'Latency_p99': 10.0}, {'Latency_p99': 10.5})
+    assert not result_dict['latency_p99']['is_regression']
+    result_dict = _compare_callback({'Latency_p99': 10.0}, {'Latency_p99': 10.5}, threshold_ratio=0.01)
+    assert result_dict['latency_p99']['is_regression']
+    # Worse from 0
+    result_dict = _compare_callback({'Latency_p99': 0.0}, {'Latency_p99': 1.0})
+    assert result_dict['latency_p99']['worse_ratio'] == math.inf
+    assert result_dict['latency_p99']['is_regression']
+
+
+def test_compare_pair_significance():
+    # 20% worse, but not significant because of large std
+    values_old = {'Latency_avg': 10.0, 'Latency_std': 10.0, 'Latency_count': 10}
+    values_new = {'Latency_avg': 12.0, 'Latency_std': 10.0, 'Latency_count': 10}
+    result = _compare_callback(values_old, values_new)['latency_avg']
+    assert not result['is_significant'] and not result['is_regression']
+
+    # Significant with many samples
+    values_old['Latency_count'] = values_new['Latency_count'] = 10000
+    result = _compare_callback(values_old, values_new)['latency_avg']
+    assert result['z_score'] == pytest.approx(2.0 / math.sqrt(0.02))
+    assert result['is_significant'] and result['is_regression']
+
+    # Count < 2: z score is not calculated, and only the threshold is used
+    values_old['Latency_count'] = 1
+    result = _compare_callback(values_old, values_new)['latency_avg']
+    assert result['z_score'] is None
+    assert result['is_significant'] and result['is_regression']
+
+
+def test_check_report_dir(monkeypatch, tmp_path):
+    # Trace data (without results.db) is rejected
+    monkeypatch.setattr(compare_report, '_logger', logging.getLogger(__name__))
+    with pytest.raises(SystemExit):
+        compare_report.check_report_dir(str(tmp_path))
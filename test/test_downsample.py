@@ -0,0 +1,89 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+import pytest
+from bokeh.models import ColumnDataSource
+from bokeh.plotting import figure
+from common.downsample import downsample_lttb, downsample_figure
+
+
+@pytest.mark.parametrize('num_data, num_points', [(1000, 100), (1000, 3), (101, 100), (10, 5)])
+def test_downsample_lttb_indices(num_data, num_points):
+    rng = np.random.default_rng(0)
+    x_list = np.sort(rng.uniform(0, 100, num_data))
+    y_list = rng.normal(0, 1, num_data)
+    index_list = downsample_lttb(x_list, y_list, num_points)
+
+    assert len(index_list) == num_points
+    assert np.all(np.diff(index_list) > 0)
+    assert index_list[0] == 0 and index_list[-1] == num_data - 1
+
+
+def test_downsample_lttb_not_downsampled():
+    x_list = np.arange(10.0)
+    np.testing.assert_array_equal(downsample_lttb(x_list, x_list, 10), np.arange(10))
+    np.testing.assert_array_equal(downsample_lttb(x_list, x_list, 20), np.arange(10))
+    np.testing.assert_array_equal(downsample_lttb(x_list, x_list, 2), np.arange(10))
+
+
+@pytest.mark.parametrize('spike_index', [1, 500, 998])
+def test_downsample_lttb_spike(spike_index):
+    x_list = np.arange(1000.0)
+    y_list = np.ones(1000)
+    y_list[spike_index] = 100.0
+    assert spike_index in downsample_lttb(x_list, y_list, 20)
+
+
+def test_downsample_figure_nan_gap():
+    x_list = np.arange(1000.0)
+    y_list = np.sin(x_list / 50)
+    y_list[100:200] = np.nan
+    x_list[300] = np.nan
+    p_line = figure()
+    p_line.line(x_list, y_list)
+    downsample_figure(p_line, 50)
+
+    data = p_line.renderers[0].data_source.data
+    assert len(data['x']) == 50 and len(data['y']) == 50
+    assert np.all(np.isfinite(data['x'])) and np.all(np.isfinite(data['y']))
+    assert data['x'][0] == 0.0 and data['x'][-1] == 999.0
+
+
+def test_downsample_figure_shared_source():
+    # Line and markers on the same source keep the same points, and columns keep the same length
+    x_list = np.arange(1000.0)
+    source = ColumnDataSource({'x': x_list, 'y': np.cos(x_list / 30), 'label': x_list.astype(int).astype(str)})
+    p_graph = figure()
+    p_graph.line('x', 'y', source=source)
+    p_graph.circle('x', 'y', source=source)
+    downsample_figure(p_graph, 100)
+
+    data_line = p_graph.renderers[0].data_source.data
+    data_marker = p_graph.renderers[1].data_source.data
+    assert {len(column) for column in data_line.values()} == {100}
+    np.testing.assert_array_equal(data_line['x'], data_marker['x'])
+    np.testing.assert_array_equal(data_line['label'], np.asarray(data_line['x']).astype(int).astype(str))
+
+
+def test_downsample_figure_separate_source():
+    # Markers on their own source are downsampled, and short lines are not changed
+    x_list = np.arange(1000.0)
+    p_graph = figure()
+    p_graph.line(x_list[:50], x_list[:50])
+    p_graph.circle(x_list, np.sin(x_list))
+    downsample_figure(p_graph, 100)
+
+    assert len(p_graph.renderers[0].data_source.data['x']) == 50
+    data_marker = p_graph.renderers[1].data_source.data
+    assert len(data_marker['x']) == 100 and len(data_marker['y']) == 100
@@ -0,0 +1,169 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+import pytest
+from common.frequency import calc_frequency, match_pubsub_freq, FrequencyMemo
+
+
+def calc_frequency_reference(timestamps: np.ndarray) -> tuple[list[float], list[int]]:
+    """Loop for each timestamp which was used before calc_frequency (check_callback_sub)"""
+    timestamp_list = []
+    frequency_list = []
+    if len(timestamps) < 2:
+        return [], []
+    timestamp_series = np.sort(timestamps) * 1e-9
+    timestamp_series -= timestamp_series[0]
+    timestamp_start_1sec = timestamp_series[0]
+    timestamp_list.append(timestamp_start_1sec)
+    frequency_list.append(1)
+    for timestamp in timestamp_series:
+        if (timestamp - timestamp_start_1sec) < 1.0:
+            frequency_list[-1] += 1
+        else:
+            timestamp_start_1sec = timestamp
+            timestamp_list.append(timestamp_start_1sec)
+            frequency_list.append(1)
+    return timestamp_list, frequency_list
+
+
+def calc_sliding_frequency_reference(timestamps: np.ndarray, window_s: float,
+                                     step_s: float) -> tuple[list[float], list[float]]:
+    """Count timestamps in each window one by one"""
+    timestamps = np.sort(timestamps)
+    window_ns, step_ns = int(window_s * 1e9), int(step_s * 1e9)
+    timestamp_list, frequency_list = [], []
+    window_start = int(timestamps[0])
+    while window_start <= timestamps[-1]:
+        count = sum(1 for timestamp in timestamps if window_start <= timestamp < window_start + window_ns)
+        timestamp_list.append((window_start - int(timestamps[0])) * 1e-9)
+        frequency_list.append(count / window_s)
+        window_start += step_ns
+    return timestamp_list, frequency_list
+
+
+def _make_timestamps(rng: np.random.Generator, num: int) -> np.ndarray:
+    """Unsorted timestamps [nsec] with jitter and gaps longer than a window"""
+    period_list = rng.choice([10**7, 5 * 10**7, 3 * 10**9], num, p=[0.6, 0.39, 0.01])
+    timestamps = 10**12 + np.cumsum(period_list + rng.integers(-10**6, 10**6, num))
+    return rng.permutation(timestamps)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_calc_frequency_reference(seed):
+    timestamps = _make_timestamps(np.random.default_rng(seed), 2000)
+    timestamp_list, frequency_list = calc_frequency(timestamps)
+    expected_timestamp_list, expected_frequency_list = calc_frequency_reference(timestamps)
+    np.testing.assert_allclose(timestamp_list, expected_timestamp_list, atol=1e-9)
+    np.testing.assert_array_equal(frequency_list, expected_frequency_list)
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('window_s, step_s', [(1.0, 1.0), (1.0, 0.25), (0.5, 1.0)])
+def test_calc_frequency_sliding(seed, window_s, step_s):
+    timestamps = _make_timestamps(np.random.default_rng(seed), 500)
+    timestamp_list, frequency_list = calc_frequency(timestamps, window_s, step_s)
+    expected_timestamp_list, expected_frequency_list = calc_sliding_frequency_reference(timestamps, window_s, step_s)
+    np.testing.assert_allclose(timestamp_list, expected_timestamp_list, atol=1e-9)
+    np.testing.assert_array_equal(frequency_list, expected_frequency_list)
+    # Windows without timestamp are 0 Hz
+    assert window_s < step_s or np.count_nonzero(frequency_list == 0) > 0
+
+
+def test_calc_frequency_timer_bincount():
+    # Timer check counted calls in 1 second terms from the first call with bincount
+    timestamps = np.sort(_make_timestamps(np.random.default_rng(0), 1000))
+    _, frequency_list = calc_frequency(timestamps, 1.0, 1.0)
+    np.testing.assert_array_equal(frequency_list, np.bincount((timestamps - timestamps[0]) // 10**9))
+
+
+def test_calc_frequency_short():
+    for timestamps in [np.zeros(0, dtype=np.int64), np.array([10**9])]:
+        timestamp_list, frequency_list = calc_frequency(timestamps)
+        assert len(timestamp_list) == len(frequency_list) == 0
+
+
+def test_frequency_memo():
+    timestamps = _make_timestamps(np.random.default_rng(0), 100)
+    memo = FrequencyMemo()
+    frequency = memo.calc_frequency('/topic', ('pub', 0), timestamps)
+    assert memo.calc_frequency('/topic', ('pub', 0), np.zeros(0)) is frequency
+    memo.release('/topic')
+    assert len(memo.calc_frequency('/topic', ('pub', 0), np.zeros(0))[0]) == 0
+
+
+def match_pubsub_freq_reference(pub_freq, sub_freq, maximum_gap_time=1.0):
+    """Nested loop which was used before match_pubsub_freq is vectorized"""
+    timestamp_list = []
+    pub_freq_list = []
+    sub_freq_list = []
+    index_to_start_check = 0
+    for index_pub in range(len(pub_freq[0])):
+        pub_time = pub_freq[0][index_pub]
+        matched_sub_index = -1
+        for index_sub in range(index_to_start_check, len(sub_freq[0])):
+            gap_time = sub_freq[0][index_sub] - pub_time
+            if gap_time < 0:
+                continue
+            gap_time_next = sub_freq[0][index_sub + 1] - pub_time if index_sub < len(sub_freq[0]) - 1 else -1
+            if gap_time_next < 0:
+                break
+            if gap_time < gap_time_next and gap_time < maximum_gap_time:
+                matched_sub_index = index_sub
+                break
+        if matched_sub_index != -1:
+            index_to_start_check = matched_sub_index + 1
+            timestamp_list.append(pub_time)
+            pub_freq_list.append(pub_freq[1][index_pub])
+            sub_freq_list.append(sub_freq[1][matched_sub_index])
+    return timestamp_list, pub_freq_list, sub_freq_list
+
+
+def _make_freq(rng: np.random.Generator, num: int, drop_ratio: float) -> tuple[np.ndarray, np.ndarray]:
+    """Timestamps with random jitter and gaps (windows dropped), and frequency of each"""
+    timestamp_list = np.arange(num) + rng.uniform(-0.3, 0.3, num)
+    timestamp_list = np.sort(timestamp_list[rng.uniform(0, 1, num) >= drop_ratio])
+    return timestamp_list, rng.uniform(5, 15, len(timestamp_list))
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('drop_ratio', [0.0, 0.1, 0.5])
+def test_match_pubsub_freq_reference(seed, drop_ratio):
+    rng = np.random.default_rng(seed)
+    pub_freq = _make_freq(rng, 300, drop_ratio)
+    sub_freq = _make_freq(rng, 300, drop_ratio)
+    for maximum_gap_time in [0.5, 1.0]:
+        expected = match_pubsub_freq_reference(pub_freq, sub_freq, maximum_gap_time)
+        result = match_pubsub_freq(pub_freq, sub_freq, maximum_gap_time)
+        for expected_list, result_list in zip(expected, result):
+            np.testing.assert_array_equal(result_list, expected_list)
+
+
+def test_match_pubsub_freq_empty():
+    empty = (np.zeros(0), np.zeros(0))
+    freq = (np.array([0.0, 1.0, 2.0]), np.array([10.0, 10.0, 10.0]))
+    for pub_freq, sub_freq in [(empty, freq), (freq, empty), (freq, (freq[0][:1], freq[1][:1]))]:
+        result = match_pubsub_freq(pub_freq, sub_freq)
+        assert [len(result_list) for result_list in result] == [0, 0, 0]
+
+
+def test_match_pubsub_freq_duplicate_subscription():
+    # Subscriptions at the same timestamp are matched to different publishments one by one
+    # (the nested loop skipped the first one of them)
+    pub_freq = (np.array([0.4, 0.9, 0.95]), np.array([1.0, 2.0, 3.0]))
+    sub_freq = (np.array([0.5, 1.0, 1.0, 2.0, 3.0]), np.array([10.0, 20.0, 21.0, 30.0, 40.0]))
+    timestamp_list, pub_freq_list, sub_freq_list = match_pubsub_freq(pub_freq, sub_freq)
+    np.testing.assert_array_equal(timestamp_list, [0.4, 0.9, 0.95])
+    np.testing.assert_array_equal(pub_freq_list, [1.0, 2.0, 3.0])
+    np.testing.assert_array_equal(sub_freq_list, [10.0, 20.0, 21.0])
+    assert match_pubsub_freq_reference(pub_freq, sub_freq)[2] == [10.0, 21.0]
@@ -0,0 +1,85 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import types
+import pytest
+pytest.importorskip('caret_analyze')
+import make_report
+
+
+class _FakeCache:
+    """Cache which has records and architecture of the previous run"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def load(self, kind: str) -> list[dict]:
+        return [{'kind': kind}]
+
+    def load_architecture(self):
+        return types.SimpleNamespace(name='cached')
+
+
+def _setup(monkeypatch, is_path_analyzed: bool) -> dict:
+    """Replace analyses with fakes, and return what they are called with"""
+    called_dict = {'load_trace_data': 0}
+
+    def load_trace_data(args, event_filter):
+        called_dict['load_trace_data'] += 1
+        return 'lttng'
+
+    monkeypatch.setattr(make_report, '_logger', logging.getLogger(__name__))
+    monkeypatch.setattr(make_report, 'TraceCache', _FakeCache)
+    monkeypatch.setattr(make_report, 'load_trace_data', load_trace_data)
+    monkeypatch.setattr(make_report, 'make_catalog', lambda *args, **kwargs: 'catalog')
+    monkeypatch.setattr(make_report.analyze_node, 'analyze',
+                        lambda args, arch, record_list, dest_dir, catalog: called_dict.update(node=(arch, record_list)))
+    monkeypatch.setattr(make_report, 'check_callbacks',
+                        lambda args, communication_list, callback_list, report_dir, catalog:
+                        called_dict.update(callback=(communication_list, callback_list)))
+    monkeypatch.setattr(make_report.add_path_to_architecture, 'read_target_path_json', lambda path: [])
+    monkeypatch.setattr(make_report.add_path_to_architecture, 'add_path_to_architecture', lambda *args: None)
+    monkeypatch.setattr(make_report, 'Architecture', lambda kind, path: types.SimpleNamespace(name=kind))
+    monkeypatch.setattr(make_report, 'Application', lambda arch, lttng: (arch.name, lttng))
+    monkeypatch.setattr(make_report.shutil, 'copy', lambda src, dst: None)
+    monkeypatch.setattr(make_report.analyze_path, 'is_analyzed', lambda args, arch, dest_dir: is_path_analyzed)
+    monkeypatch.setattr(make_report.analyze_path, 'analyze',
+                        lambda args, arch, app, dest_dir: called_dict.update(path=app))
+    return called_dict
+
+
+def _make_args(tmp_path):
+    return types.SimpleNamespace(trace_data=[str(tmp_path / 'trace')], start_point=0.0, duration=0.0,
+                                 force=False, incremental=True, event_filter=False, cache_dir='cache',
+                                 target_path_json='', architecture_file_dst='architecture_path.yaml')
+
+
+def test_make_report_without_trace_data(monkeypatch, tmp_path):
+    called_dict = _setup(monkeypatch, True)
+    make_report.make_report(_make_args(tmp_path), str(tmp_path / 'report'))
+
+    assert called_dict['load_trace_data'] == 0
+    assert called_dict['node'][0].name == 'cached'
+    assert called_dict['node'][1] == [{'kind': 'callback'}]
+    assert called_dict['callback'] == ([{'kind': 'communication'}], [{'kind': 'callback'}])
+    assert called_dict['path'] is None
+
+
+def test_make_report_loads_trace_data_for_paths(monkeypatch, tmp_path):
+    called_dict = _setup(monkeypatch, False)
+    make_report.make_report(_make_args(tmp_path), str(tmp_path / 'report'))
+
+    assert called_dict['load_trace_data'] == 1
+    assert called_dict['node'][1] == [{'kind': 'callback'}]
+    assert called_dict['path'] == ('yaml', 'lttng')
@@ -0,0 +1,108 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+import pytest
+from common.node_metrics import calc_node_metrics
+from common.stats_accumulator import TimeBinAccumulator
+
+
+def calc_callback_metrics_reference(start_timestamps: np.ndarray, end_timestamps: np.ndarray,
+                                    window_ns: int) -> dict:
+    """Loop for each callback and each window"""
+    if len(start_timestamps) == 0:
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0))
+        return {'Frequency': empty, 'Period': empty, 'Latency': empty}
+    first = int(start_timestamps[0])
+    num_window = (int(start_timestamps[-1]) - first) // window_ns + 1
+    window_start_list, frequency_list = [], []
+    for index in range(num_window):
+        window_start = first + index * window_ns
+        count = sum(1 for timestamp in start_timestamps if window_start <= timestamp < window_start + window_ns)
+        window_start_list.append(window_start)
+        frequency_list.append(count / (window_ns * 1e-9))
+    return {
+        'Frequency': (np.array(window_start_list), np.array(frequency_list)),
+        'Period': (start_timestamps[1:], np.diff(start_timestamps) * 1e-6),
+        'Latency': (start_timestamps, (end_timestamps - start_timestamps) * 1e-6),
+    }
+
+
+def _make_callback_record_list(rng: np.random.Generator) -> list[dict]:
+    """Callbacks with different periods, a gap longer than a window, one call and no call"""
+    callback_record_list = []
+    for index, (num, period_ns) in enumerate([(300, 10**7), (100, 10**8), (50, 3 * 10**8), (1, 10**8), (0, 10**8)]):
+        start_timestamps = 10**12 + index * 12345 + np.cumsum(rng.integers(period_ns // 2, period_ns * 3 // 2, num))
+        if num > 10:
+            start_timestamps[num // 2:] += 3 * 10**9
+        end_timestamps = start_timestamps + rng.integers(10**5, 10**7, num)
+        callback_record_list.append({
+            'callback_name': f'/node/callback_{index}',
+            'callback_displayname': f'callback_{index}',
+            'start_timestamps': start_timestamps.astype(np.int64),
+            'end_timestamps': end_timestamps.astype(np.int64),
+        })
+    return callback_record_list
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('window_ns', [10**9, 3 * 10**8])
+def test_calc_node_metrics_reference(seed, window_ns):
+    callback_record_list = _make_callback_record_list(np.random.default_rng(seed))
+    metrics_list = calc_node_metrics(callback_record_list, window_ns)
+    assert len(metrics_list) == len(callback_record_list)
+    for record, metrics in zip(callback_record_list, metrics_list):
+        expected = calc_callback_metrics_reference(record['start_timestamps'], record['end_timestamps'], window_ns)
+        for key in ['Frequency', 'Period', 'Latency']:
+            np.testing.assert_array_equal(metrics[key][0], expected[key][0])
+            np.testing.assert_allclose(metrics[key][1], expected[key][1])
+    # Windows in the gap are 0 Hz
+    assert np.count_nonzero(metrics_list[0]['Frequency'][1] == 0) > 0
+
+
+def test_calc_node_metrics_stream():
+    # Frequency is the same as streaming mode, which adds timestamps chunk by chunk
+    callback_record_list = _make_callback_record_list(np.random.default_rng(0))
+    metrics_list = calc_node_metrics(callback_record_list)
+    for record, metrics in zip(callback_record_list, metrics_list):
+        time_bin = TimeBinAccumulator(10**9)
+        for start_timestamps in np.array_split(record['start_timestamps'], 4):
+            time_bin.add(start_timestamps)
+        np.testing.assert_array_equal(metrics['Frequency'][0], time_bin.window_start_list)
+        np.testing.assert_array_equal(metrics['Frequency'][1], time_bin.to_frequency()[1])
+
+
+def test_calc_node_metrics_empty():
+    assert calc_node_metrics([]) == []
+
+
+def test_analyze_node_trim_frequency(monkeypatch, tmp_path):
+    # The last 2 windows are removed only from frequency, because its last windows are not full
+    pytest.importorskip('caret_analyze')
+    from analyze_node import analyze_node
+    callback_record_list = _make_callback_record_list(np.random.default_rng(0))
+    data_dict = {}
+
+    def analyze_callback(callback_name, callback_displayname, metrics_str, data, metrics, dest_dir_path):
+        data_dict[(callback_name, metrics)] = data
+        return {}
+
+    monkeypatch.setattr(analyze_node, 'analyze_callback', analyze_callback)
+    monkeypatch.setattr(analyze_node.utils, 'export_graph', lambda *args, **kwargs: None)
+    analyze_node.analyze_node('/node', callback_record_list, str(tmp_path))
+
+    for record, metrics in zip(callback_record_list, calc_node_metrics(callback_record_list)):
+        callback_name = record['callback_name']
+        np.testing.assert_array_equal(data_dict[(callback_name, 'Frequency')], metrics['Frequency'][1][:-2])
+        np.testing.assert_array_equal(data_dict[(callback_name, 'Period')], metrics['Period'][1])
+        np.testing.assert_array_equal(data_dict[(callback_name, 'Latency')], metrics['Latency'][1])
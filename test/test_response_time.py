@@ -0,0 +1,182 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+import pandas as pd
+import pytest
+from common.response_time import extract_input_output, calc_response_time, find_worst_windows
+
+
+class _FakeRecord:
+    """Record of RecordsInterface"""
+
+    def __init__(self, data: dict):
+        self.data = data
+        self.columns = set(data.keys())
+
+    def get(self, column: str) -> int:
+        return self.data[column]
+
+
+class _FakeRecords:
+    """RecordsInterface whose dataframe has nullable integer columns (the same as caret_analyze)"""
+
+    def __init__(self, data_list: list[dict], columns: list[str]):
+        self.data = [_FakeRecord(data) for data in data_list]
+        self.columns = columns
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame({column: pd.array([record.data.get(column) for record in self.data], dtype='Int64')
+                             for column in self.columns})
+
+
+def _extract_input_output_loop(records) -> tuple[np.ndarray, np.ndarray]:
+    """Reference: extract timestamps record by record"""
+    input_column = records.columns[0]
+    output_column = records.columns[-1]
+    input_list = []
+    output_list = []
+    for data in records.data:
+        if input_column not in data.columns:
+            continue
+        input_list.append(data.get(input_column))
+        output_list.append(data.get(output_column) if output_column in data.columns else -1)
+    input_list = np.array(input_list, dtype=np.int64)
+    output_list = np.array(output_list, dtype=np.int64)
+    order = np.argsort(input_list, kind='stable')
+    return input_list[order], output_list[order]
+
+
+def _make_data_list(input_list: list[int], output_list: list[int]) -> list[dict]:
+    return [{'input': i, 'middle': i + 1, 'output': o} if o >= 0 else {'input': i, 'middle': i + 1}
+            for i, o in zip(input_list, output_list)]
+
+
+# Inputs 0 and 1 reach the same output, input 3 is dropped, and input 6 is after the last output
+_INPUT_LIST = np.array([0, 100, 200, 300, 400, 500, 600], dtype=np.int64)
+_OUTPUT_LIST = np.array([150, 150, 250, -1, 1000, 1000, -1], dtype=np.int64)
+
+
+def test_extract_input_output():
+    # Timestamps are larger than 2^53, so they must not be converted through float
+    base = 1_700_000_000_123_456_789
+    data_list = _make_data_list(base + _INPUT_LIST[::-1], np.where(_OUTPUT_LIST >= 0, base + _OUTPUT_LIST, -1)[::-1])
+    data_list.append({'middle': base})    # no input
+    records = _FakeRecords(data_list, ['input', 'middle', 'output'])
+    input_list, output_list = extract_input_output(records)
+
+    np.testing.assert_array_equal(input_list, base + _INPUT_LIST)
+    np.testing.assert_array_equal(output_list, np.where(_OUTPUT_LIST >= 0, base + _OUTPUT_LIST, -1))
+    for actual, expected in zip((input_list, output_list), _extract_input_output_loop(records)):
+        np.testing.assert_array_equal(actual, expected)
+
+
+def test_extract_input_output_random():
+    rng = np.random.default_rng(0)
+    input_list = rng.integers(0, 10**12, 1000)
+    output_list = np.where(rng.random(1000) < 0.2, -1, input_list + rng.integers(0, 10**9, 1000))
+    records = _FakeRecords(_make_data_list(input_list, output_list), ['input', 'middle', 'output'])
+    for actual, expected in zip(extract_input_output(records), _extract_input_output_loop(records)):
+        np.testing.assert_array_equal(actual, expected)
+
+
+def test_extract_input_output_empty():
+    input_list, output_list = extract_input_output(_FakeRecords([], ['input', 'output']))
+    assert len(input_list) == 0 and len(output_list) == 0
+
+
+def test_calc_response_time():
+    response_time = calc_response_time(_INPUT_LIST, _OUTPUT_LIST)
+    np.testing.assert_array_equal(response_time['input_min'], [0, 200, 300])
+    np.testing.assert_array_equal(response_time['input_max'], [100, 200, 500])
+    np.testing.assert_array_equal(response_time['output'], [150, 250, 1000])
+    np.testing.assert_array_equal(response_time['best'], [50, 50, 500])
+    np.testing.assert_array_equal(response_time['worst'], [150, 50, 700])
+    # Dropped input 3 is counted until the next output, and input 6 is excluded
+    np.testing.assert_array_equal(response_time['total'], [150, 50, 50, 700, 600, 500])
+
+
+def test_calc_response_time_duplicate_output():
+    # The latest input for the same output is used for the best case
+    response_time = calc_response_time(np.array([0, 10, 20, 30]), np.array([50, 50, 50, 60]))
+    np.testing.assert_array_equal(response_time['best'], [30, 30])
+    np.testing.assert_array_equal(response_time['worst'], [50, 30])
+    np.testing.assert_array_equal(response_time['total'], [50, 40, 30, 30])
+
+
+def test_calc_response_time_no_output():
+    response_time = calc_response_time(np.array([0, 10]), np.array([-1, -1]))
+    for key in ['input_min', 'input_max', 'output', 'best', 'worst', 'total']:
+        assert len(response_time[key]) == 0
+    assert find_worst_windows(np.array([0, 10]), np.array([-1, -1]), response_time, 3, 100) == []
+
+
+def _is_overlapped(window_list: list[dict]) -> bool:
+    return any(window_a['start'] < window_b['end'] and window_b['start'] < window_a['end']
+               for i, window_a in enumerate(window_list) for window_b in window_list[i + 1:])
+
+
+def test_find_worst_windows():
+    response_time = calc_response_time(_INPUT_LIST, _OUTPUT_LIST)
+
+    # The window of the worst group overlaps the drop window, so the next worst group is used
+    window_list = find_worst_windows(_INPUT_LIST, _OUTPUT_LIST, response_time, 2, 100)
+    assert window_list == [
+        {'kind': 'response_time', 'start': 0, 'end': 151, 'worst': 150, 'num_drop': 0},
+        {'kind': 'drop', 'start': 300, 'end': 400, 'worst': 0, 'num_drop': 1},
+    ]
+
+    # Windows of the longest response time come first, and the drop window is the last
+    window_list = find_worst_windows(_INPUT_LIST, _OUTPUT_LIST, response_time, 3, 100)
+    assert [(window['kind'], window['start'], window['end']) for window in window_list] == \
+        [('response_time', 0, 151), ('response_time', 175, 275), ('drop', 300, 400)]
+    assert not _is_overlapped(window_list)
+
+    # No drop window for one window
+    window_list = find_worst_windows(_INPUT_LIST, _OUTPUT_LIST, response_time, 1, 100)
+    assert window_list == [{'kind': 'response_time', 'start': 300, 'end': 1001, 'worst': 700, 'num_drop': 1}]
+
+
+def test_find_worst_windows_random():
+    rng = np.random.default_rng(1)
+    input_list = np.cumsum(rng.integers(1, 100, 2000))
+    output_list = np.maximum.accumulate(input_list + rng.integers(0, 500, 2000))
+    output_list[rng.random(2000) < 0.1] = -1
+    response_time = calc_response_time(input_list, output_list)
+    window_list = find_worst_windows(input_list, output_list, response_time, 5, 1000)
+
+    assert len(window_list) == 5
+    assert not _is_overlapped(window_list)
+    assert [window['kind'] for window in window_list] == ['response_time'] * 4 + ['drop']
+    worst_list = [window['worst'] for window in window_list[:-1]]
+    assert worst_list[0] == np.max(response_time['worst'])
+    assert all(window['end'] - window['start'] >= 1000 for window in window_list)
+
+
+def test_calc_response_time_caret():
+    # Best and worst case are the same as ResponseTime of caret_analyze
+    pytest.importorskip('caret_analyze')
+    from caret_analyze.experiment import ResponseTime
+    from caret_analyze.record.record_factory import RecordsFactory
+    rng = np.random.default_rng(2)
+    input_list = np.cumsum(rng.integers(1, 100, 500))
+    output_list = np.maximum.accumulate(input_list + rng.integers(0, 300, 500))
+    records = RecordsFactory.create_instance(_make_data_list(input_list.tolist(), output_list.tolist()),
+                                             ['input', 'middle', 'output'])
+    response_time = calc_response_time(*extract_input_output(records))
+
+    caret_response_time = ResponseTime(records)
+    np.testing.assert_array_equal(np.sort(response_time['best']),
+                                  np.sort(caret_response_time.to_best_case_timeseries()[1]))
+    np.testing.assert_array_equal(np.sort(response_time['worst']),
+                                  np.sort(caret_response_time.to_worst_case_timeseries()[1]))
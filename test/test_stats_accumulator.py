@@ -0,0 +1,66 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+import pytest
+from common.stats_accumulator import StatsAccumulator
+
+
+def _make_values_list() -> list[np.ndarray]:
+    """Chunks with different ranges, so that automatic bin widths are different"""
+    rng = np.random.default_rng(0)
+    return [rng.uniform(1000, 1000 + 649, 500),
+            rng.uniform(500, 500 + 455, 300),
+            rng.normal(10_000, 3000, 800),
+            rng.exponential(200, 50)]
+
+
+def test_auto_bin_width_is_power_of_2():
+    for values in _make_values_list():
+        accumulator = StatsAccumulator()
+        accumulator.add(values)
+        assert np.log2(accumulator.bin_width) == int(np.log2(accumulator.bin_width))
+
+
+def test_merge_different_ranges():
+    values_list = _make_values_list()
+    all_values = np.concatenate(values_list)
+    single = StatsAccumulator()
+    single.add(all_values)
+
+    merged = StatsAccumulator()
+    for values in values_list:
+        accumulator = StatsAccumulator()
+        accumulator.add(values)
+        merged.merge(accumulator)
+
+    assert merged.count == single.count == len(all_values)
+    assert merged.avg == pytest.approx(np.mean(all_values))
+    assert merged.std == pytest.approx(np.std(all_values, ddof=1))
+    assert merged.min == single.min == np.min(all_values)
+    assert merged.max == single.max == np.max(all_values)
+    for q in [0.5, 0.95, 0.99]:
+        assert merged.quantile(q) == single.quantile(q)
+        assert merged.quantile(q) == pytest.approx(np.quantile(all_values, q), rel=0.03)
+    hist, bin_edges = merged.to_histogram()
+    assert np.sum(hist) == len(all_values)
+    assert bin_edges[0] <= np.min(all_values) and np.max(all_values) < bin_edges[-1]
+
+
+def test_merge_empty():
+    accumulator = StatsAccumulator()
+    accumulator.add(np.array([1.0, 2.0, 3.0]))
+    accumulator.merge(StatsAccumulator())
+    empty = StatsAccumulator()
+    empty.merge(accumulator)
+    assert empty.to_stats() == accumulator.to_stats()
@@ -0,0 +1,94 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+import pytest
+from common.frequency import calc_frequency
+from common.timer_metrics import calc_timer_metrics
+
+
+def calc_timer_metrics_reference(start_timestamps: np.ndarray, period_ns: int, window_s: float, step_s: float,
+                                 gap_threshold_ratio: float) -> dict:
+    """Loop for each timer callback as check_callback_timer did before calc_timer_metrics"""
+    freq_timer = 1e9 / period_ns
+    timestamp_list, frequency_list = calc_frequency(start_timestamps, window_s, step_s)
+    freq_callback_list = frequency_list[:-2]
+    metrics = {
+        'timestamp_list': timestamp_list,
+        'frequency_list': frequency_list,
+        'freq_timer': freq_timer,
+        'freq_callback': float(np.mean(freq_callback_list)) if len(freq_callback_list) > 0 else None,
+        'num_window': len(freq_callback_list),
+        'num_huge_gap': int(np.count_nonzero(freq_callback_list <= freq_timer * (1 - gap_threshold_ratio))),
+        'period_error_avg': None,
+        'period_error_max': None,
+        'jitter': None,
+        'drift': None,
+    }
+    period_error_list = (np.diff(start_timestamps) - period_ns) * 1e-6
+    if len(period_error_list) > 0:
+        metrics['period_error_avg'] = float(np.mean(period_error_list))
+        metrics['period_error_max'] = float(np.max(np.abs(period_error_list)))
+    if len(period_error_list) > 1:
+        metrics['jitter'] = float(np.std(period_error_list, ddof=1))
+    if len(start_timestamps) > 2:
+        grid_index = 0
+        x_list, y_list = [], []
+        for index, timestamp in enumerate(start_timestamps):
+            if index > 0:
+                grid_index += round((timestamp - start_timestamps[index - 1]) / period_ns)
+            elapsed = int(timestamp - start_timestamps[0])
+            x_list.append(elapsed * 1e-9)
+            y_list.append((elapsed - grid_index * period_ns) * 1e-6)
+        metrics['drift'] = float(np.polyfit(x_list, y_list, 1)[0])
+    return metrics
+
+
+def _make_timer_list(rng: np.random.Generator) -> tuple[list[np.ndarray], list[int]]:
+    """Timers with jitter, drift, skipped calls, a stop longer than a window, few calls and no call"""
+    start_timestamps_list, period_ns_list = [], []
+    for index, (num, period_ns) in enumerate([(500, 10**7), (200, 10**8), (100, 3 * 10**7), (2, 10**8),
+                                              (1, 10**8), (0, 10**8)]):
+        period_list = np.full(num, period_ns) + rng.integers(-period_ns // 10, period_ns // 10, num) + index * 1000
+        if num > 10:
+            period_list[rng.choice(num, num // 20, replace=False)] += period_ns    # skipped calls
+            period_list[num // 2] += 3 * 10**9    # 0 Hz windows
+        start_timestamps_list.append((10**12 + index * 12345 + np.cumsum(period_list)).astype(np.int64))
+        period_ns_list.append(period_ns)
+    return start_timestamps_list, period_ns_list
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('window_s, step_s', [(1.0, 1.0), (1.0, 0.5), (0.5, 1.0)])
+def test_calc_timer_metrics_reference(seed, window_s, step_s):
+    start_timestamps_list, period_ns_list = _make_timer_list(np.random.default_rng(seed))
+    metrics_list = calc_timer_metrics(start_timestamps_list, period_ns_list, window_s, step_s, 0.2)
+    assert len(metrics_list) == len(start_timestamps_list)
+    for start_timestamps, period_ns, metrics in zip(start_timestamps_list, period_ns_list, metrics_list):
+        expected = calc_timer_metrics_reference(start_timestamps, period_ns, window_s, step_s, 0.2)
+        np.testing.assert_allclose(metrics['timestamp_list'], expected['timestamp_list'], atol=1e-9)
+        np.testing.assert_array_equal(metrics['frequency_list'], expected['frequency_list'])
+        for key in ['freq_timer', 'num_window', 'num_huge_gap']:
+            assert metrics[key] == expected[key], key
+        for key in ['freq_callback', 'period_error_avg', 'period_error_max', 'jitter', 'drift']:
+            if expected[key] is None:
+                assert metrics[key] is None, key
+            else:
+                assert metrics[key] == pytest.approx(expected[key], rel=1e-6, abs=1e-9), key
+    # Windows while the timer is stopped are 0 Hz and counted as huge gap
+    assert np.count_nonzero(metrics_list[0]['frequency_list'] == 0) > 0
+    assert metrics_list[0]['num_huge_gap'] > 0
+
+
+def test_calc_timer_metrics_empty():
+    assert calc_timer_metrics([], []) == []
@@ -0,0 +1,146 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import types
+import numpy as np
+import pandas as pd
+import pytest
+pytest.importorskip('caret_analyze')
+from common.catalog import Catalog
+from common.trace_cache import TraceCache, extract_callback_records, extract_communication_records
+
+
+class _FakeEntity:
+    """Callback, publisher or subscription which counts to_dataframe calls"""
+
+    def __init__(self, column_dict: dict, **kwargs):
+        self.column_dict = column_dict
+        self.call_count = 0
+        self.__dict__.update(kwargs)
+
+    def to_dataframe(self):
+        self.call_count += 1
+        return pd.DataFrame(self.column_dict)
+
+
+def _make_callback(callback_name: str, node_name: str, callback_type: str, timestamps: list[int]):
+    return _FakeEntity({f'{callback_name}/callback_start_timestamp': timestamps,
+                        f'{callback_name}/callback_end_timestamp': [t + 1 for t in timestamps]},
+                       callback_name=callback_name, node_name=node_name,
+                       callback_type=types.SimpleNamespace(type_name=callback_type),
+                       timer=types.SimpleNamespace(period_ns=100_000_000), subscribe_topic_name='/topic_a')
+
+
+def _make_fake_trace():
+    timer = _make_callback('/node_a/callback_0', '/node_a', 'timer_callback', [10, 20])
+    sub_b = _make_callback('/node_b/callback_0', '/node_b', 'subscription_callback', [11, 21])
+    sub_c = _make_callback('/node_c/callback_0', '/node_c', 'subscription_callback', [12])
+    sub_d = _make_callback('/node_d/callback_0', '/node_d', 'subscription_callback', [])
+    publisher_a = _FakeEntity({'/topic_a/rclcpp_publish_timestamp': [9, 19]})
+    publisher_d = _FakeEntity({'/topic_d/rclcpp_publish_timestamp': []})
+
+    def _make_communication(topic_name, publisher, callback):
+        return types.SimpleNamespace(topic_name=topic_name, publish_node_name='/node_a',
+                                     subscribe_node_name=callback.node_name, subscribe_callback_name=callback.callback_name,
+                                     publisher=publisher, subscription=callback, callback_subscription=callback)
+
+    communication_list = [_make_communication('/topic_a', publisher_a, sub_b),
+                          _make_communication('/topic_a', publisher_a, sub_c),
+                          _make_communication('/topic_d', publisher_d, sub_d)]
+    app = types.SimpleNamespace(callbacks=[timer, sub_b, sub_c, sub_d], communications=communication_list)
+    arch = types.SimpleNamespace(communications=communication_list)
+    topic_count = pd.DataFrame({'size': [2]}, index=['/topic_a'])
+    lttng = types.SimpleNamespace(get_nodes=lambda: [types.SimpleNamespace(node_name=name)
+                                                     for name in ['/node_a', '/node_b', '/node_c', '/node_d']],
+                                  get_count=lambda groupby: topic_count)
+    return lttng, arch, app
+
+
+def _make_catalog(lttng, arch, app) -> Catalog:
+    catalog = Catalog({'package_a': '/node_a', 'package_b': '/node_[bcd]'}, ['/node_c/'])
+    catalog.index(lttng, arch, app)
+    return catalog
+
+
+def test_catalog_index(tmp_path):
+    lttng, arch, app = _make_fake_trace()
+    catalog = _make_catalog(lttng, arch, app)
+
+    timer_list = catalog.get_callback_list('timer_callback')
+    assert [callback['callback_name'] for callback in timer_list] == ['/node_a/callback_0']
+    assert timer_list[0]['package_name'] == 'package_a'
+    assert timer_list[0]['callback_displayname'] == 'Timer_100.0ms'
+    assert len(catalog.get_callback_list()) == 4
+    assert catalog.callback_dict['/node_c/callback_0']['is_ignored']
+    # /topic_d is not in trace data
+    assert [(communication['subscribe_node_name'], communication['is_ignored'])
+            for communication in catalog.communication_list] == [('/node_b', False), ('/node_c', True)]
+
+    catalog.save(str(tmp_path))
+    loaded = Catalog.load(str(tmp_path), catalog.package_dict, catalog.ignore_list, catalog.inputs)
+    assert loaded.callback_dict == catalog.callback_dict
+    assert loaded.communication_list == catalog.communication_list
+
+
+def test_extract_callback_records_in_catalog():
+    lttng, arch, app = _make_fake_trace()
+    catalog = _make_catalog(lttng, arch, app)
+
+    record_list = extract_callback_records(app, None, catalog.get_callback_list('timer_callback'))
+    assert [record['callback_name'] for record in record_list] == ['/node_a/callback_0']
+    assert 'package_name' not in record_list[0] and 'is_ignored' not in record_list[0]
+    np.testing.assert_array_equal(record_list[0]['start_timestamps'], [10, 20])
+    np.testing.assert_array_equal(record_list[0]['end_timestamps'], [11, 21])
+    # Data of the other callbacks is not extracted
+    assert [callback.call_count for callback in app.callbacks] == [1, 0, 0, 0]
+
+    # Records made with and without the catalog are the same
+    all_list = extract_callback_records(app)
+    assert [record['callback_name'] for record in all_list] == \
+        [record['callback_name'] for record in extract_callback_records(app, None, catalog.get_callback_list())]
+    assert all_list[0]['callback_displayname'] == record_list[0]['callback_displayname']
+
+
+def test_extract_communication_records_in_catalog():
+    lttng, arch, app = _make_fake_trace()
+    catalog = _make_catalog(lttng, arch, app)
+
+    record_list = extract_communication_records(app, None, catalog.communication_list)
+    assert [(record['topic_name'], record['subscribe_node_name']) for record in record_list] == \
+        [('/topic_a', '/node_b'), ('/topic_a', '/node_c')]
+    np.testing.assert_array_equal(record_list[1]['pub_timestamps'], [9, 19])
+    np.testing.assert_array_equal(record_list[1]['sub_timestamps'], [12])
+    assert record_list[0]['callback_displayname'] == 'Sub_/topic_a'
+    # Publisher is shared by communications of the topic, and /topic_d is not extracted
+    assert app.communications[0].publisher.call_count == 1
+    assert app.communications[2].publisher.call_count == 0
+
+    # Without the catalog (streaming mode), communications without any event are skipped
+    record_list = extract_communication_records(app)
+    assert [record['subscribe_node_name'] for record in record_list] == ['/node_b', '/node_c']
+
+
+def test_cache_round_trip(tmp_path):
+    lttng, arch, app = _make_fake_trace()
+    trace_data = tmp_path / 'trace'
+    trace_data.mkdir()
+    (trace_data / 'metadata').write_bytes(b'trace')
+    cache = TraceCache(str(tmp_path / 'cache'), str(trace_data), 0, 0)
+    record_list = extract_callback_records(app)
+    cache.save('callback', record_list)
+
+    loaded_list = cache.load('callback')
+    assert [record['callback_name'] for record in loaded_list] == [record['callback_name'] for record in record_list]
+    for loaded, record in zip(loaded_list, record_list):
+        np.testing.assert_array_equal(loaded['start_timestamps'], record['start_timestamps'])
+        assert loaded['period_ns'] == record['period_ns']
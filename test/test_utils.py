@@ -0,0 +1,55 @@
+# Copyright 2022 Tier IV, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import argparse
+import pytest
+pytest.importorskip('caret_analyze')
+from common import utils, results_db, profiler
+
+
+def test_add_common_arguments():
+    parser = argparse.ArgumentParser()
+    utils.add_common_arguments(parser)
+    args = parser.parse_args([])
+    assert vars(args) == {'cache_dir': 'caret_report_cache', 'html': 'standalone', 'png': 'immediate',
+                          'png_workers': 0, 'max_points': 10000, 'export_yaml': False,
+                          'profile': False, 'profile_cprofile': 0}
+
+    parser = argparse.ArgumentParser()
+    utils.add_common_arguments(parser, use_cache=False)
+    assert 'cache_dir' not in vars(parser.parse_args([]))
+
+
+def test_apply_common_arguments(monkeypatch, tmp_path):
+    called_dict = {}
+    monkeypatch.setattr(utils, 'set_png_mode', lambda png_mode: called_dict.update(png=png_mode))
+    monkeypatch.setattr(utils, 'set_html_mode', lambda html_mode: called_dict.update(html=html_mode))
+    monkeypatch.setattr(utils, 'set_max_points', lambda max_points: called_dict.update(max_points=max_points))
+    monkeypatch.setattr(results_db, 'set_export_yaml', lambda export_yaml: called_dict.update(export_yaml=export_yaml))
+    monkeypatch.setattr(utils, 'start_png_renderer',
+                        lambda num_workers, logger: called_dict.update(png_workers=num_workers))
+    monkeypatch.setattr(profiler, 'start_profile',
+                        lambda script_name, report_dir, num_cprofile: called_dict.update(
+                            profile=(script_name, report_dir, num_cprofile)))
+
+    parser = argparse.ArgumentParser()
+    utils.add_common_arguments(parser)
+    args = parser.parse_args(['--html', 'bundle', '--png', 'deferred', '--png_workers', '2',
+                              '--max_points', '100', '--export_yaml'])
+    utils.apply_common_arguments(args, 'script', str(tmp_path))
+    assert called_dict == {'png': 'deferred', 'html': 'bundle', 'max_points': 100, 'export_yaml': True,
+                           'png_workers': 2}
+
+    args = parser.parse_args(['--profile', '--profile_cprofile', '5'])
+    utils.apply_common_arguments(args, 'script', str(tmp_path))
+    assert called_dict['profile'] == ('script', str(tmp_path), 5)
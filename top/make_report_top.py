@@ -16,16 +16,20 @@ Script to make report page
 """
 from __future__ import annotations
 import os
+import sys
 import argparse
 from pathlib import Path
-import yaml
 import flask
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+from common import profiler
+from common.results_db import ResultsDb
 
 app = flask.Flask(__name__)
 
 
+@profiler.stage_function('render_page')
 def render_page(destination_path, template_path, report_name, package_list, stats_node_dict,
-                stats_path, stats_cb_sub_warn, stats_cb_timer_warn):
+                stats_path, stats_cb_sub_warn, stats_cb_timer_warn, topk_key, profile_list):
     """Render html page"""
     with app.app_context():
         with open(template_path, 'r', encoding='utf-8') as f_html:
@@ -38,92 +42,64 @@ def render_page(destination_path, template_path, report_name, package_list, stat
                 stats_path=stats_path,
                 stats_cb_sub_warn=stats_cb_sub_warn,
                 stats_cb_timer_warn=stats_cb_timer_warn,
+                topk_key=topk_key,
+                profile_list=profile_list,
             )
 
         with open(destination_path, 'w', encoding='utf-8') as f_html:
             f_html.write(rendered)
 
 
-def get_package_list(report_dir: str) -> list[str]:
-    """Create package name list in node analysis"""
-    package_list = os.listdir(report_dir + '/node')
-    package_list = [f for f in package_list if os.path.isdir(os.path.join(report_dir + '/node', f))]
-    package_list.sort()
-    return package_list
-
-
-def get_stats_node(report_dir: str) -> dict:
-    """Read stats"""
-    stats_dict = {}
-    package_list = get_package_list(report_dir)
-    for package_name in package_list:
-        with open(report_dir + '/node/' + package_name + '/stats_node.yaml', 'r', encoding='utf-8') as f_yaml:
-            stats = yaml.safe_load(f_yaml)
-            stats_dict[package_name] = stats
-    return stats_dict
-
-
-def get_stats_path(report_dir: str):
-    """Read stats"""
-    with open(report_dir + '/path/stats_path.yaml', 'r', encoding='utf-8') as f_yaml:
-        stats = yaml.safe_load(f_yaml)
-    return stats
-
-
-def get_stats_callback_subscription(report_dir: str):
-    """Read stats"""
-    with open(report_dir + '/check_callback_sub/stats_callback_subscription.yaml', 'r', encoding='utf-8') as f_yaml:
-        stats = yaml.safe_load(f_yaml)
-    with open(report_dir + '/check_callback_sub/stats_callback_subscription_warning.yaml', 'r', encoding='utf-8') as f_yaml:
-        stats_warn = yaml.safe_load(f_yaml)
-    return stats, stats_warn
-
-
-def get_stats_callback_timer(report_dir: str):
-    """Read stats"""
-    with open(report_dir + '/check_callback_timer/stats_callback_timer.yaml', 'r', encoding='utf-8') as f_yaml:
-        stats = yaml.safe_load(f_yaml)
-    with open(report_dir + '/check_callback_timer/stats_callback_timer_warning.yaml', 'r', encoding='utf-8') as f_yaml:
-        stats_warn = yaml.safe_load(f_yaml)
-    return stats, stats_warn
-
-
-def find_latency_topk(package_name, stats_node, numk=20) -> None:
-    """Find callback functions whose latency time is the longest(top5), and add this information into stats"""
+def make_latency_topk(db: ResultsDb, package_name: str, numk=20, sort_key='avg') -> list[dict]:
+    """Find numk callback functions whose latency time (sort_key: avg or p99) is the longest"""
     callback_latency_list = []
-    for node_name, node_info in stats_node.items():
-        callbacks = node_info['callbacks']
-        for _, callback_info in callbacks.items():
-            callback_latency_list.append({
-                'link': 'node/' + package_name + '/index.html#' + node_name,
-                'displayname': flask.Markup(node_name + '<br>' + callback_info['displayname']),
-                'avg': callback_info['Latency']['avg'] if isinstance(callback_info['Latency']['avg'], (int, float)) else 0,
-                'min': callback_info['Latency']['min'] if isinstance(callback_info['Latency']['min'], (int, float)) else 0,
-                'max': callback_info['Latency']['max'] if isinstance(callback_info['Latency']['max'], (int, float)) else 0,
-            })
-
-    callback_latency_list = sorted(callback_latency_list, reverse=True, key=lambda x: x['avg'])
-    callback_latency_list = callback_latency_list[:numk]
-    stats_node['latency_topk'] = callback_latency_list
-
-
-def make_report(report_dir: str, index_filename: str='index'):
+    for row in db.get_latency_topk(package_name, numk, sort_key):
+        callback_latency_list.append({
+            'link': 'node/' + package_name + '/index.html#' + row['node_name'],
+            'displayname': flask.Markup(row['node_name'] + '<br>' + row['displayname']),
+            'avg': row['avg'] if isinstance(row['avg'], (int, float)) else 0,
+            'min': row['min'] if isinstance(row['min'], (int, float)) else 0,
+            'max': row['max'] if isinstance(row['max'], (int, float)) else 0,
+            'p99': row['p99'] if isinstance(row['p99'], (int, float)) else 0,
+        })
+    return callback_latency_list
+
+
+def make_profile_list(report_dir: str, numk=10) -> list[dict]:
+    """Make summary of profile.json (stages sorted by wall time, and the slowest items(top k)) for each script"""
+    profile_list = []
+    for script_name, profile in profiler.load_profile(report_dir).items():
+        wall_time = profile['wall_time']
+        profile_list.append({
+            'script_name': script_name,
+            'date': profile['date'],
+            'wall_time': wall_time,
+            'cpu_time': profile['cpu_time'],
+            'peak_rss_mb': profile['peak_rss_mb'],
+            'stage_list': [dict(stage, ratio=stage['wall_time'] / wall_time * 100 if wall_time > 0 else 0)
+                           for stage in profile['stage_list']],
+            'item_list': profile['item_list'][:numk],
+        })
+    return profile_list
+
+
+def make_report(report_dir: str, index_filename: str='index', topk_key: str='avg'):
     """Make report page"""
     report_name = report_dir.split('/')[-1]
 
-    package_list = get_package_list(report_dir)
-    stats_node_dict = get_stats_node(report_dir)
-    for package_name in package_list:
-        find_latency_topk(package_name, stats_node_dict[package_name])
-
-    stats_path = get_stats_path(report_dir)
-    _, stats_cb_sub_warn = get_stats_callback_subscription(report_dir)
-    _, stats_cb_timer_warn = get_stats_callback_timer(report_dir)
+    with ResultsDb(report_dir) as db:
+        package_list = db.get_package_list()
+        stats_node_dict = {package_name: {'latency_topk': make_latency_topk(db, package_name, sort_key=topk_key)}
+                           for package_name in package_list}
+        stats_path = db.load_path_stats()
+        stats_cb_sub_warn = db.load_communication_stats(warning_only=True)
+        stats_cb_timer_warn = db.load_timer_stats(warning_only=True)
+    profile_list = make_profile_list(report_dir)
 
     destination_path = f'{report_dir}/{index_filename}.html'
     template_path = f'{Path(__file__).resolve().parent}/template_report_top.html'
     render_page(destination_path, template_path, report_name, package_list, stats_node_dict,
-                stats_path, stats_cb_sub_warn, stats_cb_timer_warn)
+                stats_path, stats_cb_sub_warn, stats_cb_timer_warn, topk_key, profile_list)
 
 
 def parse_arg():
@@ -131,6 +107,8 @@ def parse_arg():
     parser = argparse.ArgumentParser(
                 description='Script to make report page')
     parser.add_argument('report_directory', nargs=1, type=str)
+    parser.add_argument('--topk_key', type=str, default='avg', choices=['avg', 'p99'],
+                        help='Latency stats to sort callbacks in Top k list')
     args = parser.parse_args()
     return args
 
@@ -139,7 +117,7 @@ def main():
     """Main function"""
     args = parse_arg()
     report_dir = str(Path(args.report_directory[0]))
-    make_report(report_dir, 'index')
+    make_report(report_dir, 'index', args.topk_key)
     print('<<< OK. report page is created >>>')
 
 